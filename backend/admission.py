@@ -0,0 +1,287 @@
+"""
+Admission control for the Gemini-bound endpoints.
+
+At most ADMISSION_MAX_CONCURRENT analyses run at once per worker. Requests
+beyond that wait in one of three lanes (interactive, batch, background).
+Freed slots go to lanes in proportion to their weights, and within a lane
+to client keys in turn, so one script flooding the batch lane delays
+neither the web UI nor other scripts much.
+
+Each request has a deadline. A request whose estimated queue wait plus
+service time exceeds it gets 503 with Retry-After right away, and one
+still queued when it can no longer finish in time is dropped the same
+way, so no Gemini call is made for an answer nobody will receive.
+"""
+import asyncio
+import json
+import math
+import os
+import re
+import time
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, Hashable, Optional
+
+from pydantic import BaseModel
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+# Analyses running at once per worker process; 0 admits everything immediately
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "32"))
+
+# Seconds an analysis is assumed to take until real ones have been timed
+ADMISSION_SERVICE_TIME = float(os.getenv("ADMISSION_SERVICE_TIME", "3"))
+
+# Weight of the newest duration in the moving average of service times
+SERVICE_TIME_ALPHA = 0.1
+
+# Requests that go through admission: the endpoints that call Gemini
+ADMITTED_PATHS = re.compile(r"^/(analyze|analyze-with-overlay|analyze-multi|analyze-sequence|image-sessions/[^/]+/analyze)$")
+
+class LaneConfig(BaseModel):
+    """Scheduling settings for one priority lane"""
+    weight: float  # Share of freed slots relative to the other lanes with waiting requests
+    deadline: float  # Seconds a request may take, queueing included, unless it sends X-Request-Deadline
+
+DEFAULT_LANES = {
+    "interactive": LaneConfig(weight=8, deadline=30),
+    "batch": LaneConfig(weight=2, deadline=300),
+    "background": LaneConfig(weight=1, deadline=3600),
+}
+
+def load_lanes() -> Dict[str, LaneConfig]:
+    """Default lanes, overridden per lane by the ADMISSION_LANES JSON env var"""
+    lanes = dict(DEFAULT_LANES)
+    overrides = os.getenv("ADMISSION_LANES")
+    if overrides:
+        for lane, settings in json.loads(overrides).items():
+            base = lanes[lane].model_dump() if lane in lanes else {}
+            lanes[lane] = LaneConfig(**{**base, **settings})
+    return lanes
+
+class Overloaded(Exception):
+    """A request shed because it would not finish before its deadline"""
+
+    def __init__(self, retry_after: float, reason: str):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+class FairQueue:
+    """
+    FIFO queues per key, served by stride scheduling.
+
+    Each pop takes from the non-empty queue whose pass is lowest and
+    advances that pass by 1/weight, so backlogged keys are served in
+    proportion to their weights. A key that was idle starts at the current
+    virtual time instead of cashing in service it did not use.
+    """
+
+    def __init__(self):
+        self._queues: Dict[Hashable, Deque[Any]] = {}
+        self._pass: Dict[Hashable, float] = {}
+        self._weights: Dict[Hashable, float] = {}
+        self._virtual_time = 0.0
+        self._length = 0
+
+    def __len__(self) -> int:
+        return self._length
+
+    def push(self, key: Hashable, item: Any, weight: float = 1.0):
+        if key not in self._queues:
+            self._queues[key] = deque()
+            self._pass[key] = self._virtual_time
+        self._queues[key].append(item)
+        self._weights[key] = weight
+        self._length += 1
+
+    def pop(self) -> Any:
+        key = min(self._queues, key=self._pass.__getitem__)
+        queue = self._queues[key]
+        item = queue.popleft()
+        self._virtual_time = self._pass[key]
+        self._pass[key] += 1 / self._weights[key]
+        if not queue:
+            self._forget(key)
+        self._length -= 1
+        return item
+
+    def remove(self, key: Hashable, item: Any) -> bool:
+        queue = self._queues.get(key)
+        if queue is None or item not in queue:
+            return False
+        queue.remove(item)
+        if not queue:
+            self._forget(key)
+        self._length -= 1
+        return True
+
+    def _forget(self, key: Hashable):
+        del self._queues[key], self._pass[key], self._weights[key]
+
+    def lengths(self) -> Dict[Hashable, int]:
+        return {key: len(queue) for key, queue in self._queues.items()}
+
+class AdmissionScheduler:
+    """Slots for concurrent analyses, handed out by weighted fair queuing over lanes and then client keys"""
+
+    def __init__(
+        self, max_concurrent: int = ADMISSION_MAX_CONCURRENT, lanes: Optional[Dict[str, LaneConfig]] = None,
+        service_time: float = ADMISSION_SERVICE_TIME
+    ):
+        self.max_concurrent = max_concurrent
+        self.lanes = lanes if lanes is not None else load_lanes()
+        self.service_time = service_time
+        self.in_flight = 0
+        # One token per waiter in _lanes picks the lane; the lane's queue then picks the client
+        self._lanes = FairQueue()
+        self._clients = {lane: FairQueue() for lane in self.lanes}
+        self._stats = {lane: {"admitted": 0, "shed": 0, "expired": 0, "wait_seconds": 0.0} for lane in self.lanes}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_concurrent > 0
+
+    def estimate_wait(self, lane: str, client: str) -> float:
+        """Seconds a request joining now would wait for a slot, if the queues stay as they are"""
+        if self.in_flight < self.max_concurrent and not len(self._lanes):
+            return 0.0
+        # Requests of the lane served before it: up to its own position from every client's queue
+        lengths = self._clients[lane].lengths()
+        position = lengths.get(client, 0) + 1
+        lane_ahead = sum(min(length, position) for name, length in lengths.items() if name != client) + position
+        # The lane gets its weight's share of slots among the lanes with waiting requests
+        waiting = {name for name, queue in self._clients.items() if len(queue)} | {lane}
+        share = self.lanes[lane].weight / sum(self.lanes[name].weight for name in waiting)
+        return lane_ahead / share * self.service_time / self.max_concurrent
+
+    async def acquire(self, lane: str, client: str, deadline: float):
+        """
+        Wait for a slot; release() must follow once the request is done.
+
+        Raises:
+            Overloaded: the request cannot start early enough to finish within deadline seconds
+        """
+        stats = self._stats[lane]
+        if self.in_flight < self.max_concurrent and not len(self._lanes):
+            self.in_flight += 1
+            stats["admitted"] += 1
+            return
+
+        wait = self.estimate_wait(lane, client)
+        budget = deadline - self.service_time
+        if wait > budget:
+            stats["shed"] += 1
+            raise Overloaded(wait, f"Estimated queue wait {wait:.1f}s leaves no time to finish within {deadline:.0f}s")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._lanes.push(lane, lane, self.lanes[lane].weight)
+        self._clients[lane].push(client, waiter)
+        queued_at = time.monotonic()
+        try:
+            await asyncio.wait({waiter}, timeout=max(budget, 0))
+        except asyncio.CancelledError:
+            self._withdraw(lane, client, waiter)
+            raise
+        if not waiter.done():
+            self._withdraw(lane, client, waiter)
+            stats["expired"] += 1
+            raise Overloaded(self.estimate_wait(lane, client), f"Queued {time.monotonic() - queued_at:.1f}s without a slot")
+        stats["admitted"] += 1
+        stats["wait_seconds"] += time.monotonic() - queued_at
+
+    def _withdraw(self, lane: str, client: str, waiter: asyncio.Future):
+        """Take a waiter out of the queues, or give its slot back if it was granted meanwhile"""
+        if waiter.done() and not waiter.cancelled():
+            self.release()
+            return
+        waiter.cancel()
+        if self._clients[lane].remove(client, waiter):
+            self._lanes.remove(lane, lane)
+
+    def release(self, duration: Optional[float] = None):
+        """Free a slot, passing it straight to the next waiter; duration updates the service time estimate"""
+        if duration is not None:
+            self.service_time += SERVICE_TIME_ALPHA * (duration - self.service_time)
+        while len(self._lanes):
+            waiter = self._clients[self._lanes.pop()].pop()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "in_flight": self.in_flight,
+            "service_time": self.service_time,
+            "lanes": {
+                lane: {
+                    **config.model_dump(),
+                    "queued": len(self._clients[lane]),
+                    "clients_queued": len(self._clients[lane].lengths()),
+                    "admitted": self._stats[lane]["admitted"],
+                    "shed": self._stats[lane]["shed"],
+                    "expired": self._stats[lane]["expired"],
+                    "mean_queue_wait": self._stats[lane]["wait_seconds"] / max(self._stats[lane]["admitted"], 1)
+                }
+                for lane, config in self.lanes.items()
+            }
+        }
+
+class AdmissionMiddleware:
+    """
+    Runs the admitted endpoints under the scheduler's slots.
+
+    The lane comes from X-Priority; without it, browser requests (with an
+    Origin header) are interactive and others batch. Clients are told apart
+    by X-Client-Key, else by address. X-Request-Deadline sets the deadline
+    in seconds. Shedding happens before the upload is read.
+    """
+
+    def __init__(self, app: ASGIApp, scheduler: AdmissionScheduler):
+        self.app = app
+        self.scheduler = scheduler
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if (
+            scope["type"] != "http" or not self.scheduler.enabled
+            or scope["method"] != "POST" or not ADMITTED_PATHS.match(scope["path"])
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        lane = headers.get("x-priority") or ("interactive" if "origin" in headers else "batch")
+        client = headers.get("x-client-key") or (scope.get("client") or ("unknown",))[0]
+        try:
+            if lane not in self.scheduler.lanes:
+                raise ValueError(f"Unknown priority '{lane}'. Use one of: {', '.join(self.scheduler.lanes)}")
+            try:
+                deadline = float(headers.get("x-request-deadline") or self.scheduler.lanes[lane].deadline)
+            except ValueError:
+                deadline = 0.0
+            if not deadline > 0:
+                raise ValueError("X-Request-Deadline must be a positive number of seconds")
+        except ValueError as e:
+            await JSONResponse({"detail": str(e)}, status_code=400)(scope, receive, send)
+            return
+
+        try:
+            await self.scheduler.acquire(lane, client, deadline)
+        except Overloaded as e:
+            logger.info(f"Shed {scope['path']} ({lane}, {client}): {e}")
+            response = JSONResponse(
+                {"detail": f"Server overloaded: {e}"}, status_code=503,
+                headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))}
+            )
+            await response(scope, receive, send)
+            return
+
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.scheduler.release(time.monotonic() - started)
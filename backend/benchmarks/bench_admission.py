@@ -0,0 +1,158 @@
+"""
+Interactive latency under a batch flood, with and without admission control.
+
+A closed loop of batch clients (no Origin header, so the batch lane) keeps
+the server saturated while interactive requests (with Origin) arrive at a
+fixed rate. Each configuration runs against a fresh app with GenerativeModel
+routed to a local fake Gemini endpoint. Reported per configuration are
+interactive latency percentiles and failures, batch requests served and
+shed, and batch answers that arrived after their deadline (work nobody
+would have received).
+
+Usage:
+    python benchmarks/bench_admission.py --slots 0 8 --duration 30
+    python benchmarks/bench_admission.py --batch-clients 64 --interactive-rate 4 --batch-deadline 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import httpx
+import numpy as np
+
+from run_benchmark import BENCHMARK_DIR, free_port, make_images, start_process, wait_until_ready
+
+async def load(base_url: str, args: argparse.Namespace, images: List[bytes]) -> Dict[str, Any]:
+    interactive: List[float] = []
+    interactive_failed = 0
+    batch = {"served": 0, "shed": 0, "late": 0, "failed": 0}
+    stop_at = time.perf_counter() + args.duration
+
+    async def post(client: httpx.AsyncClient, index: int, headers: Dict[str, str]) -> httpx.Response:
+        files = {"file": (f"image_{index}.jpg", images[index % len(images)], "image/jpeg")}
+        form = {"detect_type": "2D bounding boxes", "reuse_threshold": "-1"}
+        return await client.post("/analyze", data=form, files=files, headers=headers)
+
+    async def batch_client(client: httpx.AsyncClient, number: int):
+        index = number
+        while time.perf_counter() < stop_at:
+            started = time.perf_counter()
+            try:
+                response = await post(client, index, {
+                    "X-Client-Key": f"script-{number % args.batch_keys}",
+                    "X-Request-Deadline": str(args.batch_deadline)
+                })
+            except httpx.HTTPError:
+                batch["failed"] += 1
+                continue
+            index += args.batch_clients
+            if response.status_code == 503:
+                batch["shed"] += 1
+                # Honour Retry-After, as a well-behaved script would
+                await asyncio.sleep(min(float(response.headers.get("retry-after", 1)), args.duration))
+            elif response.status_code != 200 or not response.json().get("success"):
+                batch["failed"] += 1
+            elif time.perf_counter() - started > args.batch_deadline:
+                batch["late"] += 1
+            else:
+                batch["served"] += 1
+
+    async def interactive_request(client: httpx.AsyncClient, index: int):
+        nonlocal interactive_failed
+        started = time.perf_counter()
+        try:
+            response = await post(client, index, {"Origin": "http://localhost:3000"})
+            ok = response.status_code == 200 and response.json().get("success")
+        except httpx.HTTPError:
+            ok = False
+        if ok:
+            interactive.append(time.perf_counter() - started)
+        else:
+            interactive_failed += 1
+
+    limits = httpx.Limits(max_connections=args.batch_clients + 64)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        batch_tasks = [asyncio.create_task(batch_client(client, number)) for number in range(args.batch_clients)]
+        # Let the flood build up before the first interactive request
+        await asyncio.sleep(min(2.0, args.duration / 4))
+        interactive_tasks = []
+        index = 0
+        while time.perf_counter() < stop_at:
+            interactive_tasks.append(asyncio.create_task(interactive_request(client, 10_000 + index)))
+            index += 1
+            await asyncio.sleep(1 / args.interactive_rate)
+        await asyncio.gather(*batch_tasks, *interactive_tasks)
+
+    latencies = np.array(interactive) * 1000 if interactive else np.array([np.nan])
+    p50, p99 = np.percentile(latencies, [50, 99]).tolist()
+    return {
+        "interactive": {"count": len(interactive), "failed": interactive_failed, "p50_ms": p50, "p99_ms": p99},
+        "batch": batch
+    }
+
+def run_slots(slots: int, args: argparse.Namespace) -> Dict[str, Any]:
+    fake_port, app_port = free_port(), free_port()
+    os.environ["ADMISSION_MAX_CONCURRENT"] = str(slots)
+    fake_config = {"latency_p50": args.latency, "latency_sigma": 0.3, "detections": 10, "seed": args.seed}
+    with tempfile.TemporaryDirectory() as workdir:
+        fake = start_process(
+            [os.path.join(BENCHMARK_DIR, "fake_gemini.py"), "--port", str(fake_port), "--config", json.dumps(fake_config)],
+            workdir
+        )
+        app = start_process(
+            [os.path.join(BENCHMARK_DIR, "run_benchmark.py"), "--serve", str(app_port),
+             f"http://127.0.0.1:{fake_port}", os.path.join(workdir, "usage.json")],
+            workdir
+        )
+        try:
+            wait_until_ready(f"http://127.0.0.1:{fake_port}/stats")
+            wait_until_ready(f"http://127.0.0.1:{app_port}/", timeout=60)
+            images = make_images(16, (640, 480), args.seed)
+            result = asyncio.run(load(f"http://127.0.0.1:{app_port}", args, images))
+        finally:
+            for process in (app, fake):
+                process.send_signal(signal.SIGINT)
+            for process in (app, fake):
+                try:
+                    process.wait(timeout=15)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+    return {"slots": slots, **result}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark interactive latency under a batch flood")
+    parser.add_argument("--slots", type=int, nargs="+", default=[0, 8], help="ADMISSION_MAX_CONCURRENT values; 0 is off")
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--batch-clients", type=int, default=48)
+    parser.add_argument("--batch-keys", type=int, default=2, help="Distinct X-Client-Key values among batch clients")
+    parser.add_argument("--batch-deadline", type=float, default=10)
+    parser.add_argument("--interactive-rate", type=float, default=2, help="Interactive requests per second")
+    parser.add_argument("--timeout", type=float, default=30, help="Client timeout in seconds, counted as a failure")
+    parser.add_argument("--latency", type=float, default=0.5, help="Median fake Gemini latency in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report here")
+    args = parser.parse_args()
+
+    report = []
+    for slots in args.slots:
+        result = run_slots(slots, args)
+        report.append(result)
+        interactive, batch = result["interactive"], result["batch"]
+        print(
+            f"slots {slots or 'off':>4}  interactive p50 {interactive['p50_ms']:7.0f}ms p99 {interactive['p99_ms']:7.0f}ms "
+            f"({interactive['count']} ok, {interactive['failed']} failed)  batch {batch['served']} served, "
+            f"{batch['late']} late, {batch['shed']} shed, {batch['failed']} failed"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Benchmark of the streaming export.
+
+Fills scratch databases of increasing size with predictions carrying a
+photo-sized PNG, then runs the export CLI on each for every format and image
+mode, reporting time, throughput and the peak RSS of the export process.
+Peak memory should stay flat as the database grows.
+
+Usage:
+    python benchmarks/bench_export.py --rows 1000 4000
+"""
+import argparse
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+
+from bench_serialization import png_data_url
+from fake_gemini import FakeGeminiConfig, make_detections
+
+RUNS = [("ndjson", "skip"), ("ndjson", "reference"), ("ndjson", "embed"), ("coco", "skip"), ("coco", "embed")]
+
+def populate(path: str, rows: int, seed: int):
+    rng = np.random.default_rng(seed)
+    image = png_data_url((800, 600), rng)
+    boxes = make_detections("box_2d", 20, FakeGeminiConfig(), rng)
+    results = json.dumps([
+        {"x": box["box_2d"][1] / 1000, "y": box["box_2d"][0] / 1000,
+         "width": (box["box_2d"][3] - box["box_2d"][1]) / 1000, "height": (box["box_2d"][2] - box["box_2d"][0]) / 1000,
+         "label": box["label"], "confidence": box.get("confidence")}
+        for box in boxes
+    ])
+    # database.py opens ./predictions.db
+    subprocess.run(
+        [sys.executable, "-c", f"import sys; sys.path.insert(0, {BACKEND_DIR!r}); import database; database.create_tables()"],
+        cwd=path, check=True
+    )
+    record = (
+        "image.png", image, "2D bounding boxes", "items", "", "English", 0.4, "gemini-2.5-flash",
+        results, "2025-01-01 00:00:00", 1.0
+    )
+    connection = sqlite3.connect(os.path.join(path, "predictions.db"))
+    for start in range(0, rows, 500):
+        connection.executemany(
+            "INSERT INTO predictions (image_name, image_data, detect_type, target_prompt, label_prompt, "
+            "segmentation_language, temperature, model_used, results, created_at, processing_time) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [record] * min(500, rows - start)
+        )
+        connection.commit()
+    connection.close()
+    return len(image)
+
+# Runs the export CLI and prints its peak RSS. VmHWM starts afresh at exec, unlike ru_maxrss,
+# which keeps the peak of this (larger) benchmark process the child was forked from
+MEASURE = """
+import os, runpy, sys
+sys.argv = sys.argv[1:]
+sys.path.insert(0, os.path.dirname(sys.argv[0]))
+runpy.run_path(sys.argv[0], run_name="__main__")
+with open("/proc/self/status") as f:
+    print(next(line.split()[1] for line in f if line.startswith("VmHWM")))
+"""
+
+def run_export(path: str, export_format: str, images: str):
+    """Seconds, output bytes and peak RSS in MB of one export CLI run"""
+    output = os.path.join(path, "export.out")
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-c", MEASURE, os.path.join(BACKEND_DIR, "export.py"),
+         "--format", export_format, "--images", images, "--output", output],
+        cwd=path, check=True, capture_output=True, text=True
+    )
+    elapsed = time.perf_counter() - started
+    size = os.path.getsize(output)
+    os.remove(output)
+    return elapsed, size, int(completed.stdout.split()[-1]) / 1024
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark streaming export")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 4000])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as path:
+            image_size = populate(path, rows, args.seed)
+            print(f"\n{rows:,} predictions, {image_size / 1e6:.1f} MB image each")
+            for export_format, images in RUNS:
+                elapsed, size, peak = run_export(path, export_format, images)
+                print(f"  {export_format:<7}{images:<10}{size / 1e6:>10.1f} MB {elapsed:>7.2f}s "
+                      f"{size / 1e6 / elapsed:>8.1f} MB/s  peak RSS {peak:6.1f} MB")
+
+if __name__ == "__main__":
+    main()
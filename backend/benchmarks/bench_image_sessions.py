@@ -0,0 +1,131 @@
+"""
+Prompt tokens and latency of image-session analyses with and without a Gemini context cache.
+
+One image session is created and --requests prompts are run against it,
+once with IMAGE_SESSION_PROVIDER_CACHE off (the image is sent inline with
+every prompt) and once on (the image sits in a cached content and each
+prompt names it), each against a fresh app routed to a local fake Gemini
+endpoint. The fake endpoint charges --latency-per-input-token for every
+prompt token it did not take from a cached content. Reported per mode are
+latency percentiles, the prompt and cached tokens from the session's
+stats, and the fake endpoint's cached content counters. With --interval
+close to --ttl, the cached content has to be extended to outlive requests.
+
+Usage:
+    python benchmarks/bench_image_sessions.py --requests 20
+    python benchmarks/bench_image_sessions.py --requests 6 --ttl 4 --interval 1.5
+"""
+import argparse
+import io
+import json
+import os
+import signal
+import subprocess
+import tempfile
+import time
+from typing import Any, Dict
+
+import httpx
+import numpy as np
+from PIL import Image
+
+from run_benchmark import BENCHMARK_DIR, free_port, start_process, wait_until_ready
+
+def make_image(args: argparse.Namespace) -> bytes:
+    """A noisy PNG, so its size and token count are those of a detailed photo"""
+    rng = np.random.default_rng(args.seed)
+    buffered = io.BytesIO()
+    Image.fromarray(rng.integers(0, 256, (args.height, args.width, 3), dtype=np.uint8)).save(buffered, format="PNG")
+    return buffered.getvalue()
+
+def drive(base_url: str, fake_url: str, image: bytes, args: argparse.Namespace) -> Dict[str, Any]:
+    latencies = []
+    failed = 0
+    with httpx.Client(base_url=base_url, timeout=120) as client:
+        response = client.post("/image-sessions", files={"file": ("image.png", image, "image/png")})
+        response.raise_for_status()
+        session_id = response.json()["session_id"]
+        for index in range(args.requests):
+            if index:
+                time.sleep(args.interval)
+            started = time.perf_counter()
+            # A new prompt each time, so no answer comes from the app's own caches
+            form = {"detect_type": args.detect_type, "target_prompt": f"objects of kind {index}"}
+            response = client.post(f"/image-sessions/{session_id}/analyze", data=form)
+            latencies.append(time.perf_counter() - started)
+            failed += response.status_code != 200 or not response.json().get("success")
+        session = client.get(f"/image-sessions/{session_id}").json()
+    return {
+        "p50_ms": float(np.percentile(latencies, 50)) * 1000,
+        "p95_ms": float(np.percentile(latencies, 95)) * 1000,
+        "prompt_tokens": session["prompt_tokens"],
+        "cached_tokens": session["cached_tokens"],
+        "uncached_tokens": session["prompt_tokens"] - session["cached_tokens"],
+        "provider_cache_extensions": session["provider_cache_extensions"],
+        "cached_contents": httpx.get(f"{fake_url}/stats").json()["cached_contents"],
+        "failed": failed
+    }
+
+def run_mode(provider_cache: bool, image: bytes, args: argparse.Namespace) -> Dict[str, Any]:
+    fake_port, app_port = free_port(), free_port()
+    fake_url, base_url = f"http://127.0.0.1:{fake_port}", f"http://127.0.0.1:{app_port}"
+    os.environ["IMAGE_SESSION_PROVIDER_CACHE"] = "true" if provider_cache else "false"
+    os.environ["IMAGE_SESSION_TTL"] = str(args.ttl)
+    fake_config = {
+        "latency_p50": args.latency, "latency_sigma": 0.2, "latency_per_input_token": args.latency_per_input_token,
+        "detections": 5, "seed": args.seed
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        fake = start_process(
+            [os.path.join(BENCHMARK_DIR, "fake_gemini.py"), "--port", str(fake_port), "--config", json.dumps(fake_config)],
+            workdir
+        )
+        app = start_process(
+            [os.path.join(BENCHMARK_DIR, "run_benchmark.py"), "--serve", str(app_port), fake_url, os.path.join(workdir, "usage.json")],
+            workdir
+        )
+        try:
+            wait_until_ready(f"{fake_url}/stats")
+            wait_until_ready(f"{base_url}/", timeout=60)
+            result = drive(base_url, fake_url, image, args)
+        finally:
+            for process in (app, fake):
+                process.send_signal(signal.SIGINT)
+            for process in (app, fake):
+                try:
+                    process.wait(timeout=15)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+    return {"provider_cache": provider_cache, **result}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark image sessions with and without a Gemini context cache")
+    parser.add_argument("--requests", type=int, default=20, help="Prompts run against the session")
+    parser.add_argument("--detect-type", default="2D bounding boxes")
+    parser.add_argument("--width", type=int, default=1024)
+    parser.add_argument("--height", type=int, default=768)
+    parser.add_argument("--ttl", type=float, default=600, help="IMAGE_SESSION_TTL in seconds")
+    parser.add_argument("--interval", type=float, default=0.0, help="Seconds between prompts")
+    parser.add_argument("--latency", type=float, default=0.3, help="Median fake Gemini latency in seconds")
+    parser.add_argument("--latency-per-input-token", type=float, default=0.0002, help="Fake seconds per uncached prompt token")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report here")
+    args = parser.parse_args()
+
+    image = make_image(args)
+    report = []
+    for provider_cache in (False, True):
+        result = run_mode(provider_cache, image, args)
+        report.append(result)
+        print(
+            f"provider cache {'on ' if provider_cache else 'off'}  p50 {result['p50_ms']:6.0f}ms p95 {result['p95_ms']:6.0f}ms  "
+            f"prompt tokens {result['prompt_tokens']:7d} (uncached {result['uncached_tokens']:7d})  "
+            f"extensions {result['provider_cache_extensions']}  cached contents {result['cached_contents']}  failed {result['failed']}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Latency and completeness of analyses at different output budgets.
+
+For each max_output_tokens value, a fresh app (with OUTPUT_BUDGETS set to
+that value for the detection type) is driven with sequential /analyze
+requests against a local fake Gemini endpoint whose latency grows with the
+number of output tokens. Reported per budget are latency percentiles, the
+share of truncated answers and the detections returned, taken from the
+app's /output-budget/stats, so the table shows what each budget trades.
+
+Usage:
+    python benchmarks/bench_output_budget.py --budgets 0 4096 2048 1024
+    python benchmarks/bench_output_budget.py --detect-type "2D bounding boxes" --detections 40 --budgets 0 512 256
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import tempfile
+from typing import Any, Dict, List
+
+import httpx
+import numpy as np
+
+from run_benchmark import BENCHMARK_DIR, free_port, make_images, start_process, wait_until_ready
+
+def drive(base_url: str, args: argparse.Namespace, images: List[bytes]) -> Dict[str, Any]:
+    detections = []
+    failed = 0
+    with httpx.Client(base_url=base_url, timeout=120) as client:
+        for index in range(args.requests):
+            files = {"file": (f"image_{index}.jpg", images[index % len(images)], "image/jpeg")}
+            form = {"detect_type": args.detect_type, "reuse_threshold": "-1"}
+            response = client.post("/analyze", data=form, files=files)
+            if response.status_code == 200 and response.json().get("success"):
+                detections.append(len(response.json()["data"]))
+            else:
+                failed += 1
+        stats = client.get("/output-budget/stats").json()["calls"].get(args.detect_type, {})
+    return {
+        "p50_ms": stats.get("p50", np.nan) * 1000,
+        "p99_ms": stats.get("p99", np.nan) * 1000,
+        "truncated_rate": stats.get("truncated_rate"),
+        "mean_output_tokens": stats.get("mean_output_tokens"),
+        "mean_detections": float(np.mean(detections)) if detections else 0.0,
+        "failed": failed
+    }
+
+def run_budget(budget: int, args: argparse.Namespace) -> Dict[str, Any]:
+    fake_port, app_port = free_port(), free_port()
+    os.environ["OUTPUT_BUDGETS"] = json.dumps({args.detect_type: {"max_output_tokens": budget or None}})
+    os.environ["OUTPUT_BUDGET_THINKING_ALLOWANCE"] = str(args.thinking_allowance)
+    fake_config = {
+        "latency_p50": args.latency, "latency_sigma": 0.2, "latency_per_token": args.latency_per_token,
+        "detections": args.detections, "mask_size": args.mask_size, "seed": args.seed
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        fake = start_process(
+            [os.path.join(BENCHMARK_DIR, "fake_gemini.py"), "--port", str(fake_port), "--config", json.dumps(fake_config)],
+            workdir
+        )
+        app = start_process(
+            [os.path.join(BENCHMARK_DIR, "run_benchmark.py"), "--serve", str(app_port),
+             f"http://127.0.0.1:{fake_port}", os.path.join(workdir, "usage.json")],
+            workdir
+        )
+        try:
+            wait_until_ready(f"http://127.0.0.1:{fake_port}/stats")
+            wait_until_ready(f"http://127.0.0.1:{app_port}/", timeout=60)
+            images = make_images(16, (640, 480), args.seed)
+            result = drive(f"http://127.0.0.1:{app_port}", args, images)
+        finally:
+            for process in (app, fake):
+                process.send_signal(signal.SIGINT)
+            for process in (app, fake):
+                try:
+                    process.wait(timeout=15)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+    return {"max_output_tokens": budget or None, **result}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark latency and truncation at different output budgets")
+    parser.add_argument("--budgets", type=int, nargs="+", default=[0, 4096, 2048, 1024], help="max_output_tokens values; 0 is unbounded")
+    parser.add_argument("--detect-type", default="Segmentation masks")
+    parser.add_argument("--requests", type=int, default=30)
+    parser.add_argument("--detections", type=int, default=10, help="Detections in each fake answer")
+    parser.add_argument("--mask-size", type=int, default=96, help="Side of the fake base64 PNG masks")
+    parser.add_argument("--latency", type=float, default=0.3, help="Median fake Gemini latency before output, in seconds")
+    parser.add_argument("--latency-per-token", type=float, default=0.0005, help="Fake generation seconds per output token")
+    parser.add_argument("--thinking-allowance", type=int, default=0, help="Tokens added for thinking models; the fake model does not think")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report here")
+    args = parser.parse_args()
+
+    report = []
+    for budget in args.budgets:
+        result = run_budget(budget, args)
+        report.append(result)
+        print(
+            f"max_output_tokens {budget or 'none':>6}  p50 {result['p50_ms']:6.0f}ms p99 {result['p99_ms']:6.0f}ms  "
+            f"truncated {result['truncated_rate'] or 0:5.0%}  detections {result['mean_detections']:5.1f}  "
+            f"output tokens {result['mean_output_tokens'] or 0:6.0f}  failed {result['failed']}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
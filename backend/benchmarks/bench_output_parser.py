@@ -0,0 +1,132 @@
+"""
+Benchmark of model-output JSON parsing.
+
+Compares the previous parsing (split on the ```json fence, json.loads)
+with output_parser.parse_json_array, with and without orjson, on
+prompt-engineering responses. Responses come from a Gemini response
+archive (see GEMINI_RECORD_PATH) or are synthesized. Each response is also
+cut at 50% and 90% and given trailing text, to show what each parser
+recovers from truncated and untidy output.
+
+Usage:
+    python benchmarks/bench_output_parser.py
+    python benchmarks/bench_output_parser.py --archive /tmp/run.jsonl.gz --output parser.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+sys.path.insert(0, BENCHMARK_DIR)
+
+import output_parser
+from fake_gemini import FakeGeminiConfig, make_detections
+from response_archive import load_archive
+
+def legacy_parse(text: str) -> List[Any]:
+    """Parsing as done before output_parser"""
+    if "```json" in text:
+        text = text.split("```json")[1].split("```")[0]
+    return json.loads(text)
+
+def parse_stdlib(text: str) -> List[Any]:
+    fast = output_parser.orjson
+    output_parser.orjson = None
+    try:
+        return output_parser.parse_json_array(text).items
+    finally:
+        output_parser.orjson = fast
+
+def parse_fast(text: str) -> List[Any]:
+    return output_parser.parse_json_array(text).items
+
+PARSERS: Dict[str, Callable[[str], List[Any]]] = {
+    "legacy": legacy_parse,
+    "tolerant-stdlib": parse_stdlib,
+    "tolerant-orjson": parse_fast,
+}
+
+def archive_texts(path: str) -> List[Tuple[str, str]]:
+    """Text parts of the recorded prompt-engineering responses"""
+    texts = []
+    for i, record in enumerate(load_archive(path)):
+        if record["call"] != "prompt_engineering" or not record.get("response"):
+            continue
+        for candidate in record["response"].get("candidates", [])[:1]:
+            text = "".join(part.get("text", "") for part in candidate.get("content", {}).get("parts", []))
+            if text:
+                texts.append((f"recorded-{i}", text))
+    return texts
+
+def synthetic_texts(seed: int) -> List[Tuple[str, str]]:
+    rng = np.random.default_rng(seed)
+    texts = []
+    for kind, count, mask_size in [("box_2d", 25, 0), ("box_2d", 250, 0), ("mask", 25, 64), ("mask", 25, 256)]:
+        config = FakeGeminiConfig(mask_size=mask_size or 64)
+        detections = make_detections(kind, count, config, rng)
+        name = f"{kind}-{count}" + (f"-mask{mask_size}" if mask_size else "")
+        texts.append((name, "```json\n" + json.dumps(detections, indent=2) + "\n```"))
+    return texts
+
+def variants(name: str, text: str) -> List[Tuple[str, str]]:
+    return [
+        (name, text),
+        (f"{name}/truncated-90%", text[:int(len(text) * 0.9)]),
+        (f"{name}/truncated-50%", text[:len(text) // 2]),
+        (f"{name}/trailing-text", text.replace("```json", "").replace("```", "") + "\nLet me know if you need anything else."),
+    ]
+
+def time_parser(parse: Callable[[str], List[Any]], text: str, repeat: int) -> Dict[str, Any]:
+    try:
+        items = len(parse(text))
+    except ValueError as e:
+        return {"items": 0, "error": type(e).__name__}
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parse(text)
+        timings.append(time.perf_counter() - start)
+    return {"items": items, "ms": float(np.median(timings)) * 1000}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark model-output JSON parsing")
+    parser.add_argument("--archive", help="Gemini response archive to take prompt-engineering responses from")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report here")
+    args = parser.parse_args()
+
+    texts = archive_texts(args.archive) if args.archive else synthetic_texts(args.seed)
+    if not texts:
+        parser.error("No prompt-engineering responses found in the archive")
+    if output_parser.orjson is None:
+        del PARSERS["tolerant-orjson"]
+
+    results = []
+    print(f"{'case':<36}{'bytes':>10}" + "".join(f"{name:>24}" for name in PARSERS))
+    for name, text in texts:
+        for case, variant in variants(name, text):
+            row = {"case": case, "bytes": len(variant)}
+            for parser_name, parse in PARSERS.items():
+                row[parser_name] = time_parser(parse, variant, args.repeat)
+            results.append(row)
+            cells = [
+                f"{row[parser_name]['items']:>5} items {row[parser_name]['ms']:>8.3f}ms" if "ms" in row[parser_name]
+                else f"{row[parser_name]['error']:>24}"
+                for parser_name in PARSERS
+            ]
+            print(f"{case:<36}{len(variant):>10}" + "".join(f"{cell:>24}" for cell in cells))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"parsers": list(PARSERS), "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Benchmark of the prediction search index.
+
+Fills a scratch database with synthetic predictions (results only, no
+images) through the normal insert path, so the FTS5 triggers do the
+indexing, then times /search queries of varying selectivity.
+
+Usage:
+    python benchmarks/bench_search.py --rows 1000000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCHMARK_DIR)
+
+LABELS = [
+    "person", "car", "forklift", "pallet", "box", "truck", "bicycle", "dog", "cat", "chair",
+    "table", "laptop", "phone", "bottle", "cup", "helmet", "ladder", "crane", "door", "window"
+]
+PROMPTS = ["items", "vehicles", "people", "warehouse equipment", "safety gear", "furniture"]
+DETECT_TYPES = ["2D bounding boxes", "Points", "Segmentation masks", "3D bounding boxes"]
+
+QUERIES = [
+    ("common label", {"query": "person"}),
+    ("rare label", {"query": "crane ladder"}),
+    ("prefix", {"query": "fork", "prefix": True}),
+    ("labels only, recent", {"query": "forklift", "field": "labels", "sort": "recent"}),
+    ("with detect_type", {"query": "pallet", "detect_type": "Points"}),
+    ("deep page", {"query": "truck", "offset": 400}),
+]
+
+def populate(connection, rows: int, seed: int, batch: int = 10000):
+    rng = np.random.default_rng(seed)
+    # Zipf-like label frequencies: a few labels are everywhere, most are rare
+    weights = 1 / np.arange(1, len(LABELS) + 1)
+    weights /= weights.sum()
+    for start in range(0, rows, batch):
+        records = []
+        for _ in range(min(batch, rows - start)):
+            labels = rng.choice(LABELS, size=int(rng.integers(1, 8)), p=weights)
+            results = [{"x": 0.1, "y": 0.1, "width": 0.2, "height": 0.2, "label": str(label)} for label in labels]
+            records.append((
+                "image.jpg", None, DETECT_TYPES[int(rng.integers(len(DETECT_TYPES)))],
+                PROMPTS[int(rng.integers(len(PROMPTS)))], "", "English", 0.4, "gemini-2.5-flash",
+                json.dumps(results), "2025-01-01 00:00:00", 1.0
+            ))
+        connection.executemany(
+            "INSERT INTO predictions (image_name, image_data, detect_type, target_prompt, label_prompt, "
+            "segmentation_language, temperature, model_used, results, created_at, processing_time) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            records
+        )
+        connection.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark prediction search")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # database.py opens ./predictions.db
+        os.chdir(workdir)
+        sys.path.insert(0, BACKEND_DIR)
+        from database import SessionLocal, create_tables, engine
+        from search import create_search_index, search_predictions
+
+        create_tables()
+        create_search_index()
+        start = time.perf_counter()
+        connection = engine.raw_connection()
+        populate(connection, args.rows, args.seed)
+        connection.close()
+        insert_time = time.perf_counter() - start
+        print(f"Inserted {args.rows:,} predictions in {insert_time:.1f}s ({args.rows / insert_time:,.0f} rows/s incl. indexing)")
+
+        db = SessionLocal()
+        for name, params in QUERIES:
+            timings = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                page = search_predictions(db, **params)
+                timings.append(time.perf_counter() - started)
+            p50, p95 = np.percentile(np.array(timings) * 1000, [50, 95])
+            print(f"  {name:<24} {len(page['results']):>3} results  p50 {p50:7.2f}ms  p95 {p95:7.2f}ms")
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Gemini calls and wall time of a frame sequence: per-frame /analyze against /analyze-sequence.
+
+A synthetic clip of --scenes scenes, each --frames-per-scene frames of a
+slowly panning textured image with sensor noise, is analyzed twice against
+a fresh app routed to a local fake Gemini endpoint: once frame by frame
+through /analyze (near-duplicate reuse off, --concurrency requests at a
+time), and once as a zip of JPEG frames through /analyze-sequence. Reported
+are the Gemini calls made (from the fake endpoint's counter) and wall time.
+
+Usage:
+    python benchmarks/bench_sequence.py --scenes 5 --frames-per-scene 30
+    python benchmarks/bench_sequence.py --pan 4 --keyframe-threshold 0.05 --max-gap 15
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import signal
+import subprocess
+import tempfile
+import time
+import zipfile
+from typing import Any, Dict, List
+
+import httpx
+import numpy as np
+from PIL import Image
+
+from run_benchmark import BENCHMARK_DIR, free_port, start_process, wait_until_ready
+
+def make_clip(args: argparse.Namespace) -> List[bytes]:
+    """JPEG frames: per scene, a random texture panned by --pan pixels per frame, plus noise"""
+    rng = np.random.default_rng(args.seed)
+    frames = []
+    for _ in range(args.scenes):
+        # Coarse blocks with fine detail on top, like a photographed scene
+        texture = rng.integers(0, 256, size=(480 // 32, 640 // 32 + 8, 3)).repeat(32, 0).repeat(32, 1)
+        texture = texture + rng.normal(0, 12, texture.shape)
+        for k in range(args.frames_per_scene):
+            offset = k * args.pan
+            frame = np.roll(texture, -offset, axis=1)[:, :640] + rng.normal(0, 4, (480, 640, 3))
+            buffered = io.BytesIO()
+            Image.fromarray(np.clip(frame, 0, 255).astype(np.uint8)).save(buffered, format="JPEG", quality=85)
+            frames.append(buffered.getvalue())
+    return frames
+
+def gemini_calls(fake_url: str) -> int:
+    return httpx.get(f"{fake_url}/stats").json()["calls"]
+
+async def per_frame(base_url: str, frames: List[bytes], args: argparse.Namespace):
+    semaphore = asyncio.Semaphore(args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=300) as client:
+        async def analyze(index: int, frame: bytes):
+            async with semaphore:
+                files = {"file": (f"frame_{index}.jpg", frame, "image/jpeg")}
+                response = await client.post("/analyze", data={"detect_type": args.detect_type, "reuse_threshold": "-1"}, files=files)
+                response.raise_for_status()
+        await asyncio.gather(*[analyze(index, frame) for index, frame in enumerate(frames)])
+
+def sequence(base_url: str, frames: List[bytes], args: argparse.Namespace) -> Dict[str, Any]:
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zipped:
+        for index, frame in enumerate(frames):
+            zipped.writestr(f"frame_{index:05d}.jpg", frame)
+    form = {"detect_type": args.detect_type}
+    if args.keyframe_threshold is not None:
+        form["keyframe_threshold"] = str(args.keyframe_threshold)
+    if args.max_gap is not None:
+        form["max_gap"] = str(args.max_gap)
+    response = httpx.post(
+        f"{base_url}/analyze-sequence", data=form,
+        files={"file": ("clip.zip", archive.getvalue(), "application/zip")}, timeout=600
+    )
+    response.raise_for_status()
+    return response.json()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark keyframe sequence analysis against per-frame analysis")
+    parser.add_argument("--scenes", type=int, default=4)
+    parser.add_argument("--frames-per-scene", type=int, default=30)
+    parser.add_argument("--pan", type=int, default=1, help="Pixels the scene moves per frame")
+    parser.add_argument("--detect-type", default="2D bounding boxes")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent per-frame /analyze requests")
+    parser.add_argument("--keyframe-threshold", type=float)
+    parser.add_argument("--max-gap", type=int)
+    parser.add_argument("--latency", type=float, default=0.5, help="Median fake Gemini latency in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report here")
+    args = parser.parse_args()
+
+    frames = make_clip(args)
+    fake_port, app_port = free_port(), free_port()
+    fake_url, base_url = f"http://127.0.0.1:{fake_port}", f"http://127.0.0.1:{app_port}"
+    fake_config = {"latency_p50": args.latency, "latency_sigma": 0.2, "detections": 5, "seed": args.seed}
+    with tempfile.TemporaryDirectory() as workdir:
+        fake = start_process(
+            [os.path.join(BENCHMARK_DIR, "fake_gemini.py"), "--port", str(fake_port), "--config", json.dumps(fake_config)],
+            workdir
+        )
+        app = start_process(
+            [os.path.join(BENCHMARK_DIR, "run_benchmark.py"), "--serve", str(app_port), fake_url, os.path.join(workdir, "usage.json")],
+            workdir
+        )
+        try:
+            wait_until_ready(f"{fake_url}/stats")
+            wait_until_ready(f"{base_url}/", timeout=60)
+
+            calls, started = gemini_calls(fake_url), time.perf_counter()
+            asyncio.run(per_frame(base_url, frames, args))
+            report = {"frames": len(frames), "per_frame": {"calls": gemini_calls(fake_url) - calls, "seconds": time.perf_counter() - started}}
+
+            calls, started = gemini_calls(fake_url), time.perf_counter()
+            result = sequence(base_url, frames, args)
+            report["sequence"] = {
+                "calls": gemini_calls(fake_url) - calls, "seconds": time.perf_counter() - started,
+                "keyframes": [keyframe["frame"] for keyframe in result["keyframes"]]
+            }
+        finally:
+            for process in (app, fake):
+                process.send_signal(signal.SIGINT)
+            for process in (app, fake):
+                try:
+                    process.wait(timeout=15)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+    for mode in ("per_frame", "sequence"):
+        print(f"{mode:>9}  {report[mode]['calls']:4d} Gemini calls  {report[mode]['seconds']:6.1f}s  ({report['frames']} frames)")
+    print(f"keyframes: {report['sequence']['keyframes']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Benchmark of response encoding and compression.
+
+Builds analysis responses of increasing size (segmentation masks, image
+data URL, overlay image) and reports, per payload, the encode time and
+size of the standard JSON response, the orjson response and the msgpack
+representation, and the size and time of each gzip level and brotli
+quality on the JSON body.
+
+Usage:
+    python benchmarks/bench_serialization.py
+    python benchmarks/bench_serialization.py --output serialization.json
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+from fastapi.responses import JSONResponse, ORJSONResponse
+from PIL import Image
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+sys.path.insert(0, BENCHMARK_DIR)
+
+import responses
+from fake_gemini import FakeGeminiConfig, make_detections
+
+def png_data_url(size: tuple, rng: np.random.Generator) -> str:
+    """PNG of a photo-like image, as the app stores uploads"""
+    blocks = rng.integers(0, 256, size=(size[1] // 8, size[0] // 8, 3), dtype=np.uint8)
+    image = Image.fromarray(blocks).resize(size, Image.Resampling.BILINEAR)
+    buffered = io.BytesIO()
+    image.save(buffered, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buffered.getvalue()).decode()
+
+def make_payloads(seed: int) -> Dict[str, Dict[str, Any]]:
+    rng = np.random.default_rng(seed)
+    payloads = {}
+    boxes = make_detections("box_2d", 50, FakeGeminiConfig(), rng)
+    payloads["boxes-50"] = {"success": True, "data": boxes, "prediction_id": 1}
+    for count, mask_size in [(20, 64), (50, 256)]:
+        masks = make_detections("mask", count, FakeGeminiConfig(mask_size=mask_size), rng)
+        payloads[f"masks-{count}x{mask_size}"] = {"success": True, "data": masks, "prediction_id": 1}
+    payloads["masks-50x256+images"] = {
+        **payloads["masks-50x256"],
+        "image_data": png_data_url((800, 600), rng),
+        "overlay_image": png_data_url((800, 600), rng)
+    }
+    return payloads
+
+def median_time(function: Callable[[], Any], repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings)) * 1000
+
+def compressors() -> Dict[str, Callable[[], Any]]:
+    options = {f"gzip-{level}": (lambda level=level: responses.GzipCompressor(level)) for level in (1, 6, 9)}
+    if responses.brotli is not None:
+        options.update({f"br-{quality}": (lambda quality=quality: responses.BrotliCompressor(quality)) for quality in (1, 4, 11)})
+    return options
+
+def compress(make_compressor: Callable[[], Any], body: bytes) -> bytes:
+    compressor = make_compressor()
+    return compressor.compress(body) + compressor.finish()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark response encoding and compression")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report here")
+    args = parser.parse_args()
+
+    results: List[Dict[str, Any]] = []
+    for name, payload in make_payloads(args.seed).items():
+        encoders = {
+            "json": lambda: JSONResponse(payload).body,
+            "orjson": lambda: ORJSONResponse(payload).body,
+        }
+        if responses.msgpack is not None:
+            encoders["msgpack"] = lambda: responses.MsgpackResponse(responses.data_urls_to_bytes(payload)).body
+
+        row: Dict[str, Any] = {"payload": name, "encoding": {}, "compression": {}}
+        for encoder_name, encode in encoders.items():
+            row["encoding"][encoder_name] = {"ms": median_time(encode, args.repeat), "bytes": len(encode())}
+
+        body = ORJSONResponse(payload).body
+        for compressor_name, make_compressor in compressors().items():
+            row["compression"][compressor_name] = {
+                "ms": median_time(lambda: compress(make_compressor, body), max(1, args.repeat // 2)),
+                "bytes": len(compress(make_compressor, body))
+            }
+        results.append(row)
+
+        print(f"\n{name}")
+        for encoder_name, result in row["encoding"].items():
+            print(f"  {encoder_name:<12}{result['bytes']:>12,} bytes {result['ms']:>10.2f}ms")
+        for compressor_name, result in row["compression"].items():
+            ratio = result["bytes"] / len(body)
+            print(f"  {compressor_name:<12}{result['bytes']:>12,} bytes {result['ms']:>10.2f}ms  ({ratio:.0%} of JSON)")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Benchmark of the spatial detection index.
+
+Fills a scratch database with synthetic box and point predictions through
+the normal insert path, so the triggers fill the detections table and its
+R*Tree, then times region, label and confidence queries against the same
+filter evaluated over every stored results blob.
+
+Usage:
+    python benchmarks/bench_spatial.py --rows 200000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from sqlalchemy import text
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCHMARK_DIR)
+
+LABELS = ["person", "car", "forklift", "pallet", "box", "truck", "bicycle", "dog", "helmet", "crane"]
+
+QUERIES = [
+    ("person in left third", {"region": (0, 0, 1 / 3, 1), "mode": "within", "label": "person"}),
+    ("boxes overlapping a region", {"region": (0.45, 0.45, 0.55, 0.55)}),
+    ("small region, confident", {"region": (0.1, 0.1, 0.15, 0.15), "min_confidence": 0.9}),
+    ("rare label in small region", {"region": (0.1, 0.1, 0.15, 0.15), "label": "crane"}),
+    ("rare label anywhere", {"label": "crane", "min_confidence": 0.5}),
+    ("points in top half", {"region": (0, 0, 1, 0.5), "detect_type": "Points"}),
+]
+
+# "small region, confident" evaluated by scanning the results blobs, as before the index existed
+SCAN_QUERY = """
+    SELECT p.id, json_extract(value, '$.label') AS label
+    FROM predictions p, json_each(p.results)
+    WHERE json_extract(value, '$.confidence') >= 0.9
+      AND coalesce(json_extract(value, '$.x'), json_extract(value, '$.point.x'))
+          + coalesce(json_extract(value, '$.width'), 0) >= 0.1
+      AND coalesce(json_extract(value, '$.x'), json_extract(value, '$.point.x')) <= 0.15
+      AND coalesce(json_extract(value, '$.y'), json_extract(value, '$.point.y'))
+          + coalesce(json_extract(value, '$.height'), 0) >= 0.1
+      AND coalesce(json_extract(value, '$.y'), json_extract(value, '$.point.y')) <= 0.15
+    ORDER BY p.id DESC LIMIT 101
+"""
+
+def populate(connection, rows: int, seed: int, batch: int = 10000):
+    rng = np.random.default_rng(seed)
+    weights = 1 / np.arange(1, len(LABELS) + 1)
+    weights /= weights.sum()
+    for start in range(0, rows, batch):
+        records = []
+        for _ in range(min(batch, rows - start)):
+            count = int(rng.integers(1, 8))
+            labels = rng.choice(LABELS, size=count, p=weights)
+            x, y = rng.random(count) * 0.8, rng.random(count) * 0.8
+            size = rng.random((count, 2)) * 0.2
+            confidence = rng.random(count)
+            if rng.random() < 0.25:
+                detect_type = "Points"
+                results = [
+                    {"point": {"x": x[i], "y": y[i]}, "label": str(labels[i]), "confidence": confidence[i]}
+                    for i in range(count)
+                ]
+            else:
+                detect_type = "2D bounding boxes"
+                results = [
+                    {"x": x[i], "y": y[i], "width": size[i, 0], "height": size[i, 1],
+                     "label": str(labels[i]), "confidence": confidence[i]}
+                    for i in range(count)
+                ]
+            records.append((
+                "image.jpg", "x" * 2000, detect_type, "items", "", "English", 0.4, "gemini-2.5-flash",
+                json.dumps(results), "2025-01-01 00:00:00", 1.0
+            ))
+        connection.executemany(
+            "INSERT INTO predictions (image_name, image_data, detect_type, target_prompt, label_prompt, "
+            "segmentation_language, temperature, model_used, results, created_at, processing_time) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            records
+        )
+        connection.commit()
+
+def percentiles(function, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started)
+    return result, np.percentile(np.array(timings) * 1000, [50, 95])
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark spatial detection queries")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # database.py opens ./predictions.db
+        os.chdir(workdir)
+        sys.path.insert(0, BACKEND_DIR)
+        from database import SessionLocal, create_tables, engine
+        from spatial import create_spatial_index, query_detections
+
+        create_tables()
+        create_spatial_index()
+        start = time.perf_counter()
+        connection = engine.raw_connection()
+        populate(connection, args.rows, args.seed)
+        connection.close()
+        insert_time = time.perf_counter() - start
+        print(f"Inserted {args.rows:,} predictions in {insert_time:.1f}s ({args.rows / insert_time:,.0f} rows/s incl. indexing)")
+
+        db = SessionLocal()
+        detections = db.execute(text("SELECT count(*) FROM detections")).scalar()
+        print(f"Indexed {detections:,} detections")
+        for name, params in QUERIES:
+            page, (p50, p95) = percentiles(lambda: query_detections(db, **params), args.repeat)
+            print(f"  {name:<28} {len(page['detections']):>4} results  p50 {p50:8.2f}ms  p95 {p95:8.2f}ms")
+        rows, (p50, p95) = percentiles(lambda: db.execute(text(SCAN_QUERY)).all(), max(1, args.repeat // 10))
+        print(f"  {'results scan (baseline)':<28} {len(rows):>4} results  p50 {p50:8.2f}ms  p95 {p95:8.2f}ms")
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Cold-start benchmark: import time of main.py and time until the server is ready.
+
+Each measurement runs in a fresh interpreter in an empty directory, as an
+autoscaled worker would start. Reported are the median import time, the
+modules contributing most to it (python -X importtime), and the time from
+process start to the first answer on GET / (listening) and to a 200 from
+GET /ready (warm).
+
+Usage:
+    python benchmarks/bench_startup.py --runs 5
+    python benchmarks/bench_startup.py --max-import-seconds 1.5   # exit 1 above this, for CI
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import httpx
+import numpy as np
+
+from run_benchmark import BACKEND_DIR, free_port
+
+IMPORT_SCRIPT = (
+    "import sys, time; sys.path.insert(0, {backend!r}); started = time.perf_counter(); import main; "
+    "print(time.perf_counter() - started); "
+    "print(int('google.generativeai' in sys.modules), int('sqlalchemy' in sys.modules), int('PIL.Image' in sys.modules))"
+)
+
+def import_time(workdir: str) -> Dict[str, Any]:
+    output = subprocess.check_output(
+        [sys.executable, "-c", IMPORT_SCRIPT.format(backend=BACKEND_DIR)], cwd=workdir, stderr=subprocess.DEVNULL, text=True
+    ).split()
+    return {
+        "seconds": float(output[0]),
+        "genai_loaded": output[1] == "1",
+        "sqlalchemy_loaded": output[2] == "1",
+        "pil_loaded": output[3] == "1"
+    }
+
+def top_imports(workdir: str, count: int) -> List[Dict[str, Any]]:
+    """Top-level packages by cumulative import time"""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import sys; sys.path.insert(0, {BACKEND_DIR!r}); import main"],
+        cwd=workdir, capture_output=True, text=True
+    ).stderr
+    packages: Dict[str, int] = {}
+    for line in stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \|( *)(\S+)", line)
+        # Only modules imported directly by the script or main.py's own imports (two levels)
+        if match and len(match.group(2)) <= 3:
+            name = match.group(3)
+            if name != "main":
+                packages[name] = max(packages.get(name, 0), int(match.group(1)))
+    ranked = sorted(packages.items(), key=lambda item: -item[1])[:count]
+    return [{"module": name, "ms": microseconds / 1000} for name, microseconds in ranked]
+
+def time_to_ready(workdir: str, timeout: float = 60) -> Dict[str, float]:
+    port = free_port()
+    environment = {**os.environ, "PYTHONPATH": BACKEND_DIR}
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, env=environment, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    result: Dict[str, float] = {}
+    try:
+        while time.perf_counter() - started < timeout and "ready" not in result:
+            try:
+                if "listening" not in result:
+                    httpx.get(f"http://127.0.0.1:{port}/", timeout=1)
+                    result["listening"] = time.perf_counter() - started
+                if httpx.get(f"http://127.0.0.1:{port}/ready", timeout=1).status_code == 200:
+                    result["ready"] = time.perf_counter() - started
+            except httpx.TransportError:
+                pass
+            time.sleep(0.01)
+    finally:
+        process.terminate()
+        process.wait(timeout=15)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark backend import time and time to ready")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="Slowest imports to list")
+    parser.add_argument("--max-import-seconds", type=float, help="Fail if the median import time is above this")
+    parser.add_argument("--output", help="Write the JSON report here")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        imports = [import_time(workdir) for _ in range(args.runs)]
+        startups = [time_to_ready(workdir) for _ in range(args.runs)]
+        slowest = top_imports(workdir, args.top)
+
+    import_seconds = [run["seconds"] for run in imports]
+    report = {
+        "import_seconds": {"median": float(np.median(import_seconds)), "max": max(import_seconds)},
+        "loaded_at_import": {key: imports[0][key] for key in ("genai_loaded", "sqlalchemy_loaded", "pil_loaded")},
+        "listening_seconds": float(np.median([run.get("listening", np.nan) for run in startups])),
+        "ready_seconds": float(np.median([run.get("ready", np.nan) for run in startups])),
+        "slowest_imports": slowest
+    }
+    print(f"import main: median {report['import_seconds']['median']:.2f}s, max {report['import_seconds']['max']:.2f}s")
+    print(f"loaded at import: {report['loaded_at_import']}")
+    print(f"server listening after {report['listening_seconds']:.2f}s, ready after {report['ready_seconds']:.2f}s")
+    for entry in slowest:
+        print(f"  {entry['module']:<32} {entry['ms']:8.1f}ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.max_import_seconds is not None and report["import_seconds"]["median"] > args.max_import_seconds:
+        print(f"Import time above {args.max_import_seconds}s", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Throughput scaling of the multi-worker server from 1 to N worker processes.
+
+For each worker count, gunicorn is started from gunicorn.conf.py (preloaded
+app, uvicorn workers, shared cache) with GenerativeModel routed to a local
+fake Gemini endpoint, and driven with run_benchmark's load generator. The
+report gives throughput, latency and speedup over one worker.
+
+The load generator runs in this process on one core; leave a core free for
+it, or its own ceiling shows up as the server's.
+
+Usage:
+    python benchmarks/bench_workers.py --workers 1 2 4 8
+    python benchmarks/bench_workers.py --scenario read-heavy --requests 2000
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+from typing import Any, Dict
+
+import numpy as np
+
+from run_benchmark import BENCHMARK_DIR, BACKEND_DIR, SCENARIOS, drive, free_port, start_process, wait_until_ready
+
+# Fast provider, so the app's own CPU work (image decoding and re-encoding, serialization) dominates
+SCALING_SCENARIOS: Dict[str, Dict[str, Any]] = {
+    "analyze": {
+        "mix": {"/analyze": 1},
+        "requests": 400,
+        "concurrency": 16,
+        "form": {"detect_type": "2D bounding boxes"},
+        "fake": {"latency_p50": 0.05, "latency_sigma": 0, "detections": 20}
+    },
+    "read-heavy": {**SCENARIOS["read-heavy"], "requests": 2000, "concurrency": 64},
+}
+
+def serve(port: int, workers: int, fake_url: str):
+    """Run gunicorn with the repo's config and the fake provider installed before the workers fork"""
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+    os.environ.setdefault("SHARED_CACHE_PATH", os.path.abspath("shared-cache.db"))
+    sys.path.insert(0, BACKEND_DIR)
+    from gunicorn.app.base import Application
+
+    class BenchmarkServer(Application):
+        def init(self, parser, opts, args):
+            return {}
+
+        def load_config(self):
+            self.load_config_from_file(os.path.join(BACKEND_DIR, "gunicorn.conf.py"))
+            self.cfg.set("bind", f"127.0.0.1:{port}")
+            self.cfg.set("workers", workers)
+            self.cfg.set("loglevel", "warning")
+
+        def load(self):
+            import fake_gemini
+            import main
+
+            fake_gemini.install(fake_url, main.genai)
+            return main.app
+
+    BenchmarkServer().run()
+
+def run_workers(scenario: Dict[str, Any], workers: int, seed: int) -> Dict[str, Any]:
+    fake_port, app_port = free_port(), free_port()
+    with tempfile.TemporaryDirectory() as workdir:
+        fake = start_process(
+            [os.path.join(BENCHMARK_DIR, "fake_gemini.py"), "--port", str(fake_port),
+             "--config", json.dumps({**scenario.get("fake", {}), "seed": seed})],
+            workdir
+        )
+        app = start_process(
+            [os.path.abspath(__file__), "--serve", str(app_port), str(workers), f"http://127.0.0.1:{fake_port}"],
+            workdir
+        )
+        try:
+            wait_until_ready(f"http://127.0.0.1:{fake_port}/stats")
+            wait_until_ready(f"http://127.0.0.1:{app_port}/", timeout=60)
+            result = asyncio.run(drive(f"http://127.0.0.1:{app_port}", scenario, seed))
+        finally:
+            # gunicorn stops gracefully on SIGTERM
+            app.send_signal(signal.SIGTERM)
+            fake.send_signal(signal.SIGINT)
+            for process in (app, fake):
+                try:
+                    process.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+    latencies = result["latencies"] * 1000
+    p50, p99 = np.percentile(latencies, [50, 99]).tolist()
+    return {
+        "workers": workers,
+        "throughput": len(latencies) / result["wall_time"],
+        "latency_ms": {"p50": p50, "p99": p99},
+        "errors": int(result["errors"])
+    }
+
+def main():
+    if len(sys.argv) == 5 and sys.argv[1] == "--serve":
+        serve(int(sys.argv[2]), int(sys.argv[3]), sys.argv[4])
+        return
+
+    parser = argparse.ArgumentParser(description="Benchmark throughput scaling across worker processes")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--scenario", choices=SCALING_SCENARIOS, action="append")
+    parser.add_argument("--requests", type=int, help="Override the request count")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report here")
+    args = parser.parse_args()
+    print(f"{os.cpu_count()} CPUs", file=sys.stderr)
+
+    report = {}
+    for name in args.scenario or list(SCALING_SCENARIOS):
+        scenario = dict(SCALING_SCENARIOS[name])
+        if args.requests:
+            scenario["requests"] = args.requests
+        print(f"{name}:", file=sys.stderr)
+        report[name] = []
+        for workers in args.workers:
+            result = run_workers(scenario, workers, args.seed)
+            result["speedup"] = result["throughput"] / report[name][0]["throughput"] if report[name] else 1.0
+            report[name].append(result)
+            print(
+                f"  {workers:>3} workers  {result['throughput']:8.1f} req/s  x{result['speedup']:.2f}  "
+                f"p50 {result['latency_ms']['p50']:6.0f}ms  p99 {result['latency_ms']['p99']:6.0f}ms  "
+                f"{result['errors']} errors",
+                file=sys.stderr
+            )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,429 @@
+"""
+Offline evaluation of image size and encoding against accuracy and latency.
+
+Runs a labeled image set through the app's detection pipeline (the resize
+and encoding of /analyze, then run_detection) for every combination of
+maximum size, image format and detect type. Detections are scored against
+the ground truth and reported with latency and payload size, with the
+Pareto-optimal settings of each detect type marked (accuracy against
+encode-plus-call time and payload) and the fastest one within --tolerance
+of the best accuracy recommended as the default.
+
+Providers:
+    simulated  In-process stand-in that answers from the ground truth. Its
+               localization noise and misses grow as the image it receives
+               shrinks or is compressed harder, and its latency follows the
+               image's token count and bytes. It exercises the harness and shows
+               the shape of the trade-off, not Gemini's actual accuracy.
+    gemini     The real API (GEMINI_API_KEY). Set GEMINI_RECORD_PATH to record
+               the responses.
+    replay     Responses recorded by a gemini run (--archive), replayed with
+               their recorded latency, so the grid can be re-scored offline.
+
+The dataset is a directory with images and a COCO annotations file, as
+written by `export.py --format coco --images reference --image-dir <dir>`.
+Keypoint annotations are point truths. Without --dataset a synthetic set of
+shapes is generated.
+
+Usage:
+    python benchmarks/eval_resolution.py --synthetic 20
+    GEMINI_RECORD_PATH=eval.jsonl.gz python benchmarks/eval_resolution.py --dataset data/ --provider gemini
+    python benchmarks/eval_resolution.py --dataset data/ --provider replay --archive eval.jsonl.gz
+"""
+import argparse
+import asyncio
+import base64
+import contextvars
+import io
+import json
+import logging
+import math
+import os
+import sys
+import tempfile
+import time
+import zlib
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+
+DETECT_TYPES = ["2D bounding boxes", "Points", "Segmentation masks"]
+DEFAULT_SIZES = [384, 512, 640, 768, 800, 1024]
+DEFAULT_FORMATS = ["PNG", "JPEG:90", "JPEG:75", "WEBP:80"]
+
+# A box match needs this IoU; a point hits when inside the truth box or this close to its center
+IOU_THRESHOLD = 0.5
+POINT_RADIUS = 0.03
+
+class Truth(NamedTuple):
+    """One labeled image; boxes are normalized (label, x, y, width, height), points have zero size"""
+    name: str
+    data: bytes
+    width: int
+    height: int
+    boxes: List[Tuple[str, float, float, float, float]]
+
+# Truth of the image being analyzed, for the simulated provider
+current_truth: contextvars.ContextVar = contextvars.ContextVar("current_truth")
+
+def parse_format(spec: str) -> Tuple[str, int]:
+    """"JPEG:85" -> ("JPEG", 85)"""
+    name, _, quality = spec.partition(":")
+    return name.upper(), int(quality or 90)
+
+def synthetic_dataset(count: int, seed: int, size: Tuple[int, int] = (1280, 960)) -> List[Truth]:
+    """Shapes from 12 to 300 pixels on a textured background, saved as camera-like JPEGs"""
+    rng = np.random.default_rng(seed)
+    labels = ["box", "disc", "bar"]
+    truths = []
+    for index in range(count):
+        texture = rng.integers(60, 200, size=(size[1] // 16, size[0] // 16, 3), dtype=np.uint8)
+        image = Image.fromarray(texture).resize(size, Image.Resampling.BICUBIC)
+        draw = ImageDraw.Draw(image)
+        boxes = []
+        for _ in range(int(rng.integers(3, 12))):
+            side = float(np.exp(rng.uniform(np.log(12), np.log(300))))
+            width, height = side * rng.uniform(0.6, 1.4), side * rng.uniform(0.6, 1.4)
+            x, y = rng.uniform(0, size[0] - width), rng.uniform(0, size[1] - height)
+            label = labels[int(rng.integers(len(labels)))]
+            color = tuple(int(c) for c in rng.integers(0, 256, size=3))
+            shape = [x, y, x + width, y + height]
+            if label == "disc":
+                draw.ellipse(shape, fill=color)
+            else:
+                draw.rectangle(shape, fill=color)
+            boxes.append((label, x / size[0], y / size[1], width / size[0], height / size[1]))
+        buffered = io.BytesIO()
+        image.save(buffered, format="JPEG", quality=95)
+        truths.append(Truth(f"synthetic-{index}.jpg", buffered.getvalue(), size[0], size[1], boxes))
+    return truths
+
+def load_dataset(directory: str, annotations_file: Optional[str] = None) -> List[Truth]:
+    """Images and boxes/keypoints of a COCO annotations file in directory"""
+    if annotations_file is None:
+        candidates = [name for name in sorted(os.listdir(directory)) if name.endswith(".json")]
+        if not candidates:
+            raise FileNotFoundError(f"No COCO annotations file in {directory}")
+        annotations_file = os.path.join(directory, candidates[0])
+    with open(annotations_file) as f:
+        coco = json.load(f)
+
+    categories = {category["id"]: category["name"] for category in coco.get("categories", [])}
+    boxes: Dict[int, list] = {}
+    for annotation in coco.get("annotations", []):
+        image = annotation["image_id"]
+        x, y, width, height = annotation["bbox"]
+        if annotation.get("keypoints"):
+            x, y, width, height = annotation["keypoints"][0], annotation["keypoints"][1], 0, 0
+        boxes.setdefault(image, []).append((categories.get(annotation["category_id"], "object"), x, y, width, height))
+
+    truths = []
+    for image in coco["images"]:
+        # export.py with --image-dir references the written file in image_url
+        path = next(
+            (os.path.join(directory, name) for name in (image.get("file_name"), image.get("image_url"))
+             if name and os.path.isfile(os.path.join(directory, name))),
+            None
+        )
+        if path is None:
+            logging.warning(f"Image {image['id']} not found in {directory}, skipping")
+            continue
+        with open(path, "rb") as f:
+            data = f.read()
+        width, height = image["width"], image["height"]
+        truths.append(Truth(os.path.basename(path), data, width, height, [
+            (label, x / width, y / height, w / width, h / height) for label, x, y, w, h in boxes.get(image["id"], [])
+        ]))
+    return truths
+
+def box_iou(a: Tuple[float, ...], b: Tuple[float, ...]) -> float:
+    """IoU of two (x, y, width, height) boxes"""
+    inter_w = min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0])
+    inter_h = min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1])
+    if inter_w <= 0 or inter_h <= 0:
+        return 0.0
+    inter = inter_w * inter_h
+    return inter / (a[2] * a[3] + b[2] * b[3] - inter)
+
+def f1_score(matches: int, predicted: int, expected: int) -> float:
+    if not predicted and not expected:
+        return 1.0
+    return 2 * matches / (predicted + expected)
+
+def score_boxes(predicted: List[Tuple[float, ...]], truth: List[Tuple[float, ...]]) -> Dict[str, float]:
+    """F1 at IOU_THRESHOLD and mean IoU per truth box (0 when missed), greedy by IoU"""
+    pairs = sorted(
+        ((box_iou(p, t), i, j) for i, p in enumerate(predicted) for j, t in enumerate(truth)),
+        reverse=True
+    )
+    used_p, used_t, ious = set(), set(), []
+    for iou, i, j in pairs:
+        if iou <= 0:
+            break
+        if i not in used_p and j not in used_t:
+            used_p.add(i)
+            used_t.add(j)
+            ious.append(iou)
+    matches = sum(1 for iou in ious if iou >= IOU_THRESHOLD)
+    return {
+        "accuracy": f1_score(matches, len(predicted), len(truth)),
+        "mean_iou": sum(ious) / len(truth) if truth else 1.0
+    }
+
+def score_points(predicted: List[Tuple[float, float]], truth: List[Tuple[float, ...]]) -> Dict[str, float]:
+    """F1 of points inside (or within POINT_RADIUS of) a truth box, and mean distance to its center"""
+    pairs = []
+    for i, (px, py) in enumerate(predicted):
+        for j, (x, y, width, height) in enumerate(truth):
+            distance = math.hypot(px - (x + width / 2), py - (y + height / 2))
+            inside = x <= px <= x + width and y <= py <= y + height
+            if inside or distance <= POINT_RADIUS:
+                pairs.append((distance, i, j))
+    used_p, used_t, distances = set(), set(), []
+    for distance, i, j in sorted(pairs):
+        if i not in used_p and j not in used_t:
+            used_p.add(i)
+            used_t.add(j)
+            distances.append(distance)
+    return {
+        "accuracy": f1_score(len(distances), len(predicted), len(truth)),
+        "mean_distance": sum(distances) / len(distances) if distances else None
+    }
+
+def score(detect_type: str, detections: List[dict], truth: Truth) -> Dict[str, float]:
+    truth_boxes = [box[1:] for box in truth.boxes]
+    if detect_type == "Points":
+        return score_points([(d["point"]["x"], d["point"]["y"]) for d in detections], truth_boxes)
+    # Segmentation masks are scored by their boxes
+    return score_boxes([(d["x"], d["y"], d["width"], d["height"]) for d in detections], truth_boxes)
+
+class SimulatedGenerativeModel:
+    """
+    Drop-in for genai.GenerativeModel answering from current_truth.
+
+    What it sees is what the app sends: detection probability falls for
+    objects under about 10 pixels in the received image, box edges are off
+    by 1.5 pixels plus up to 2 more for heavily compressed images (few bits
+    per pixel), and latency is 0.3 s plus 0.5 ms per image token (258 per
+    768-pixel tile, as Gemini counts them) plus upload at 4 MB/s.
+    """
+
+    def __init__(self, model_name: str, tools: Optional[list] = None, **kwargs):
+        self.model_name = model_name
+        self.tools = tools or []
+
+    @classmethod
+    def from_cached_content(cls, cached_content, **kwargs):
+        return cls(getattr(cached_content, "model", "gemini-2.5-flash"), getattr(cached_content, "tools", None))
+
+    async def generate_content_async(self, contents: list, generation_config: Any = None, **kwargs):
+        from google.generativeai.types import generation_types
+        import google.generativeai as genai
+        from fake_gemini import FUNCTION_KEYS
+
+        image = next(content for content in contents if isinstance(content, dict))
+        prompt = " ".join(content for content in contents if isinstance(content, str))
+        payload = base64.b64decode(image["data"])
+        received = Image.open(io.BytesIO(payload))
+        width, height = received.size
+        rng = np.random.default_rng(zlib.crc32(payload) ^ zlib.crc32(prompt.encode()))
+
+        tiles = 1 if max(width, height) <= 384 else math.ceil(width / 768) * math.ceil(height / 768)
+        latency = 0.3 + 0.0005 * 258 * tiles + len(payload) / 4e6
+        await asyncio.sleep(latency * float(np.exp(rng.normal(0, 0.1))))
+
+        bits_per_pixel = len(payload) * 8 / (width * height)
+        noise = 1.5 + 2.0 * max(0.0, 1 - bits_per_pixel)
+        detections = []
+        for label, x, y, w, h in current_truth.get().boxes:
+            side = min(w * width, h * height) if w and h else 16
+            found = 1 / (1 + math.exp(-(side - 10) / 3))
+            if rng.random() > found:
+                continue
+            x0, x1 = np.clip(np.array([x, x + w]) + rng.normal(0, noise / width, 2), 0, 1)
+            y0, y1 = np.clip(np.array([y, y + h]) + rng.normal(0, noise / height, 2), 0, 1)
+            x0, x1, y0, y1 = (round(float(v) * 1000) for v in (min(x0, x1), max(x0, x1), min(y0, y1), max(y0, y1)))
+            detection = {"label": label, "confidence": round(found, 3), "box_2d": [y0, x0, y1, x1]}
+            detections.append(detection)
+
+        if self.tools:
+            key = FUNCTION_KEYS[self.tools[0].function_declarations[0].name]
+            if key == "point":
+                for detection in detections:
+                    ymin, xmin, ymax, xmax = detection.pop("box_2d")
+                    detection["point"] = [(ymin + ymax) // 2, (xmin + xmax) // 2]
+            part = {"functionCall": {"name": self.tools[0].function_declarations[0].name, "args": {"detections": detections}}}
+        else:
+            part = {"text": "```json\n" + json.dumps(detections) + "\n```"}
+
+        body = {
+            "candidates": [{"content": {"role": "model", "parts": [part]}, "finishReason": "STOP"}],
+            "usageMetadata": {"promptTokenCount": 258 * tiles, "candidatesTokenCount": 20 * len(detections)}
+        }
+        proto = genai.protos.GenerateContentResponse.from_json(json.dumps(body), ignore_unknown_fields=True)
+        return generation_types.AsyncGenerateContentResponse.from_response(proto)
+
+def pareto_front(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Rows no other row beats on accuracy, latency and payload at once"""
+    def dominates(a, b):
+        no_worse = (
+            a["accuracy"] >= b["accuracy"] and a["total_p50"] <= b["total_p50"]
+            and a["payload_bytes"] <= b["payload_bytes"]
+        )
+        better = (
+            a["accuracy"] > b["accuracy"] or a["total_p50"] < b["total_p50"]
+            or a["payload_bytes"] < b["payload_bytes"]
+        )
+        return no_worse and better
+    return [row for row in rows if not any(dominates(other, row) for other in rows)]
+
+def recommend(rows: List[Dict[str, Any]], tolerance: float) -> Dict[str, Any]:
+    """Fastest setting within tolerance of the best accuracy"""
+    best = max(row["accuracy"] for row in rows)
+    eligible = [row for row in rows if row["accuracy"] >= best - tolerance]
+    return min(eligible, key=lambda row: (row["total_p50"], row["payload_bytes"]))
+
+async def evaluate(main, truths: List[Truth], detect_types: List[str], sizes: List[int],
+                   formats: List[str], concurrency: int, prompt: str) -> List[Dict[str, Any]]:
+    """One sample per image, size, format and detect type"""
+    semaphore = asyncio.Semaphore(concurrency)
+    samples = []
+
+    async def run(truth: Truth, img_base64: str, detect_type: str, sample: Dict[str, Any]):
+        async with semaphore:
+            current_truth.set(truth)
+            model_name = main.model_router.primary_model(detect_type)
+            started = time.perf_counter()
+            try:
+                detections = await main.run_detection(img_base64, detect_type, prompt, "", "English", 0.4, model_name)
+            except Exception as e:
+                logging.warning(f"{truth.name} {detect_type} {sample['max_size']} {sample['format']} failed: {e}")
+                sample.update(latency=time.perf_counter() - started, error=str(e), accuracy=0.0)
+            else:
+                sample["latency"] = time.perf_counter() - started
+                sample.update(score(detect_type, detections, truth))
+            sample["total"] = sample["encode_ms"] / 1000 + sample["latency"]
+
+    for truth in truths:
+        # Encode every variant of one image before its calls, so encoding never delays a timed call
+        variants = []
+        for size in sizes:
+            for spec in formats:
+                image_format, quality = parse_format(spec)
+                started = time.perf_counter()
+                img_base64 = main.convert_image_to_base64(truth.data, size, False, image_format, quality)
+                encode_ms = (time.perf_counter() - started) * 1000
+                variants.append((size, spec, img_base64, encode_ms))
+
+        tasks = []
+        for size, spec, img_base64, encode_ms in variants:
+            for detect_type in detect_types:
+                sample = {
+                    "image": truth.name, "detect_type": detect_type, "max_size": size, "format": spec,
+                    "payload_bytes": len(img_base64), "encode_ms": encode_ms
+                }
+                samples.append(sample)
+                tasks.append(run(truth, img_base64, detect_type, sample))
+        await asyncio.gather(*tasks)
+    return samples
+
+def summarize(samples: List[Dict[str, Any]], tolerance: float) -> Dict[str, Any]:
+    """Per detect type: one row per setting, its Pareto front and the recommended setting"""
+    report = {}
+    for detect_type in dict.fromkeys(sample["detect_type"] for sample in samples):
+        rows = []
+        settings = dict.fromkeys((s["max_size"], s["format"]) for s in samples if s["detect_type"] == detect_type)
+        for size, spec in settings:
+            group = [s for s in samples if s["detect_type"] == detect_type and s["max_size"] == size and s["format"] == spec]
+            latencies = np.array([s["latency"] for s in group])
+            totals = np.array([s["total"] for s in group])
+            secondary = "mean_distance" if detect_type == "Points" else "mean_iou"
+            values = [s[secondary] for s in group if s.get(secondary) is not None]
+            rows.append({
+                "max_size": size,
+                "format": spec,
+                "accuracy": float(np.mean([s["accuracy"] for s in group])),
+                secondary: float(np.mean(values)) if values else None,
+                "latency_p50": float(np.percentile(latencies, 50)),
+                "latency_p95": float(np.percentile(latencies, 95)),
+                "total_p50": float(np.percentile(totals, 50)),
+                "payload_bytes": float(np.mean([s["payload_bytes"] for s in group])),
+                "encode_ms": float(np.mean([s["encode_ms"] for s in group])),
+                "errors": sum(1 for s in group if "error" in s)
+            })
+        front = pareto_front(rows)
+        for row in rows:
+            row["pareto"] = row in front
+        report[detect_type] = {"settings": rows, "recommended": recommend(rows, tolerance)}
+    return report
+
+def print_report(report: Dict[str, Any]):
+    for detect_type, result in report.items():
+        print(f"\n{detect_type}")
+        secondary = "mean_distance" if detect_type == "Points" else "mean_iou"
+        print(f"  {'size':>5} {'format':<9} {'accuracy':>8} {secondary:>13} {'encode ms':>10} "
+              f"{'call p50':>9} {'call p95':>9} {'total p50':>10} {'payload KB':>11}")
+        for row in result["settings"]:
+            value = f"{row[secondary]:.3f}" if row[secondary] is not None else "-"
+            print(f"{'*' if row['pareto'] else ' '} {row['max_size']:>5} {row['format']:<9} {row['accuracy']:>8.3f} "
+                  f"{value:>13} {row['encode_ms']:>10.1f} {row['latency_p50']:>9.2f} {row['latency_p95']:>9.2f} "
+                  f"{row['total_p50']:>10.2f} {row['payload_bytes'] / 1024:>11.0f}")
+        best = result["recommended"]
+        print(f"  recommended: {best['max_size']}px {best['format']} (* = Pareto-optimal)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate image size and format against accuracy, latency and payload")
+    parser.add_argument("--dataset", help="Directory with images and a COCO annotations file")
+    parser.add_argument("--annotations", help="COCO annotations file (default: the first .json in --dataset)")
+    parser.add_argument("--synthetic", type=int, default=12, help="Synthetic images when no --dataset is given")
+    parser.add_argument("--provider", choices=["simulated", "gemini", "replay"], default="simulated")
+    parser.add_argument("--archive", help="Recorded responses for --provider replay")
+    parser.add_argument("--detect-types", nargs="+", default=DETECT_TYPES)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--formats", nargs="+", default=DEFAULT_FORMATS, help="PNG, JPEG:<quality> or WEBP:<quality>")
+    parser.add_argument("--prompt", help="Target prompt (default: the dataset's labels)")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--tolerance", type=float, default=0.02, help="Accuracy the recommendation may give up")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report here")
+    args = parser.parse_args()
+
+    truths = load_dataset(args.dataset, args.annotations) if args.dataset else synthetic_dataset(args.synthetic, args.seed)
+    prompt = args.prompt or ", ".join(sorted({box[0] for truth in truths for box in truth.boxes})) or "items"
+
+    if args.provider == "replay":
+        if not args.archive:
+            parser.error("--provider replay needs --archive")
+        os.environ["GEMINI_REPLAY_PATH"] = os.path.abspath(args.archive)
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # main.py creates ./predictions.db on import
+        os.chdir(workdir)
+        sys.path.insert(0, BACKEND_DIR)
+        import main as app_main
+        logging.disable(logging.INFO)
+        if args.provider == "simulated":
+            app_main.genai.GenerativeModel = SimulatedGenerativeModel
+
+        started = time.perf_counter()
+        samples = asyncio.run(evaluate(
+            app_main, truths, args.detect_types, args.sizes, args.formats, args.concurrency, prompt
+        ))
+        print(f"{len(samples)} calls on {len(truths)} images in {time.perf_counter() - started:.0f}s ({args.provider} provider)")
+
+    report = summarize(samples, args.tolerance)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"provider": args.provider, "images": len(truths), "prompt": prompt,
+                       "report": report, "samples": samples}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
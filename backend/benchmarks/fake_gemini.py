@@ -0,0 +1,378 @@
+"""
+Local stand-in for the Gemini generateContent endpoint.
+
+The fake server answers REST-shaped generateContent requests with
+deterministic synthetic detections after a latency drawn from a
+configurable distribution (plus a cost per output token), and fails a
+configurable share of calls. Answers longer than the request's
+maxOutputTokens are cut off with finishReason MAX_TOKENS. /stats counts
+the generationConfig fields received, to check what the SDK really sends.
+cachedContents can be created, extended and deleted; a request naming
+one gets its contents and tools prepended, and only pays
+latency_per_input_token for the prompt tokens it did not cache.
+FakeGenerativeModel replaces genai.GenerativeModel in the app: it sends
+each request to the fake server over HTTP and parses the reply into the
+SDK's own response types, so the app's parsing and formatting code runs
+exactly as it does against the real API.
+"""
+import asyncio
+import base64
+import io
+import json
+import threading
+import time
+import zlib
+from datetime import timedelta
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import httpx
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from PIL import Image
+from google.api_core import exceptions as api_exceptions
+import google.generativeai as genai
+from google.generativeai.types import generation_types
+from pydantic import BaseModel
+
+class FakeGeminiConfig(BaseModel):
+    """Behaviour of the fake endpoint"""
+    latency_p50: float = 0.5  # Median latency in seconds
+    latency_sigma: float = 0.4  # Log-normal shape; 0 gives a constant latency
+    error_rate: float = 0.0  # Share of calls answered with HTTP 500
+    detections: int = 10  # Detections per response
+    polygon_points: int = 64  # Vertices per segmentation polygon (function calling)
+    mask_size: int = 64  # Side of the base64 PNG masks in prompt-engineering segmentation
+    latency_per_token: float = 0.0  # Seconds added per output token, as generation time grows with length
+    latency_per_input_token: float = 0.0  # Seconds added per prompt token not served from a cached content
+    cache_min_tokens: int = 0  # Smallest cached content accepted, in tokens; smaller ones are a 400 as with Gemini
+    seed: int = 0
+
+FUNCTION_KEYS = {
+    "detect_2d_bounding_boxes": "box_2d",
+    "detect_3d_bounding_boxes": "box_3d",
+    "detect_segmentation_masks": "polygon",
+    "detect_key_points": "point",
+}
+
+def make_detections(kind: str, count: int, config: FakeGeminiConfig, rng: np.random.Generator) -> List[Dict[str, Any]]:
+    """Synthetic detections in Gemini's 0-1000 coordinate space"""
+    detections = []
+    for i in range(count):
+        ymin, xmin = rng.integers(0, 800, size=2).tolist()
+        height, width = rng.integers(20, 200, size=2).tolist()
+        box = [ymin, xmin, ymin + height, xmin + width]
+        detection = {"label": f"object {i % 5}", "confidence": round(float(rng.uniform(0.3, 1.0)), 3)}
+
+        if kind == "point":
+            detection["point"] = [ymin + height // 2, xmin + width // 2]
+        elif kind == "box_3d":
+            detection["box_3d"] = rng.uniform(-2, 2, size=6).round(3).tolist() + rng.uniform(-90, 90, size=3).round(1).tolist()
+        elif kind == "polygon":
+            angles = np.linspace(0, 2 * np.pi, config.polygon_points, endpoint=False)
+            detection["box_2d"] = box
+            detection["polygon"] = np.stack([
+                xmin + width / 2 * (1 + np.cos(angles)),
+                ymin + height / 2 * (1 + np.sin(angles))
+            ], axis=1).round(1).tolist()
+        elif kind == "mask":
+            mask = Image.fromarray((rng.random((config.mask_size, config.mask_size)) > 0.5).astype(np.uint8) * 255)
+            buffered = io.BytesIO()
+            mask.save(buffered, format="PNG")
+            detection["box_2d"] = box
+            detection["mask"] = "data:image/png;base64," + base64.b64encode(buffered.getvalue()).decode()
+        else:
+            detection["box_2d"] = box
+        detections.append(detection)
+    return detections
+
+def count_tokens(contents: list) -> int:
+    """Rough prompt tokens: 4 characters of text, or 1000 base64 characters of inline data, per token"""
+    return sum(
+        len(part.get("inlineData", {}).get("data", "")) // 1000 + len(part.get("text", "")) // 4
+        for content in contents for part in content.get("parts", [])
+    )
+
+def error_response(code: int, status: str, message: str) -> JSONResponse:
+    return JSONResponse(status_code=code, content={"error": {"code": code, "message": message, "status": status}})
+
+def create_fake_app(config: FakeGeminiConfig) -> FastAPI:
+    app = FastAPI(title="Fake Gemini")
+    app.state.config = config
+    app.state.calls = 0
+    app.state.generation_config_fields = Counter()
+    app.state.caches = {}
+    app.state.cache_stats = Counter()
+
+    @app.post("/v1beta/cachedContents")
+    async def create_cached_content(request: Request):
+        body = await request.json()
+        tokens = count_tokens(body.get("contents", []))
+        if tokens < app.state.config.cache_min_tokens:
+            return error_response(400, "INVALID_ARGUMENT", f"Cached content is too small: {tokens} tokens")
+        app.state.cache_stats["created"] += 1
+        name = f"cachedContents/fake-{app.state.cache_stats['created']}"
+        app.state.caches[name] = {
+            "contents": body.get("contents", []), "tools": body.get("tools", []), "tokens": tokens,
+            "expires": time.time() + float(body.get("ttl", "3600s").rstrip("s"))
+        }
+        return {"name": name, "model": body.get("model"), "usageMetadata": {"totalTokenCount": tokens}}
+
+    @app.patch("/v1beta/cachedContents/{cache_id}")
+    async def update_cached_content(cache_id: str, request: Request):
+        body = await request.json()
+        cached = app.state.caches.get(f"cachedContents/{cache_id}")
+        if cached is None or cached["expires"] < time.time():
+            return error_response(404, "NOT_FOUND", f"Cached content {cache_id} not found")
+        app.state.cache_stats["updated"] += 1
+        cached["expires"] = time.time() + float(body.get("ttl", "3600s").rstrip("s"))
+        return {"name": f"cachedContents/{cache_id}"}
+
+    @app.delete("/v1beta/cachedContents/{cache_id}")
+    async def delete_cached_content(cache_id: str):
+        if app.state.caches.pop(f"cachedContents/{cache_id}", None) is None:
+            return error_response(404, "NOT_FOUND", f"Cached content {cache_id} not found")
+        app.state.cache_stats["deleted"] += 1
+        return {}
+
+    @app.post("/v1beta/models/{model}:generateContent")
+    async def generate_content(model: str, request: Request):
+        body = await request.json()
+        config = app.state.config
+        app.state.calls += 1
+        app.state.generation_config_fields.update(body.get("generationConfig", {}).keys())
+        cached_tokens = 0
+        if "cachedContent" in body:
+            cached = app.state.caches.get(body.pop("cachedContent"))
+            if cached is None or cached["expires"] < time.time():
+                app.state.cache_stats["misses"] += 1
+                return error_response(404, "NOT_FOUND", "Cached content not found or expired")
+            app.state.cache_stats["hits"] += 1
+            cached_tokens = cached["tokens"]
+            body["contents"] = cached["contents"] + body.get("contents", [])
+            body["tools"] = body.get("tools") or cached["tools"]
+        # Seed from the request so every run sees the same latency and payload for the same request
+        request_seed = zlib.crc32(json.dumps(body, sort_keys=True).encode()) ^ config.seed
+        rng = np.random.default_rng(request_seed)
+
+        latency = config.latency_p50 * float(np.exp(rng.normal(0, config.latency_sigma))) if config.latency_sigma else config.latency_p50
+        failed = rng.random() < config.error_rate
+
+        tools = [declaration["name"] for tool in body.get("tools", []) for declaration in tool.get("functionDeclarations", [])]
+        if tools:
+            parts = [
+                {"functionCall": {"name": name, "args": {"detections": make_detections(FUNCTION_KEYS[name], config.detections, config, rng)}}}
+                for name in tools if name in FUNCTION_KEYS
+            ]
+        else:
+            prompt = " ".join(part.get("text", "") for content in body.get("contents", []) for part in content.get("parts", []))
+            if "segment" in prompt:
+                kind = "mask"
+            elif "box_3d" in prompt:
+                kind = "box_3d"
+            elif "point" in prompt and "box_2d" not in prompt:
+                kind = "point"
+            else:
+                kind = "box_2d"
+            parts = [{"text": "```json\n" + json.dumps(make_detections(kind, config.detections, config, rng)) + "\n```"}]
+
+        # About 4 characters per token; a cut-off function call is dropped, cut-off text kept
+        output_tokens = len(json.dumps(parts)) // 4
+        max_output_tokens = body.get("generationConfig", {}).get("maxOutputTokens")
+        finish_reason = "STOP"
+        if max_output_tokens and output_tokens > max_output_tokens:
+            finish_reason = "MAX_TOKENS"
+            output_tokens = max_output_tokens
+            parts = [{"text": part["text"][:max_output_tokens * 4]} for part in parts if "text" in part]
+        prompt_tokens = count_tokens(body.get("contents", []))
+        await asyncio.sleep(
+            latency + config.latency_per_input_token * (prompt_tokens - cached_tokens) + config.latency_per_token * output_tokens
+        )
+
+        if failed:
+            return error_response(500, "INTERNAL", "Fake Gemini error")
+
+        return {
+            "candidates": [{"content": {"role": "model", "parts": parts}, "finishReason": finish_reason}],
+            "usageMetadata": {
+                "promptTokenCount": prompt_tokens, "cachedContentTokenCount": cached_tokens,
+                "candidatesTokenCount": output_tokens, "totalTokenCount": prompt_tokens + output_tokens
+            }
+        }
+
+    @app.get("/stats")
+    async def stats():
+        # Calls that carried each generationConfig field, e.g. whether any sent a thinkingConfig
+        return {
+            "calls": app.state.calls, "generation_config_fields": dict(app.state.generation_config_fields),
+            "cached_contents": dict(app.state.cache_stats)
+        }
+
+    return app
+
+class FakeGeminiServer:
+    """Runs the fake endpoint with uvicorn on a background thread"""
+
+    def __init__(self, config: FakeGeminiConfig, host: str = "127.0.0.1", port: int = 0):
+        self.config = config
+        self.host = host
+        self.port = port
+        self._server: Optional[uvicorn.Server] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self) -> "FakeGeminiServer":
+        if not self.port:
+            import socket
+            with socket.socket() as sock:
+                sock.bind((self.host, 0))
+                self.port = sock.getsockname()[1]
+
+        self._server = uvicorn.Server(uvicorn.Config(
+            create_fake_app(self.config), host=self.host, port=self.port, log_level="warning"
+        ))
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.should_exit = True
+            self._thread.join(timeout=5)
+
+def tools_body(tools: Optional[list]) -> List[Dict[str, Any]]:
+    return [
+        {"functionDeclarations": [{"name": declaration.name} for declaration in tool.function_declarations]}
+        for tool in tools or []
+    ]
+
+class FakeCachedContent:
+    """Drop-in for genai.caching.CachedContent that talks to the fake endpoint (blocking, like the SDK)"""
+
+    base_url = "http://127.0.0.1:8001"
+
+    def __init__(self, name: str, model: str):
+        self.name = name
+        self.model = model
+
+    @classmethod
+    def _request(cls, method: str, path: str, body: Optional[dict] = None) -> Dict[str, Any]:
+        response = httpx.request(method, f"{cls.base_url}/v1beta/{path}", json=body, timeout=60)
+        if response.status_code != 200:
+            raise api_exceptions.from_http_status(response.status_code, response.text)
+        return response.json()
+
+    @classmethod
+    def create(cls, model: str, *, contents: Optional[list] = None, tools: Optional[list] = None,
+               ttl: Optional[timedelta] = None, **kwargs) -> "FakeCachedContent":
+        body = {
+            "model": model,
+            "contents": [
+                {"role": content.get("role", "user"), "parts": [
+                    {"inlineData": {"mimeType": part["inline_data"]["mime_type"], "data": part["inline_data"]["data"]}}
+                    if "inline_data" in part else part
+                    for part in content["parts"]
+                ]}
+                for content in contents or []
+            ],
+            "tools": tools_body(tools),
+            "ttl": f"{(ttl or timedelta(hours=1)).total_seconds()}s"
+        }
+        return cls(cls._request("POST", "cachedContents", body)["name"], model.removeprefix("models/"))
+
+    def update(self, *, ttl: Optional[timedelta] = None, **kwargs):
+        self._request("PATCH", self.name, {"ttl": f"{(ttl or timedelta(hours=1)).total_seconds()}s"})
+
+    def delete(self):
+        self._request("DELETE", self.name)
+
+class FakeGenerativeModel:
+    """Drop-in for genai.GenerativeModel that talks to the fake endpoint"""
+
+    base_url = "http://127.0.0.1:8001"
+    _client: Optional[httpx.AsyncClient] = None
+    _client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def __init__(self, model_name: str, tools: Optional[list] = None, **kwargs):
+        self.model_name = model_name
+        self.tools = tools or []
+        self.cached_content: Optional[str] = None
+
+    @classmethod
+    def from_cached_content(cls, cached_content, **kwargs):
+        # The image and tools live in the cached content; requests only name it
+        model = cls(cached_content.model)
+        model.cached_content = cached_content.name
+        return model
+
+    @classmethod
+    def client(cls) -> httpx.AsyncClient:
+        # Connections belong to one event loop; test clients may run each request in a new one
+        loop = asyncio.get_running_loop()
+        if cls._client is None or cls._client_loop is not loop:
+            cls._client = httpx.AsyncClient(base_url=cls.base_url, timeout=120)
+            cls._client_loop = loop
+        return cls._client
+
+    def _request_body(self, contents: list, generation_config: Any) -> Dict[str, Any]:
+        parts = []
+        for content in contents:
+            if isinstance(content, str):
+                parts.append({"text": content})
+            elif isinstance(content, dict) and "data" in content:
+                parts.append({"inlineData": {"mimeType": content["mime_type"], "data": content["data"]}})
+        body = {
+            "contents": [{"role": "user", "parts": parts}],
+            "tools": tools_body(self.tools),
+            "generationConfig": self._generation_config(generation_config)
+        }
+        if self.cached_content:
+            body["cachedContent"] = self.cached_content
+        return body
+
+    @staticmethod
+    def _generation_config(generation_config: Any) -> Dict[str, Any]:
+        """generationConfig as the SDK serializes it: fields it does not know are dropped, as on the real wire"""
+        if generation_config is None:
+            return {}
+        proto = genai.protos.GenerationConfig(generation_types.to_generation_config_dict(generation_config))
+        return json.loads(genai.protos.GenerationConfig.to_json(proto, including_default_value_fields=False))
+
+    async def generate_content_async(self, contents: list, generation_config: Any = None, **kwargs):
+        response = await self.client().post(
+            f"/v1beta/models/{self.model_name}:generateContent",
+            json=self._request_body(contents, generation_config)
+        )
+        if response.status_code != 200:
+            raise api_exceptions.from_http_status(response.status_code, response.text)
+        proto = genai.protos.GenerateContentResponse.from_json(response.text, ignore_unknown_fields=True)
+        return generation_types.AsyncGenerateContentResponse.from_response(proto)
+
+def install(base_url: str, target_module: Any = genai):
+    """Route every GenerativeModel and CachedContent created through target_module.genai to the fake endpoint"""
+    FakeGenerativeModel.base_url = base_url
+    FakeGenerativeModel._client = None
+    FakeCachedContent.base_url = base_url
+    target_module.GenerativeModel = FakeGenerativeModel
+    target_module.caching.CachedContent = FakeCachedContent
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the fake Gemini endpoint")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--config", default="{}", help="FakeGeminiConfig as JSON")
+    args = parser.parse_args()
+
+    uvicorn.run(
+        create_fake_app(FakeGeminiConfig(**json.loads(args.config))),
+        host=args.host, port=args.port, log_level="warning"
+    )
@@ -0,0 +1,314 @@
+"""
+End-to-end benchmark of the backend against a local fake Gemini endpoint.
+
+Each scenario starts the fake endpoint and the app in their own processes,
+drives the app over HTTP at a fixed concurrency and reports throughput,
+latency percentiles, error count, and the app process's CPU time and peak
+RSS. Scenarios are seeded, so two runs on the same commit send the same
+requests and see the same simulated provider behaviour.
+
+Usage:
+    python benchmarks/run_benchmark.py --output report.json
+    python benchmarks/run_benchmark.py --compare baseline.json --output report.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import httpx
+import numpy as np
+from PIL import Image
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCHMARK_DIR)
+
+# Each scenario: request mix (endpoint -> weight), load shape, form fields and fake provider behaviour
+SCENARIOS: Dict[str, Dict[str, Any]] = {
+    "analyze-2d": {
+        "mix": {"/analyze": 1},
+        "requests": 200,
+        "concurrency": 16,
+        "form": {"detect_type": "2D bounding boxes"},
+        "fake": {"latency_p50": 0.3, "latency_sigma": 0.4, "detections": 20}
+    },
+    "analyze-segmentation": {
+        "mix": {"/analyze": 1},
+        "requests": 100,
+        "concurrency": 16,
+        "form": {"detect_type": "Segmentation masks"},
+        "fake": {"latency_p50": 0.5, "latency_sigma": 0.4, "detections": 20, "mask_size": 128}
+    },
+    "overlay-2d": {
+        "mix": {"/analyze-with-overlay": 1},
+        "requests": 100,
+        "concurrency": 8,
+        "form": {"detect_type": "2D bounding boxes"},
+        "fake": {"latency_p50": 0.3, "latency_sigma": 0.4, "detections": 50}
+    },
+    "read-heavy": {
+        "mix": {"/history": 1, "/prediction/{id}": 4},
+        "requests": 500,
+        "concurrency": 32,
+        "seed_predictions": 50,
+        "form": {"detect_type": "2D bounding boxes"},
+        "fake": {"latency_p50": 0.05, "latency_sigma": 0, "detections": 20}
+    },
+    "flaky-provider": {
+        "mix": {"/analyze": 1},
+        "requests": 200,
+        "concurrency": 16,
+        "form": {"detect_type": "Points"},
+        "fake": {"latency_p50": 0.3, "latency_sigma": 0.8, "error_rate": 0.1, "detections": 20}
+    },
+}
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def make_images(count: int, size: tuple, seed: int) -> List[bytes]:
+    """Distinct JPEG images so near-duplicate reuse never short-circuits a request"""
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        # Blocky noise keeps the JPEG size realistic for a photo of this resolution
+        blocks = rng.integers(0, 256, size=(size[1] // 16, size[0] // 16, 3), dtype=np.uint8)
+        image = Image.fromarray(blocks).resize(size, Image.Resampling.BILINEAR)
+        buffered = io.BytesIO()
+        image.save(buffered, format="JPEG", quality=85)
+        images.append(buffered.getvalue())
+    return images
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def serve_app(port: int, fake_url: str, usage_path: str):
+    """Run the app with GenerativeModel routed to the fake endpoint (runs in the app process)"""
+    import uvicorn
+
+    sys.path.insert(0, BACKEND_DIR)
+    sys.path.insert(0, BENCHMARK_DIR)
+    import fake_gemini
+    import main
+
+    fake_gemini.install(fake_url, main.genai)
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    server.run()
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    rss_bytes = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+    with open(usage_path, "w") as f:
+        json.dump({"cpu_seconds": usage.ru_utime + usage.ru_stime, "peak_rss_mb": rss_bytes / 2**20}, f)
+
+def start_process(args: List[str], cwd: str) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, *args], cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def wait_until_ready(url: str, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.TransportError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not start within {timeout}s")
+
+async def send_request(client: httpx.AsyncClient, endpoint: str, index: int, scenario: Dict[str, Any],
+                       images: List[bytes], prediction_ids: List[int]) -> httpx.Response:
+    if endpoint == "/history":
+        return await client.get("/history", params={"limit": 50})
+    if endpoint == "/prediction/{id}":
+        return await client.get(f"/prediction/{prediction_ids[index % len(prediction_ids)]}")
+
+    form = {"target_prompt": "items", "reuse_threshold": "-1", **scenario.get("form", {})}
+    files = {"file": (f"image_{index}.jpg", images[index % len(images)], "image/jpeg")}
+    return await client.post(endpoint, data=form, files=files)
+
+def is_error(endpoint: str, response: httpx.Response) -> bool:
+    if response.status_code != 200:
+        return True
+    # Analysis endpoints report provider failures in the body
+    return endpoint.startswith("/analyze") and not response.json().get("success", False)
+
+async def drive(base_url: str, scenario: Dict[str, Any], seed: int) -> Dict[str, Any]:
+    """Send the scenario's requests at its concurrency; returns raw timings"""
+    rng = np.random.default_rng(seed)
+    mix = scenario["mix"]
+    endpoints = rng.choice(list(mix), size=scenario["requests"], p=np.array(list(mix.values())) / sum(mix.values()))
+    images = make_images(scenario.get("images", 32), tuple(scenario.get("image_size", (1280, 960))), seed)
+
+    latencies = np.zeros(len(endpoints))
+    errors = 0
+    async with httpx.AsyncClient(base_url=base_url, timeout=300) as client:
+        # Populate the database for read endpoints; not part of the measurement
+        prediction_ids = []
+        for i in range(scenario.get("seed_predictions", 0)):
+            response = await send_request(client, "/analyze", i, scenario, images, prediction_ids)
+            if response.status_code == 200 and response.json().get("prediction_id"):
+                prediction_ids.append(response.json()["prediction_id"])
+
+        queue = iter(enumerate(endpoints))
+
+        async def worker():
+            nonlocal errors
+            for index, endpoint in queue:
+                started = time.perf_counter()
+                try:
+                    response = await send_request(client, endpoint, index, scenario, images, prediction_ids)
+                    failed = is_error(endpoint, response)
+                except httpx.HTTPError:
+                    failed = True
+                latencies[index] = time.perf_counter() - started
+                errors += failed
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(scenario["concurrency"])))
+        wall_time = time.perf_counter() - started
+
+    return {"latencies": latencies, "errors": errors, "wall_time": wall_time}
+
+def run_scenario(name: str, scenario: Dict[str, Any], seed: int) -> Dict[str, Any]:
+    fake_port, app_port = free_port(), free_port()
+    with tempfile.TemporaryDirectory() as workdir:
+        usage_path = os.path.join(workdir, "usage.json")
+        fake = start_process(
+            [os.path.join(BENCHMARK_DIR, "fake_gemini.py"), "--port", str(fake_port),
+             "--config", json.dumps({**scenario.get("fake", {}), "seed": seed})],
+            workdir
+        )
+        # The app runs from the temp dir so it gets a fresh predictions.db
+        app = start_process(
+            [os.path.abspath(__file__), "--serve", str(app_port), f"http://127.0.0.1:{fake_port}", usage_path],
+            workdir
+        )
+        try:
+            wait_until_ready(f"http://127.0.0.1:{fake_port}/stats")
+            wait_until_ready(f"http://127.0.0.1:{app_port}/")
+            result = asyncio.run(drive(f"http://127.0.0.1:{app_port}", scenario, seed))
+        finally:
+            for process in (app, fake):
+                process.send_signal(signal.SIGINT)
+            for process in (app, fake):
+                try:
+                    process.wait(timeout=15)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+        usage = {"cpu_seconds": None, "peak_rss_mb": None}
+        if os.path.exists(usage_path):
+            with open(usage_path) as f:
+                usage = json.load(f)
+
+    latencies = result["latencies"] * 1000
+    p50, p90, p95, p99 = np.percentile(latencies, [50, 90, 95, 99]).tolist()
+    return {
+        "requests": len(latencies),
+        "concurrency": scenario["concurrency"],
+        "errors": int(result["errors"]),
+        "wall_time": result["wall_time"],
+        "throughput": len(latencies) / result["wall_time"],
+        "latency_ms": {"p50": p50, "p90": p90, "p95": p95, "p99": p99, "max": float(latencies.max())},
+        **usage
+    }
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any]) -> str:
+    """Table of relative changes against a baseline report"""
+    def change(new, old):
+        if new is None or not old:
+            return "n/a"
+        return f"{(new - old) / old:+.1%}"
+
+    lines = [f"{'scenario':<24}{'throughput':>12}{'p50':>10}{'p95':>10}{'cpu':>10}{'rss':>10}"]
+    for name, new in report["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if old is None:
+            lines.append(f"{name:<24}{'(new)':>12}")
+            continue
+        lines.append(
+            f"{name:<24}{change(new['throughput'], old['throughput']):>12}"
+            f"{change(new['latency_ms']['p50'], old['latency_ms']['p50']):>10}"
+            f"{change(new['latency_ms']['p95'], old['latency_ms']['p95']):>10}"
+            f"{change(new['cpu_seconds'], old['cpu_seconds']):>10}"
+            f"{change(new['peak_rss_mb'], old['peak_rss_mb']):>10}"
+        )
+    return "\n".join(lines)
+
+def main():
+    if len(sys.argv) == 5 and sys.argv[1] == "--serve":
+        serve_app(int(sys.argv[2]), sys.argv[3], sys.argv[4])
+        return
+
+    parser = argparse.ArgumentParser(description="Benchmark the backend against a fake Gemini endpoint")
+    parser.add_argument("--scenario", action="append", help="Scenario to run (repeatable); default all")
+    parser.add_argument("--scenarios-file", help="JSON file of scenarios to use instead of the built-in ones")
+    parser.add_argument("--requests", type=int, help="Override the request count of every scenario")
+    parser.add_argument("--concurrency", type=int, help="Override the concurrency of every scenario")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report here (default stdout)")
+    parser.add_argument("--compare", help="Baseline JSON report to compare against")
+    args = parser.parse_args()
+
+    scenarios = SCENARIOS
+    if args.scenarios_file:
+        with open(args.scenarios_file) as f:
+            scenarios = json.load(f)
+    selected = args.scenario or list(scenarios)
+    unknown = [name for name in selected if name not in scenarios]
+    if unknown:
+        parser.error(f"Unknown scenario(s): {', '.join(unknown)}. Available: {', '.join(scenarios)}")
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "scenarios": {}
+    }
+    for name in selected:
+        scenario = dict(scenarios[name])
+        if args.requests:
+            scenario["requests"] = args.requests
+        if args.concurrency:
+            scenario["concurrency"] = args.concurrency
+        print(f"Running {name}...", file=sys.stderr)
+        report["scenarios"][name] = {"config": scenario, **run_scenario(name, scenario, args.seed)}
+        summary = report["scenarios"][name]
+        print(
+            f"  {summary['throughput']:.1f} req/s, p50 {summary['latency_ms']['p50']:.0f}ms, "
+            f"p95 {summary['latency_ms']['p95']:.0f}ms, {summary['errors']} errors",
+            file=sys.stderr
+        )
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            print(compare(report, json.load(f)), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
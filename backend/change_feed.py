@@ -0,0 +1,197 @@
+"""
+Change feed of the prediction history.
+
+Triggers append a row to prediction_changes for every prediction created,
+updated or deleted, whichever code path or worker process writes it, in
+the same transaction. The row's seq is the feed cursor: it only grows, so
+a client that remembers the last seq it saw can ask for what happened
+since. Only the newest CHANGE_FEED_KEEP changes are kept; a cursor older
+than that is answered with reset, and the client reloads /history.
+"""
+import asyncio
+import os
+import logging
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from database import engine
+
+logger = logging.getLogger(__name__)
+
+CHANGES_TABLE = "prediction_changes"
+
+# Changes kept for clients catching up; older cursors get a reset
+CHANGE_FEED_KEEP = int(os.getenv("CHANGE_FEED_KEEP", "10000"))
+
+# Seconds between checks for changes committed by other worker processes, while streams are open
+CHANGE_FEED_POLL_INTERVAL = float(os.getenv("CHANGE_FEED_POLL_INTERVAL", "1"))
+
+# Seconds between keep-alive comments on an idle stream, so proxies do not close it
+CHANGE_FEED_KEEPALIVE = float(os.getenv("CHANGE_FEED_KEEPALIVE", "15"))
+
+_PRUNE_SQL = f"DELETE FROM {CHANGES_TABLE} WHERE seq <= (SELECT max(seq) FROM {CHANGES_TABLE}) - {CHANGE_FEED_KEEP};"
+
+CHANGES_DDL = [
+    # AUTOINCREMENT: seq is never reused, even after pruning, so cursors stay valid
+    f"""CREATE TABLE IF NOT EXISTS {CHANGES_TABLE} (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        prediction_id INTEGER NOT NULL,
+        op TEXT NOT NULL,
+        detect_type TEXT
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {CHANGES_TABLE}_insert AFTER INSERT ON predictions BEGIN
+        INSERT INTO {CHANGES_TABLE}(prediction_id, op, detect_type) VALUES (new.id, 'created', new.detect_type);
+        {_PRUNE_SQL}
+    END""",
+    # Only columns shown in the history list; moving a shared image between rows is not a change
+    f"""CREATE TRIGGER IF NOT EXISTS {CHANGES_TABLE}_update
+        AFTER UPDATE OF image_name, detect_type, target_prompt, results ON predictions BEGIN
+        INSERT INTO {CHANGES_TABLE}(prediction_id, op, detect_type) VALUES (new.id, 'updated', new.detect_type);
+        {_PRUNE_SQL}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {CHANGES_TABLE}_delete AFTER DELETE ON predictions BEGIN
+        INSERT INTO {CHANGES_TABLE}(prediction_id, op, detect_type) VALUES (old.id, 'deleted', old.detect_type);
+        {_PRUNE_SQL}
+    END""",
+]
+
+def create_change_feed():
+    """
+    Create the change table and its triggers; the feed starts empty, /history holds what came before.
+
+    Every statement is IF NOT EXISTS, so triggers dropped with a rebuilt predictions table come back.
+    """
+    with engine.begin() as connection:
+        for statement in CHANGES_DDL:
+            connection.execute(text(statement))
+
+def latest_cursor(db: Session) -> int:
+    """seq of the newest change, 0 before the first"""
+    return db.execute(text(f"SELECT coalesce(max(seq), 0) FROM {CHANGES_TABLE}")).scalar()
+
+# The fields of /history, read without loading images or result payloads
+HISTORY_COLUMNS = (
+    "p.id, p.image_name, p.detect_type, p.target_prompt, p.created_at, p.processing_time, p.image_size, "
+    "coalesce(json_array_length(p.results), 0) AS result_count"
+)
+
+def read_changes(db: Session, since: int, limit: int = 100, detect_type: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Changes after cursor since, oldest first, at most limit.
+
+    Created and updated entries carry the row as /history lists it. An
+    entry whose row has been deleted since is left out; its deletion
+    follows later in the feed.
+    """
+    latest = latest_cursor(db)
+    oldest = db.execute(text(f"SELECT min(seq) FROM {CHANGES_TABLE}")).scalar()
+    if since > latest or (oldest is not None and since < oldest - 1):
+        return {"cursor": latest, "reset": True, "has_more": False, "changes": []}
+
+    rows = db.execute(
+        text(
+            f"SELECT c.seq, c.op, c.prediction_id, p.id IS NOT NULL AS present, {HISTORY_COLUMNS} "
+            f"FROM {CHANGES_TABLE} c LEFT JOIN predictions p ON p.id = c.prediction_id AND c.op != 'deleted' "
+            f"WHERE c.seq > :since {'AND c.detect_type = :detect_type ' if detect_type else ''}"
+            "ORDER BY c.seq LIMIT :limit"
+        ),
+        {"since": since, "detect_type": detect_type, "limit": limit}
+    ).mappings().all()
+
+    changes = []
+    for row in rows:
+        if row["op"] == "deleted":
+            changes.append({"seq": row["seq"], "op": "deleted", "id": row["prediction_id"]})
+        elif row["present"]:
+            prediction = {key: row[key] for key in (
+                "id", "image_name", "detect_type", "target_prompt", "created_at", "processing_time", "image_size", "result_count"
+            )}
+            # Raw SQL returns SQLite's text; the same datetime /history returns
+            prediction["created_at"] = datetime.fromisoformat(row["created_at"]) if row["created_at"] else None
+            changes.append({"seq": row["seq"], "op": row["op"], "id": row["prediction_id"], "prediction": prediction})
+    has_more = len(rows) == limit
+    return {
+        "cursor": rows[-1]["seq"] if has_more else latest,
+        "reset": False,
+        "has_more": has_more,
+        "changes": changes
+    }
+
+class ChangeNotifier:
+    """
+    Wakes open change streams when predictions may have changed.
+
+    Commits of this process notify at once (from any thread). Commits of
+    other worker processes are picked up by one poll of the newest seq per
+    CHANGE_FEED_POLL_INTERVAL, run only while streams are open.
+    """
+
+    def __init__(self, poll_interval: float = CHANGE_FEED_POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self.listeners = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._event: Optional[asyncio.Event] = None
+        self._poller: Optional[asyncio.Task] = None
+        self.notifications = 0
+
+    def watch(self, session_factory):
+        """Notify after every commit of sessions from session_factory"""
+        event.listen(session_factory, "after_commit", lambda session: self.notify())
+
+    def notify(self):
+        loop = self._loop
+        if loop is not None and self.listeners:
+            loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        # Waiters hold the current event; replacing it after setting wakes them all once
+        self.notifications += 1
+        self._event.set()
+        self._event = asyncio.Event()
+
+    def subscribe(self):
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+            self._event = asyncio.Event()
+        self.listeners += 1
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.create_task(self._poll())
+
+    def unsubscribe(self):
+        self.listeners -= 1
+
+    async def wait(self, timeout: float) -> bool:
+        """Until the next notification (True), or timeout seconds (False)"""
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _poll(self):
+        from database import SessionLocal
+
+        def latest() -> int:
+            db = SessionLocal()
+            try:
+                return latest_cursor(db)
+            finally:
+                db.close()
+
+        seen = await asyncio.to_thread(latest)
+        while self.listeners > 0:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                current = await asyncio.to_thread(latest)
+            except Exception as e:
+                logger.warning(f"Change feed poll failed: {e}")
+                continue
+            if current != seen:
+                seen = current
+                self._wake()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"listeners": self.listeners, "notifications": self.notifications, "poll_interval": self.poll_interval}
@@ -1,8 +1,10 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, Float, JSON
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, Float, JSON, ForeignKey, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.schema import CreateTable
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
 import os
+import threading
 
 # Database URL
 DATABASE_URL = "sqlite:///./predictions.db"
@@ -18,6 +20,8 @@ Base = declarative_base()
 
 class Prediction(Base):
     __tablename__ = "predictions"
+    # Ids are never reused: responses for a prediction id are cached by clients as immutable
+    __table_args__ = {"sqlite_autoincrement": True}
     
     id = Column(Integer, primary_key=True, index=True)
     image_name = Column(String, index=True)
@@ -31,11 +35,114 @@ class Prediction(Base):
     results = Column(JSON)  # Store the detection results
     created_at = Column(DateTime, default=datetime.utcnow)
     processing_time = Column(Float, nullable=True)  # Time in seconds
+    image_size = Column(Integer, nullable=True)  # Longer side in pixels of the image sent to the model
+    parent_id = Column(Integer, ForeignKey("predictions.id"), nullable=True, index=True)  # Row holding the shared image
+
+def add_missing_columns():
+    """Add columns introduced after a table was created (SQLite create_all never alters tables)"""
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}'))
+                    if column.index:
+                        connection.execute(text(
+                            f'CREATE INDEX IF NOT EXISTS ix_{table.name}_{column.name} ON {table.name} ("{column.name}")'
+                        ))
+
+def rebuild_with_autoincrement():
+    """
+    Rebuild a predictions table created without AUTOINCREMENT, keeping its rows and ids.
+
+    SQLite otherwise hands a deleted last row's id to the next insert. The
+    id counter starts past every id still present or recorded as deleted in
+    the change feed; the triggers on the table are recreated by the index
+    and change feed set-up that follows.
+    """
+    inspector = inspect(engine)
+    if not inspector.has_table("predictions"):
+        return
+    with engine.begin() as connection:
+        table_sql = connection.execute(text(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'predictions'"
+        )).scalar()
+        if "AUTOINCREMENT" in table_sql.upper():
+            return
+        table = Prediction.__table__
+        columns = ", ".join(f'"{column.name}"' for column in table.columns)
+        create_sql = str(CreateTable(table).compile(dialect=engine.dialect))
+        connection.execute(text(create_sql.replace("CREATE TABLE predictions", "CREATE TABLE predictions_rebuild", 1)))
+        connection.execute(text(f"INSERT INTO predictions_rebuild ({columns}) SELECT {columns} FROM predictions"))
+        last_id = connection.execute(text("SELECT max(id) FROM predictions")).scalar() or 0
+        if inspector.has_table("prediction_changes"):
+            deleted_id = connection.execute(text("SELECT max(prediction_id) FROM prediction_changes")).scalar() or 0
+            last_id = max(last_id, deleted_id)
+        connection.execute(text("DROP TABLE predictions"))
+        connection.execute(text("ALTER TABLE predictions_rebuild RENAME TO predictions"))
+        connection.execute(text("DELETE FROM sqlite_sequence WHERE name = 'predictions'"))
+        connection.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES ('predictions', :seq)"), {"seq": last_id})
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
 
 def create_tables():
+    # Lets deleted pages be returned to the filesystem a few at a time (PRAGMA incremental_vacuum).
+    # It only takes effect on a new database; existing ones need a full VACUUM once (retention.py --convert)
+    with engine.connect() as connection:
+        connection.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+        # Readers in any worker process proceed while another writes; the mode is stored in the file
+        connection.exec_driver_sql("PRAGMA journal_mode = WAL")
     Base.metadata.create_all(bind=engine)
+    add_missing_columns()
+    rebuild_with_autoincrement()
+
+_initialized = False
+_init_lock = threading.Lock()
+
+def init_database():
+    """Create the tables, the search and spatial indexes and the change feed, once per process, on first use"""
+    global _initialized
+    if _initialized:
+        return
+    with _init_lock:
+        if not _initialized:
+            # Imported here: these modules build on this one
+            from change_feed import create_change_feed
+            from search import create_search_index
+            from spatial import create_spatial_index
+
+            create_tables()
+            create_search_index()
+            create_spatial_index()
+            create_change_feed()
+            _initialized = True
+
+def hand_over_image(db, prediction: Prediction, excluded=()) -> list:
+    """
+    Pass the image a row shares with its linked rows to the first of them, before the row is deleted.
+
+    Linked rows in excluded (being deleted too) are skipped. Returns the linked rows that changed.
+    """
+    children = (
+        db.query(Prediction)
+        .filter(Prediction.parent_id == prediction.id, Prediction.id.notin_(list(excluded)))
+        .order_by(Prediction.id)
+        .all()
+    )
+    if children:
+        heir = children[0]
+        heir.image_data = prediction.image_data
+        heir.parent_id = None
+        for child in children[1:]:
+            child.parent_id = heir.id
+    return children
 
 def get_db():
+    init_database()
     db = SessionLocal()
     try:
         yield db
@@ -0,0 +1,267 @@
+"""
+Streaming export of stored predictions as NDJSON or COCO annotations.
+
+Rows are read with a server-side cursor in batches of EXPORT_BATCH_SIZE and
+written as they arrive, so memory stays flat whatever the database size.
+
+Usage:
+    python export.py --format coco --images skip --output annotations.json
+    python export.py --format ndjson --images reference --image-dir images/ --detect-type Points
+"""
+import argparse
+import base64
+import logging
+import os
+import struct
+import sys
+import tempfile
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import orjson
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session, aliased
+
+from database import Prediction, SessionLocal
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ("ndjson", "coco")
+IMAGE_MODES = ("embed", "reference", "skip")
+
+# Rows fetched from the cursor at a time, and when each row carries its image
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "200"))
+EXPORT_IMAGE_BATCH_SIZE = int(os.getenv("EXPORT_IMAGE_BATCH_SIZE", "8"))
+
+# Output is handed on in chunks of about this size rather than one per record
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+# Enough of a base64 PNG data URL to hold the signature and IHDR chunk with the image size
+_HEADER_CHARS = 128
+
+# Exported rows without their image
+_COLUMNS = (
+    Prediction.id, Prediction.image_name, Prediction.detect_type, Prediction.target_prompt,
+    Prediction.label_prompt, Prediction.segmentation_language, Prediction.temperature,
+    Prediction.model_used, Prediction.results, Prediction.created_at, Prediction.processing_time,
+    Prediction.parent_id, Prediction.image_size
+)
+
+ImageWriter = Callable[[int, str], str]
+
+def image_url(image_id: int) -> str:
+    return f"/prediction/{image_id}/image"
+
+def png_size(data_url: Optional[str]) -> Optional[Tuple[int, int]]:
+    """Width and height from the start of a base64 PNG data URL"""
+    if not data_url or "," not in data_url:
+        return None
+    encoded = data_url.split(",", 1)[1][:32]
+    try:
+        header = base64.b64decode(encoded)
+    except ValueError:
+        return None
+    if len(header) < 24 or header[:8] != b"\x89PNG\r\n\x1a\n" or header[12:16] != b"IHDR":
+        return None
+    return struct.unpack(">II", header[16:24])
+
+def _statement(
+    image: str, detect_type: Optional[str] = None, model: Optional[str] = None,
+    created_after: Optional[datetime] = None, created_before: Optional[datetime] = None
+):
+    """
+    Filtered rows in id order, with the image (or just its first bytes) resolved from the parent row if shared.
+
+    image is "full", "header" or "none".
+    """
+    parent = aliased(Prediction)
+    image_id = func.coalesce(Prediction.parent_id, Prediction.id).label("image_id")
+    columns = [*_COLUMNS, image_id]
+    if image != "none":
+        data = func.coalesce(
+            Prediction.image_data,
+            select(parent.image_data).where(parent.id == Prediction.parent_id).scalar_subquery()
+        )
+        columns.append((data if image == "full" else func.substr(data, 1, _HEADER_CHARS)).label("image_data"))
+
+    statement = select(*columns)
+    if detect_type:
+        statement = statement.where(Prediction.detect_type == detect_type)
+    if model:
+        # Prefix match, so "gemini-2.5-flash" also finds "gemini-2.5-flash (direct)"
+        statement = statement.where(Prediction.model_used.startswith(model, autoescape=True))
+    if created_after:
+        statement = statement.where(Prediction.created_at >= created_after)
+    if created_before:
+        statement = statement.where(Prediction.created_at < created_before)
+    batch_size = EXPORT_IMAGE_BATCH_SIZE if image == "full" else EXPORT_BATCH_SIZE
+    return statement.order_by(Prediction.id).execution_options(yield_per=batch_size)
+
+def _chunked(pieces: Iterator[bytes]) -> Iterator[bytes]:
+    buffer = bytearray()
+    for piece in pieces:
+        buffer += piece
+        if len(buffer) >= EXPORT_CHUNK_BYTES:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+def _image_fields(row: Any, images: str, image_writer: Optional[ImageWriter]) -> Dict[str, Any]:
+    if images == "embed":
+        return {"image_data": row.image_data}
+    if images == "reference":
+        if image_writer is not None and row.image_data:
+            return {"image_url": image_writer(row.image_id, row.image_data)}
+        return {"image_url": image_url(row.image_id)}
+    return {}
+
+def export_ndjson(
+    db: Session, images: str = "skip", image_writer: Optional[ImageWriter] = None, **filters
+) -> Iterator[bytes]:
+    """One JSON object per prediction and line, with the stored results as they are"""
+    load_image = "full" if images == "embed" or image_writer is not None else "none"
+
+    def lines():
+        for row in db.execute(_statement(load_image, **filters)):
+            record = {column.key: row._mapping[column.key] for column in _COLUMNS}
+            record.update(_image_fields(row, images, image_writer))
+            yield orjson.dumps(record) + b"\n"
+
+    return _chunked(lines())
+
+def coco_annotations(results: List[dict], width: int, height: int) -> Iterator[Tuple[dict, str]]:
+    """
+    COCO annotations (without ids) and their labels for one prediction.
+
+    Boxes and polygons are scaled from normalized to pixel coordinates and
+    points become single keypoints. Masks stored as images keep only their
+    box, and 3D boxes, which have no position in the frame, are left out.
+    """
+    for detection in results or []:
+        if not isinstance(detection, dict) or "label" not in detection:
+            continue
+        annotation: Dict[str, Any] = {"iscrowd": 0}
+        if detection.get("confidence") is not None:
+            annotation["score"] = detection["confidence"]
+
+        if isinstance(detection.get("point"), dict):
+            x, y = detection["point"]["x"] * width, detection["point"]["y"] * height
+            annotation.update(bbox=[x, y, 0, 0], area=0, keypoints=[x, y, 2], num_keypoints=1)
+        elif "x" in detection and "width" in detection:
+            x, y = detection["x"] * width, detection["y"] * height
+            w, h = detection["width"] * width, detection["height"] * height
+            annotation.update(bbox=[x, y, w, h], area=w * h)
+            if detection.get("polygon"):
+                annotation["segmentation"] = [
+                    [value for px, py in detection["polygon"] for value in (px * width, py * height)]
+                ]
+        else:
+            continue
+        yield annotation, detection["label"]
+
+def export_coco(
+    db: Session, images: str = "skip", image_writer: Optional[ImageWriter] = None, **filters
+) -> Iterator[bytes]:
+    """
+    A COCO annotations file with one image entry per prediction.
+
+    The images array is written while the cursor is read; annotations are
+    spooled to a temporary file meanwhile (on disk past a few MB) and follow
+    it, then the categories seen.
+    """
+    load_image = "full" if images == "embed" or image_writer is not None else "header"
+
+    def pieces():
+        categories: Dict[str, int] = {}
+        annotation_id = 0
+        info = {"description": "Spatial Understanding predictions", "date_created": datetime.utcnow()}
+        yield b'{"info":' + orjson.dumps(info) + b',"images":['
+
+        with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as annotations:
+            separator = b""
+            for row in db.execute(_statement(load_image, **filters)):
+                size = png_size(row.image_data)
+                if size is None:
+                    logger.warning(f"Prediction {row.id} has no readable PNG image, leaving it out of the COCO export")
+                    continue
+                width, height = size
+                entry = {
+                    "id": row.id,
+                    "file_name": row.image_name,
+                    "width": width,
+                    "height": height,
+                    "date_captured": row.created_at,
+                    "detect_type": row.detect_type,
+                    "target_prompt": row.target_prompt,
+                    "model_used": row.model_used,
+                }
+                entry.update(_image_fields(row, images, image_writer))
+                yield separator + orjson.dumps(entry)
+
+                for annotation, label in coco_annotations(row.results, width, height):
+                    if label not in categories:
+                        categories[label] = len(categories) + 1
+                    annotation_id += 1
+                    annotation.update(id=annotation_id, image_id=row.id, category_id=categories[label])
+                    annotations.write((b"," if annotation_id > 1 else b"") + orjson.dumps(annotation))
+                separator = b","
+
+            yield b'],"annotations":['
+            annotations.seek(0)
+            while True:
+                block = annotations.read(EXPORT_CHUNK_BYTES)
+                if not block:
+                    break
+                yield block
+
+        yield b'],"categories":' + orjson.dumps([
+            {"id": category_id, "name": label} for label, category_id in categories.items()
+        ]) + b"}"
+
+    return _chunked(pieces())
+
+EXPORTERS = {"ndjson": export_ndjson, "coco": export_coco}
+
+def file_image_writer(directory: str) -> ImageWriter:
+    """Write each shared image once as <image id>.png and reference it by file name"""
+    os.makedirs(directory, exist_ok=True)
+
+    def write(image_id: int, data_url: str) -> str:
+        file_name = f"{image_id}.png"
+        path = os.path.join(directory, file_name)
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.write(base64.b64decode(data_url.split(",", 1)[1]))
+        return file_name
+
+    return write
+
+def main():
+    parser = argparse.ArgumentParser(description="Export stored predictions as NDJSON or COCO annotations")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="ndjson")
+    parser.add_argument("--images", choices=IMAGE_MODES, default="skip")
+    parser.add_argument("--image-dir", help="With --images reference, write the images here as PNG files")
+    parser.add_argument("--detect-type")
+    parser.add_argument("--model", help="Model name, or the start of it")
+    parser.add_argument("--created-after", type=datetime.fromisoformat)
+    parser.add_argument("--created-before", type=datetime.fromisoformat)
+    parser.add_argument("--output", help="Output file (default: stdout)")
+    args = parser.parse_args()
+
+    image_writer = file_image_writer(args.image_dir) if args.image_dir and args.images == "reference" else None
+    db = SessionLocal()
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for chunk in EXPORTERS[args.format](
+            db, args.images, image_writer, detect_type=args.detect_type, model=args.model,
+            created_after=args.created_after, created_before=args.created_before
+        ):
+            output.write(chunk)
+    finally:
+        if args.output:
+            output.close()
+        db.close()
+
+if __name__ == "__main__":
+    main()
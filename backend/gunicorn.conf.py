@@ -0,0 +1,35 @@
+"""
+Multi-worker deployment: gunicorn forks uvicorn workers from one preloaded app.
+
+    WEB_CONCURRENCY=4 gunicorn -c gunicorn.conf.py main:app
+
+Loading the app once in the master shares its imported modules and startup
+work (table creation, index backfills) copy-on-write between the workers.
+Caches go through the shared cache file (see shared_cache.py) so results
+cached by one worker are hits in all of them.
+"""
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+# Analyses wait on Gemini for tens of seconds at worst
+timeout = 120
+
+# shared_cache reads the worker count when the app is preloaded, before this file's defaults apply
+os.environ.setdefault("WEB_CONCURRENCY", str(workers))
+
+def on_starting(server):
+    from database import init_database
+    from main import shared_cache
+    if shared_cache:
+        shared_cache.clear()
+    # Tables and index backfills once, in the master, instead of racing in every worker
+    init_database()
+
+def post_fork(server, worker):
+    # Database connections opened while preloading belong to the master
+    from database import engine
+    engine.dispose(close=False)
@@ -0,0 +1,244 @@
+import asyncio
+import os
+import time
+import uuid
+import threading
+import logging
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Any, Dict, Optional
+
+import orjson
+
+from lazy_imports import lazy_import
+from shared_cache import SharedCache
+
+genai = lazy_import("google.generativeai")
+
+logger = logging.getLogger(__name__)
+
+# Idle seconds before an image session (and its provider cache) expires
+DEFAULT_SESSION_TTL = float(os.getenv("IMAGE_SESSION_TTL", "600"))
+
+# Maximum number of live image sessions; least recently used are evicted first
+DEFAULT_MAX_SESSIONS = int(os.getenv("IMAGE_SESSION_MAX", "64"))
+
+# Whether to try Gemini context caching for session images
+PROVIDER_CACHE_ENABLED = os.getenv("IMAGE_SESSION_PROVIDER_CACHE", "true").lower() == "true"
+
+class ImageSession:
+    """An uploaded image kept in normalized form so many prompts can run against it"""
+
+    def __init__(self, img_base64: str, image_name: str, conversion_time: float, ttl: float, session_id: Optional[str] = None):
+        self.id = session_id or uuid.uuid4().hex
+        self.img_base64 = img_base64
+        self.image_name = image_name
+        self.conversion_time = conversion_time
+        self.ttl = ttl
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.prediction_id: Optional[int] = None  # Row that stores the image for this session
+        self._provider_caches: Dict[Any, Any] = {}
+        self._provider_expiry: Dict[Any, float] = {}  # When each provider cache expires, as last set by us
+        self._lock = asyncio.Lock()
+        self.stats = {
+            "requests": 0,
+            "prompt_tokens": 0,
+            "cached_tokens": 0,
+            "provider_cache_hits": 0,
+            "provider_cache_failures": 0,
+            "provider_cache_extensions": 0
+        }
+
+    @property
+    def expires_at(self) -> float:
+        return self.last_used + self.ttl
+
+    def touch(self):
+        self.last_used = time.time()
+
+    async def get_provider_cache(self, model_name: str, tool: Optional[Any] = None) -> Optional[Any]:
+        """
+        Get (or create) a Gemini cached content holding this image and tool.
+
+        Caching needs a minimum prompt size that small images often do not
+        reach; a failed attempt is remembered so it is not retried for the
+        same model and tool.
+
+        The provider cache is created with the session TTL but does not
+        follow touch(), so once less than half of its TTL is left it is
+        extended to a full TTL again; one that already expired, or cannot
+        be extended, is created anew.
+
+        Returns:
+            CachedContent, or None when caching is disabled or unsupported
+        """
+        if not PROVIDER_CACHE_ENABLED:
+            return None
+
+        key = (model_name, tool.function_declarations[0].name if tool is not None else None)
+        async with self._lock:
+            cached = self._provider_caches.get(key)
+            if cached is not None and self._provider_expiry[key] - time.time() < self.ttl / 2:
+                await self._extend_provider_cache(key, cached)
+
+            if key not in self._provider_caches:
+                try:
+                    self._provider_caches[key] = await asyncio.to_thread(
+                        genai.caching.CachedContent.create,
+                        model=f"models/{model_name}",
+                        contents=[{"role": "user", "parts": [{"inline_data": {"mime_type": "image/png", "data": self.img_base64}}]}],
+                        tools=[tool] if tool is not None else None,
+                        ttl=timedelta(seconds=self.ttl)
+                    )
+                    self._provider_expiry[key] = time.time() + self.ttl
+                    logger.info(f"Created provider cache for session {self.id} ({key})")
+                except Exception as e:
+                    logger.info(f"Provider caching unavailable for session {self.id} ({key}): {e}")
+                    self._provider_caches[key] = None
+                    self.stats["provider_cache_failures"] += 1
+
+            cached = self._provider_caches[key]
+            if cached is not None:
+                self.stats["provider_cache_hits"] += 1
+            return cached
+
+    async def _extend_provider_cache(self, key: Any, cached: Any):
+        """Push a provider cache's expiry a full TTL out, or forget it so it is recreated (lock held)"""
+        if self._provider_expiry[key] > time.time():
+            try:
+                await asyncio.to_thread(cached.update, ttl=timedelta(seconds=self.ttl))
+                self._provider_expiry[key] = time.time() + self.ttl
+                self.stats["provider_cache_extensions"] += 1
+                return
+            except Exception as e:
+                logger.info(f"Could not extend provider cache for session {self.id} ({key}), recreating it: {e}")
+        del self._provider_caches[key]
+        del self._provider_expiry[key]
+
+    def record_usage(self, response: Any):
+        """Accumulate token usage reported by a Gemini response"""
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None:
+            return
+        self.stats["prompt_tokens"] += getattr(usage, "prompt_token_count", 0) or 0
+        self.stats["cached_tokens"] += getattr(usage, "cached_content_token_count", 0) or 0
+
+    def release(self):
+        """Delete provider caches; best effort, they also expire on their own"""
+        for cached in self._provider_caches.values():
+            if cached is not None:
+                try:
+                    cached.delete()
+                except Exception as e:
+                    logger.warning(f"Failed to delete provider cache for session {self.id}: {e}")
+        self._provider_caches.clear()
+        self._provider_expiry.clear()
+
+    def summary(self) -> Dict[str, Any]:
+        requests = self.stats["requests"]
+        return {
+            "session_id": self.id,
+            "image_name": self.image_name,
+            "prediction_id": self.prediction_id,
+            "created_at": self.created_at,
+            "expires_at": self.expires_at,
+            "base64_length": len(self.img_base64),
+            **self.stats,
+            # Every request after the first skips upload decoding and PNG re-encoding
+            "conversion_time": self.conversion_time,
+            "conversion_time_saved": self.conversion_time * max(requests - 1, 0),
+            "image_bytes_reused": len(self.img_base64) * max(requests - 1, 0)
+        }
+
+class ImageSessionStore:
+    """
+    Bounded, TTL-expiring registry of image sessions.
+
+    With a shared cache, each session's image is also kept there, so a
+    worker that did not create a session picks it up on first use, and a
+    session deleted or expired in one worker is gone in all of them.
+    Provider caches and usage statistics stay per worker.
+    """
+
+    def __init__(self, max_sessions: int = DEFAULT_MAX_SESSIONS, ttl: float = DEFAULT_SESSION_TTL,
+                 shared: Optional[SharedCache] = None):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.shared = shared
+        self._sessions: "OrderedDict[str, ImageSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, img_base64: str, image_name: str, conversion_time: float) -> ImageSession:
+        session = ImageSession(img_base64, image_name, conversion_time, self.ttl)
+        self.save(session)
+        with self._lock:
+            self._sessions[session.id] = session
+            evicted = self._evict()
+        self._release(evicted)
+        return session
+
+    def save(self, session: ImageSession):
+        """Publish a session's image and stored prediction to the other workers"""
+        if self.shared is not None:
+            self.shared.put("image_sessions", session.id, orjson.dumps({
+                "img_base64": session.img_base64,
+                "image_name": session.image_name,
+                "conversion_time": session.conversion_time,
+                "prediction_id": session.prediction_id
+            }), ttl=self.ttl)
+
+    def get(self, session_id: str) -> Optional[ImageSession]:
+        if self.shared is not None and not self.shared.touch("image_sessions", session_id, self.ttl):
+            # Deleted or expired, possibly by another worker
+            self.remove(session_id)
+            return None
+        with self._lock:
+            evicted = self._evict()
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.touch()
+                self._sessions.move_to_end(session_id)
+        self._release(evicted)
+        if session is None and self.shared is not None:
+            session = self._load(session_id)
+        return session
+
+    def _load(self, session_id: str) -> Optional[ImageSession]:
+        """A session another worker created, from the shared cache"""
+        value = self.shared.get("image_sessions", session_id)
+        if value is None:
+            return None
+        record = orjson.loads(value)
+        session = ImageSession(record["img_base64"], record["image_name"], record["conversion_time"], self.ttl, session_id)
+        session.prediction_id = record["prediction_id"]
+        with self._lock:
+            session = self._sessions.setdefault(session_id, session)
+            evicted = self._evict()
+        self._release(evicted)
+        return session
+
+    def remove(self, session_id: str) -> bool:
+        removed = self.shared is not None and self.shared.delete("image_sessions", session_id) > 0
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is None:
+            return removed
+        self._release([session])
+        return True
+
+    def _evict(self) -> list:
+        """Drop expired sessions and the least recently used beyond max_sessions (lock held)"""
+        now = time.time()
+        evicted = [session for session in self._sessions.values() if session.expires_at < now]
+        for session in evicted:
+            del self._sessions[session.id]
+        while len(self._sessions) > self.max_sessions:
+            evicted.append(self._sessions.popitem(last=False)[1])
+        return evicted
+
+    def _release(self, sessions: list):
+        for session in sessions:
+            logger.info(f"Image session {session.id} closed after {session.stats['requests']} requests")
+            # Deleting provider caches is a network call; keep it off the request path
+            threading.Thread(target=session.release, daemon=True).start()
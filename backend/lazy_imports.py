@@ -0,0 +1,74 @@
+"""
+Deferred imports for heavy dependencies.
+
+google.generativeai pulls in protobuf, gRPC and IPython and takes most of a
+second to import. Modules bind it through lazy_import instead, so importing
+the app stays fast and the SDK is loaded by the first request or by the
+start-up warm-up, whichever comes first.
+"""
+import importlib
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+class LazyModule:
+    """
+    Stands in for a module until an attribute is first read or set.
+
+    Attribute writes go to the real module, so patching through the proxy
+    (as the benchmarks do with GenerativeModel) works as on the module.
+    """
+
+    def __init__(self, name: str):
+        object.__setattr__(self, "_name", name)
+        object.__setattr__(self, "_module", None)
+        object.__setattr__(self, "_on_load", [])
+        object.__setattr__(self, "_lock", threading.RLock())
+
+    def load(self) -> Any:
+        module = self._module
+        if module is None:
+            with self._lock:
+                if self._module is None:
+                    module = importlib.import_module(self._name)
+                    for hook in self._on_load:
+                        hook(module)
+                    object.__setattr__(self, "_module", module)
+                module = self._module
+        return module
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.load(), name)
+
+    def __setattr__(self, name: str, value: Any):
+        setattr(self.load(), name, value)
+
+    def __repr__(self) -> str:
+        return f"<lazy module {self._name!r} ({'loaded' if self.loaded else 'not loaded'})>"
+
+_modules: Dict[str, LazyModule] = {}
+_modules_lock = threading.Lock()
+
+def lazy_import(name: str, on_load: Optional[Callable[[Any], None]] = None) -> LazyModule:
+    """
+    The shared proxy for a module.
+
+    on_load runs once with the real module when it is loaded, whichever
+    importer touches it first (immediately if it already has been).
+    """
+    with _modules_lock:
+        proxy = _modules.setdefault(name, LazyModule(name))
+    if on_load is not None:
+        with proxy._lock:
+            if proxy.loaded:
+                on_load(proxy._module)
+            else:
+                proxy._on_load.append(on_load)
+    return proxy
+
+def loaded_modules() -> List[str]:
+    """Names of the deferred modules imported so far"""
+    return [name for name, proxy in _modules.items() if proxy.loaded]
@@ -0,0 +1,99 @@
+import asyncio
+import os
+import time
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Default number of analyses a single live session may run at once
+DEFAULT_LIVE_CONCURRENCY = int(os.getenv("LIVE_MAX_CONCURRENCY", "1"))
+
+# Most analyses a session may ask for with max_concurrency; larger requests are clamped to it
+LIVE_CONCURRENCY_LIMIT = max(DEFAULT_LIVE_CONCURRENCY, int(os.getenv("LIVE_CONCURRENCY_LIMIT", "4")))
+
+def parse_max_concurrency(value: Any) -> int:
+    """A session's requested max_concurrency, clamped to 1..LIVE_CONCURRENCY_LIMIT"""
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError(f"max_concurrency must be an integer, got {value!r}")
+    return min(LIVE_CONCURRENCY_LIMIT, max(1, value))
+
+class LatestFrameScheduler:
+    """
+    Per-session frame scheduler where the newest frame always wins.
+
+    At most max_concurrency analyses run at once. While all slots are busy,
+    a single pending slot holds the newest frame; a frame arriving while one
+    is already pending replaces it and the superseded frame is reported as
+    dropped, so latency never grows with the number of frames pushed.
+    """
+
+    def __init__(
+        self,
+        analyze: Callable[[bytes], Awaitable[Dict[str, Any]]],
+        send: Callable[[Dict[str, Any]], Awaitable[None]],
+        max_concurrency: int = DEFAULT_LIVE_CONCURRENCY
+    ):
+        self.analyze = analyze
+        self.send = send
+        self.max_concurrency = max(1, max_concurrency)
+        self._pending: Optional[Tuple[Any, bytes, float]] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self.received = 0
+        self.dropped = 0
+        self.completed = 0
+
+    async def submit(self, frame_id: Any, image_data: bytes):
+        """Start the frame now if a slot is free, otherwise make it the pending frame"""
+        self.received += 1
+        frame = (frame_id, image_data, time.time())
+
+        if len(self._tasks) < self.max_concurrency:
+            self._start(frame)
+            return
+
+        if self._pending is not None:
+            self.dropped += 1
+            await self.send({"type": "dropped", "frame_id": self._pending[0]})
+        self._pending = frame
+
+    def _start(self, frame: Tuple[Any, bytes, float]):
+        task = asyncio.create_task(self._run(*frame))
+        self._tasks.add(task)
+        task.add_done_callback(self._on_done)
+
+    def _on_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if self._pending is not None and len(self._tasks) < self.max_concurrency:
+            frame, self._pending = self._pending, None
+            self._start(frame)
+
+    async def _run(self, frame_id: Any, image_data: bytes, received_at: float):
+        started_at = time.time()
+        try:
+            result = await self.analyze(image_data)
+        except Exception as e:
+            logger.error(f"Live analysis of frame {frame_id} failed: {e}")
+            result = {"success": False, "data": [], "error": str(e)}
+
+        self.completed += 1
+        message = {
+            "type": "result",
+            "frame_id": frame_id,
+            **result,
+            "queue_time": started_at - received_at,
+            "processing_time": time.time() - started_at,
+            "dropped_frames": self.dropped
+        }
+        try:
+            await self.send(message)
+        except Exception as e:
+            logger.warning(f"Could not deliver result for frame {frame_id}: {e}")
+
+    async def close(self):
+        """Cancel in-flight analyses and forget the pending frame"""
+        self._pending = None
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
@@ -1,22 +1,61 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, ORJSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional, Union
-import google.generativeai as genai
+from pydantic import BaseModel, Field
+from typing import List, Optional, Tuple, Union
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 import os
 from dotenv import load_dotenv
 import base64
 import io
 from PIL import Image, ImageDraw, ImageFont
 import json
+import hashlib
+import orjson
 import time
+import asyncio
+import numpy as np
 from datetime import datetime
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, defer
 import logging
 
 # Import our custom modules
-from database import get_db, create_tables, Prediction
-from tools import get_tool_for_detection_type, get_tool_prompt
+from database import get_db, init_database, hand_over_image, Prediction, SessionLocal
+from lazy_imports import lazy_import, loaded_modules
+from tools import (
+    DETECT_TYPES, build_tools, get_tool_for_detection_type, get_tool_prompt,
+    get_detection_type_for_function, get_multi_tool_prompt
+)
+from postprocess import (
+    PostprocessOptions, DEFAULT_POLYGON_METHOD, build_postprocess_options, normalize_detections,
+    select_detections, normalize_polygons, simplify_polygon
+)
+from phash_index import PerceptualHashIndex, SharedPerceptualHashIndex, DEFAULT_MAX_DISTANCE, dhash
+from live import LatestFrameScheduler, DEFAULT_LIVE_CONCURRENCY, parse_max_concurrency
+from image_sessions import ImageSession, ImageSessionStore
+from routing import ModelRouter
+from response_archive import ResponseArchive, request_fingerprint
+from output_parser import parse_json_array
+from responses import CompressionMiddleware, negotiate
+from response_cache import ResponseCache, OVERLAY_CACHE_BYTES, PREDICTION_CACHE_MAX_AGE, etag_matches, make_etag
+from search import SEARCH_FIELDS, SEARCH_SORTS, search_predictions
+from spatial import REGION_MODES, query_detections
+from export import EXPORT_FORMATS, EXPORTERS, IMAGE_MODES
+from retention import RetentionManager
+from shared_cache import WEB_CONCURRENCY, open_shared_cache
+from warmup import Warmup
+from resolution import ResolutionPolicy
+from output_budget import MULTI_TASK, OutputBudgetController
+from sequences import (
+    PROPAGATION_MODES, SEQUENCE_CONCURRENCY, SEQUENCE_KEYFRAME_THRESHOLD, SEQUENCE_MAX_FRAMES, SEQUENCE_MAX_GAP,
+    SEQUENCE_MAX_KEYFRAMES,
+    KeyframeSelector,
+    assign_keyframes, iter_frames, select_keyframes
+)
+from admission import AdmissionMiddleware, AdmissionScheduler
+from change_feed import CHANGE_FEED_KEEPALIVE, ChangeNotifier, latest_cursor, read_changes
+from profiling import PROFILE_ADMIN_TOKEN, PROFILE_HEADER, ProfileStore, ProfilingMiddleware, token_matches
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -24,7 +63,25 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-app = FastAPI(title="Spatial Understanding API", version="1.0.0")
+# The Gemini SDK is imported (and configured) by whatever first uses it: the warm-up or a request
+genai = lazy_import("google.generativeai", on_load=lambda module: module.configure(api_key=os.getenv("GEMINI_API_KEY")))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The server accepts connections right away; GET /ready reports when warm-up is done
+    warmup.start()
+    retention.start()
+    yield
+    retention.stop()
+
+# orjson encodes large result payloads several times faster than the standard encoder
+app = FastAPI(
+    title="Spatial Understanding API", version="1.0.0", default_response_class=ORJSONResponse, lifespan=lifespan
+)
+
+# Concurrent analyses per worker, queued by priority lane and client, shed with 503 when they would miss their deadline
+admission = AdmissionScheduler()
+app.add_middleware(AdmissionMiddleware, scheduler=admission)
 
 # Configure CORS
 origins = os.getenv("CORS_ORIGINS", "http://localhost:3000").split(",")
@@ -36,11 +93,53 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Configure Gemini API
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+# gzip/brotli for clients that accept it, when enabled with RESPONSE_COMPRESSION
+app.add_middleware(CompressionMiddleware)
+
+# Profiles of requests sent with the admin token or picked by PROFILE_SAMPLE_RATE; a pass-through otherwise
+profile_store = ProfileStore()
+app.add_middleware(ProfilingMiddleware, store=profile_store)
+
+# Cache tier shared by the worker processes of a multi-worker server; None with a single process
+shared_cache = open_shared_cache()
+
+# Recently analyzed images, for reusing results on near-identical frames
+phash_index = SharedPerceptualHashIndex(shared_cache) if shared_cache else PerceptualHashIndex()
+
+# Uploaded images that several prompts are run against
+image_sessions = ImageSessionStore(shared=shared_cache)
+
+# Per-detect-type model choice based on rolling latency and error rates
+model_router = ModelRouter()
 
-# Create database tables on startup
-create_tables()
+# Per-detect-type size of the images sent to Gemini (RESOLUTION_MODE, RESOLUTION_PROFILES)
+resolution_policy = ResolutionPolicy()
+
+# Per-detect-type caps on detections and output tokens, with truncation and latency stats (OUTPUT_BUDGETS)
+output_budget = OutputBudgetController()
+
+# Optional recording or replay of raw Gemini responses (GEMINI_RECORD_PATH / GEMINI_REPLAY_PATH)
+response_archive = ResponseArchive()
+
+# Serialized GET /prediction/{id} responses; stored predictions do not change
+prediction_cache = ResponseCache(shared=shared_cache, namespace="predictions")
+
+# Overlay images rendered by /analyze-with-overlay, keyed by image and detections
+overlay_cache = ResponseCache(OVERLAY_CACHE_BYTES, shared=shared_cache, namespace="overlays")
+
+# Archives and deletes expired predictions and reclaims their space (RETENTION_POLICIES)
+retention = RetentionManager(on_deleted=lambda ids: prediction_cache.invalidate(*ids))
+
+# Wakes /history/stream clients when a commit (of any session, retention included) may have changed predictions
+change_feed = ChangeNotifier()
+change_feed.watch(SessionLocal)
+
+# Start-up work deferred from import time, run in the background once the server listens
+warmup = Warmup(OrderedDict(
+    database=init_database,
+    gemini_sdk=genai.load,
+    tools=build_tools
+))
 
 def convert_image_to_png_base64(image_data: bytes, max_size: int = 800, skip_resize: bool = False) -> str:
     """
@@ -48,57 +147,104 @@ def convert_image_to_png_base64(image_data: bytes, max_size: int = 800, skip_res
     
     Args:
         image_data: Raw image bytes in any format
-        max_size: Maximum dimension for resizing (default 640px)
+        max_size: Maximum dimension for resizing (default 800px)
         
     Returns:
         Clean base64 string of PNG image
     """
-    try:
-        # Open image from bytes
-        image = Image.open(io.BytesIO(image_data))
-        original_format = image.format
-        logger.info(f"Image loaded: {image.width}x{image.height}, format: {original_format}, mode: {image.mode}")
-        
-        # Convert to RGB mode for maximum compatibility
-        # This handles RGBA, CMYK, LA, P (palette), 1 (bitmap), etc.
-        if image.mode != 'RGB':
-            logger.info(f"Converting image from {image.mode} to RGB")
-            if image.mode in ('RGBA', 'LA'):
-                # For images with transparency, create white background
-                background = Image.new('RGB', image.size, (255, 255, 255))
-                if image.mode == 'RGBA':
-                    background.paste(image, mask=image.split()[-1])  # Use alpha channel as mask
-                else:  # LA mode
-                    background.paste(image, mask=image.split()[-1])
-                image = background
-            else:
-                # For other modes (P, CMYK, 1, etc.), direct conversion
-                image = image.convert('RGB')
-        
-        # Resize if needed (max dimension) and skip_resize is False
-        if not skip_resize and (image.width > max_size or image.height > max_size):
-            scale = min(max_size / image.width, max_size / image.height)
-            new_width = int(image.width * scale)
-            new_height = int(image.height * scale)
-            image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            logger.info(f"Image resized to: {new_width}x{new_height}")
-        elif skip_resize:
-            logger.info(f"Skipping backend resize (mobile already resized)")
-        else:
-            logger.info(f"Image size {image.width}x{image.height} is within max_size {max_size}, no resize needed")
-        
-        # Convert to PNG format
-        buffered = io.BytesIO()
-        image.save(buffered, format="PNG", optimize=True)
-        img_base64 = base64.b64encode(buffered.getvalue()).decode()
-        
-        logger.info(f"Image converted: {original_format} -> PNG, base64 length: {len(img_base64)}")
-        return img_base64
+    return convert_image_to_base64(image_data, max_size, skip_resize)
+
+def convert_image_to_base64(
+    image_data: bytes, max_size: int = 800, skip_resize: bool = False,
+    image_format: str = "PNG", quality: int = 90
+) -> str:
+    """
+    Convert any image format to RGB, resize it and return it as a base64 string.
+    
+    Args:
+        image_data: Raw image bytes in any format
+        max_size: Maximum dimension for resizing
+        image_format: PNG (lossless), JPEG or WEBP
+        quality: JPEG/WEBP quality
         
+    Returns:
+        Clean base64 string of the encoded image
+    """
+    try:
+        image = decode_image(image_data)
+        return encode_image(resize_image(image, max_size, skip_resize), image_format, quality)
     except Exception as e:
-        logger.error(f"Failed to convert image to PNG: {e}")
+        logger.error(f"Failed to convert image to {image_format}: {e}")
         raise e
 
+def decode_image(image_data: bytes) -> Image.Image:
+    """Open image bytes in any format as an RGB image"""
+    # Open image from bytes
+    image = Image.open(io.BytesIO(image_data))
+    logger.info(f"Image loaded: {image.width}x{image.height}, format: {image.format}, mode: {image.mode}")
+    return to_rgb(image)
+
+def to_rgb(image: Image.Image) -> Image.Image:
+    """An image in any mode as RGB, with transparency flattened onto white"""
+    # Convert to RGB mode for maximum compatibility
+    # This handles RGBA, CMYK, LA, P (palette), 1 (bitmap), etc.
+    if image.mode != 'RGB':
+        logger.info(f"Converting image from {image.mode} to RGB")
+        if image.mode in ('RGBA', 'LA'):
+            # For images with transparency, create white background
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            if image.mode == 'RGBA':
+                background.paste(image, mask=image.split()[-1])  # Use alpha channel as mask
+            else:  # LA mode
+                background.paste(image, mask=image.split()[-1])
+            image = background
+        else:
+            # For other modes (P, CMYK, 1, etc.), direct conversion
+            image = image.convert('RGB')
+    return image
+
+def resize_image(image: Image.Image, max_size: int = 800, skip_resize: bool = False) -> Image.Image:
+    """Scale an image down to at most max_size on its longer side"""
+    # Resize if needed (max dimension) and skip_resize is False
+    if not skip_resize and (image.width > max_size or image.height > max_size):
+        scale = min(max_size / image.width, max_size / image.height)
+        new_width = int(image.width * scale)
+        new_height = int(image.height * scale)
+        image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        logger.info(f"Image resized to: {new_width}x{new_height}")
+    elif skip_resize:
+        logger.info(f"Skipping backend resize (mobile already resized)")
+    else:
+        logger.info(f"Image size {image.width}x{image.height} is within max_size {max_size}, no resize needed")
+    return image
+
+def encode_image(image: Image.Image, image_format: str = "PNG", quality: int = 90) -> str:
+    """Base64 of an RGB image encoded as PNG, JPEG or WEBP"""
+    buffered = io.BytesIO()
+    if image_format == "PNG":
+        image.save(buffered, format="PNG", optimize=True)
+    else:
+        image.save(buffered, format=image_format, quality=quality)
+    img_base64 = base64.b64encode(buffered.getvalue()).decode()
+    
+    logger.info(f"Image encoded as {image_format}, base64 length: {len(img_base64)}")
+    return img_base64
+
+def encode_for_model(image: Image.Image, max_size: int, skip_resize: bool = False) -> Tuple[str, int, int]:
+    """PNG base64 of a decoded image at max_size, with the width and height sent"""
+    resized = resize_image(image, max_size, skip_resize)
+    return encode_image(resized), resized.width, resized.height
+
+# Leading base64 characters of each encoding's signature
+IMAGE_SIGNATURES = {"iVBORw0KGgo": "image/png", "/9j/": "image/jpeg", "UklGR": "image/webp"}
+
+def image_mime_type(img_base64: str) -> str:
+    """MIME type of a base64 image, from its signature (PNG unless recognized otherwise)"""
+    for prefix, mime_type in IMAGE_SIGNATURES.items():
+        if img_base64.startswith(prefix):
+            return mime_type
+    return "image/png"
+
 def clean_base64_for_gemini(base64_string: str) -> str:
     """
     Ensure base64 string is clean for Gemini API by removing any data URL prefix.
@@ -153,6 +299,18 @@ class SegmentationMask(BaseModel):
     imageData: str
     confidence: Optional[float] = None
 
+class SegmentationPolygon(BaseModel):
+    x: float
+    y: float
+    width: float
+    height: float
+    label: str
+    polygon: List[List[float]]
+    vertex_count: int
+    original_vertex_count: int
+    original_polygon: Optional[List[List[float]]] = None
+    confidence: Optional[float] = None
+
 class DetectedPoint(BaseModel):
     point: Point
     label: str
@@ -167,9 +325,64 @@ class VisionRequest(BaseModel):
 
 class VisionResponse(BaseModel):
     success: bool
-    data: Union[List[BoundingBox2D], List[BoundingBox3D], List[SegmentationMask], List[DetectedPoint]]
+    # First match wins: a segmentation result also validates as plain boxes, which would drop its mask or polygon
+    data: Union[
+        List[SegmentationPolygon], List[SegmentationMask], List[BoundingBox3D], List[DetectedPoint], List[BoundingBox2D]
+    ] = Field(union_mode="left_to_right")
     error: Optional[str] = None
     prediction_id: Optional[int] = None
+    reused: bool = False
+    reuse_distance: Optional[int] = None
+
+class AnalysisTask(BaseModel):
+    detect_type: str
+    target_prompt: str = "items"
+    label_prompt: str = ""
+
+class TaskResult(BaseModel):
+    model_config = {"protected_namespaces": ()}
+    
+    detect_type: str
+    target_prompt: str
+    success: bool
+    data: List[dict]
+    error: Optional[str] = None
+    prediction_id: Optional[int] = None
+    model_used: Optional[str] = None
+
+class MultiTaskResponse(BaseModel):
+    success: bool
+    mode: str
+    results: List[TaskResult]
+    processing_time: float
+
+class SequenceKeyframe(BaseModel):
+    frame: int
+    name: str
+    difference: float
+    success: bool
+    data: List[dict]
+    error: Optional[str] = None
+    prediction_id: Optional[int] = None
+
+class SequenceFrame(BaseModel):
+    frame: int
+    name: str
+    difference: float
+    keyframe: int  # Frame whose results apply to this one
+
+class SequenceResponse(BaseModel):
+    model_config = {"protected_namespaces": ()}
+    
+    success: bool
+    detect_type: str
+    model_used: str
+    frame_count: int
+    truncated: bool
+    truncated_reason: Optional[str] = None  # max_frames or max_keyframes
+    keyframes: List[SequenceKeyframe]
+    frames: List[SequenceFrame]
+    processing_time: float
 
 class PredictionHistory(BaseModel):
     id: int
@@ -178,14 +391,22 @@ class PredictionHistory(BaseModel):
     target_prompt: str
     created_at: datetime
     processing_time: Optional[float]
+    image_size: Optional[int] = None
     result_count: int
 
 @app.get("/")
 async def root():
     return {"message": "Spatial Understanding API with Tools & Database"}
 
+@app.get("/ready")
+async def readiness():
+    """Warm-up state; 503 until the database, Gemini SDK and tool schemas are loaded"""
+    status = {**warmup.status(), "lazy_modules_loaded": loaded_modules()}
+    return ORJSONResponse(status, status_code=200 if status["ready"] else 503)
+
 @app.post("/analyze", response_model=VisionResponse)
 async def analyze_image(
+    request: Request,
     file: UploadFile = File(...),
     detect_type: str = Form(...),
     target_prompt: str = Form("items"),
@@ -193,50 +414,70 @@ async def analyze_image(
     segmentation_language: str = Form("English"),
     temperature: float = Form(0.4),
     skip_resize: bool = Form(False),
+    resolution: Optional[str] = Form(None),
+    min_confidence: Optional[float] = Form(None),
+    nms_iou_threshold: Optional[float] = Form(None),
+    top_k: Optional[int] = Form(None),
+    polygon_tolerance: Optional[float] = Form(None),
+    polygon_method: Optional[str] = Form(None),
+    keep_original_polygon: bool = Form(False),
+    reuse_threshold: Optional[int] = Form(None),
     db: Session = Depends(get_db)
 ):
     start_time = time.time()
     logger.info(f"Starting analysis: {detect_type} for '{target_prompt}'")
+    try:
+        postprocess = build_postprocess_options(
+            min_confidence, nms_iou_threshold, top_k,
+            polygon_tolerance, polygon_method, keep_original_polygon
+        )
+        resolution_mode = resolution_policy.resolve_mode(resolution)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     try:
-        # Read and convert image to PNG
         image_data = await file.read()
-        img_base64 = convert_image_to_png_base64(image_data, skip_resize=skip_resize)
         
-        # Choose model based on detection type
-        model_name = "gemini-2.0-flash" if detect_type == "3D bounding boxes" else "gemini-2.5-flash"
+        # Reuse the result of a near-identical recent image with the same parameters
+        reuse_key = None
+        if reuse_threshold is None:
+            reuse_threshold = DEFAULT_MAX_DISTANCE
+        if reuse_threshold >= 0:
+            image_hash = dhash(image_data)
+            reuse_key = (
+                detect_type, target_prompt, label_prompt, segmentation_language,
+                temperature, resolution_mode, skip_resize, postprocess.model_dump_json()
+            )
+            match = phash_index.lookup(reuse_key, image_hash, reuse_threshold)
+            if match:
+                logger.info(f"Reusing prediction {match['prediction_id']} (hash distance {match['distance']})")
+                return negotiate(request, VisionResponse(
+                    success=True,
+                    data=match["result"],
+                    prediction_id=match["prediction_id"],
+                    reused=True,
+                    reuse_distance=match["distance"]
+                ))
+        
+        image = decode_image(image_data)
+        
+        # Choose model based on detection type and recent model performance
+        model_name = model_router.route(detect_type).model_name
         logger.info(f"Using model: {model_name}")
         
-        # For segmentation masks, skip function calling and go straight to prompt engineering
-        # as the original Google code shows this works better for masks
-        if detect_type == "Segmentation masks":
-            logger.info("Using prompt engineering for segmentation masks (like original)...")
-            result = await analyze_with_prompt_engineering(
-                img_base64, detect_type, target_prompt, label_prompt, 
-                segmentation_language, temperature, model_name
+        # Adaptive mode tries a smaller image first and only resends at full size when needed
+        sizes = resolution_policy.sizes(detect_type, resolution_mode, max(image.size), skip_resize)
+        for attempt, size in enumerate(sizes):
+            img_base64, width, height = encode_for_model(image, size, skip_resize)
+            formatted_data = await run_detection(
+                img_base64, detect_type, target_prompt, label_prompt,
+                segmentation_language, temperature, model_name, postprocess
             )
-            formatted_data = result
-            logger.info(f"Prompt engineering succeeded with {len(formatted_data)} detections")
-        else:
-            # Try function calling first for other detection types
-            try:
-                logger.info("Attempting function calling approach...")
-                result = await analyze_with_function_calling(
-                    img_base64, detect_type, target_prompt, label_prompt, 
-                    segmentation_language, temperature, model_name
-                )
-                formatted_data = result
-                logger.info(f"Function calling succeeded with {len(formatted_data)} detections")
-            except Exception as func_error:
-                logger.warning(f"Function calling failed: {func_error}")
-                logger.info("Falling back to prompt engineering...")
-                # Fallback to prompt engineering
-                result = await analyze_with_prompt_engineering(
-                    img_base64, detect_type, target_prompt, label_prompt, 
-                    segmentation_language, temperature, model_name
-                )
-                formatted_data = result
-                logger.info(f"Prompt engineering succeeded with {len(formatted_data)} detections")
+            if attempt == len(sizes) - 1 or not resolution_policy.needs_more_resolution(formatted_data, width, height):
+                break
+            logger.info(f"First pass at {size}px too coarse, retrying at {sizes[-1]}px")
+        image_size = max(width, height)
+        resolution_policy.record(detect_type, image_size, escalated=attempt > 0)
         
         # Calculate processing time
         processing_time = time.time() - start_time
@@ -253,18 +494,22 @@ async def analyze_image(
             temperature=temperature,
             model_used=model_name,
             results=formatted_data,
-            processing_time=processing_time
+            processing_time=processing_time,
+            image_size=image_size
         )
         db.add(prediction)
         db.commit()
         db.refresh(prediction)
         logger.info(f"Saved prediction to database with ID: {prediction.id}")
         
-        return VisionResponse(
+        if reuse_key is not None:
+            phash_index.add(reuse_key, image_hash, formatted_data, prediction.id)
+        
+        return negotiate(request, VisionResponse(
             success=True, 
             data=formatted_data, 
             prediction_id=prediction.id
-        )
+        ))
         
     except Exception as e:
         processing_time = time.time() - start_time
@@ -282,7 +527,8 @@ async def analyze_image(
                 temperature=temperature,
                 model_used=model_name,
                 results=[],
-                processing_time=processing_time
+                processing_time=processing_time,
+                image_size=max(width, height)
             )
             db.add(prediction)
             db.commit()
@@ -290,10 +536,11 @@ async def analyze_image(
         except:
             logger.error("Failed to save failed prediction to database")
         
-        return VisionResponse(success=False, data=[], error=str(e))
+        return negotiate(request, VisionResponse(success=False, data=[], error=str(e)))
 
 @app.post("/analyze-with-overlay")
 async def analyze_image_with_overlay(
+    request: Request,
     file: UploadFile = File(...),
     detect_type: str = Form(...),
     target_prompt: str = Form("items"),
@@ -301,48 +548,51 @@ async def analyze_image_with_overlay(
     segmentation_language: str = Form("English"),
     temperature: float = Form(0.4),
     skip_resize: bool = Form(False),
+    min_confidence: Optional[float] = Form(None),
+    nms_iou_threshold: Optional[float] = Form(None),
+    top_k: Optional[int] = Form(None),
+    polygon_tolerance: Optional[float] = Form(None),
+    polygon_method: Optional[str] = Form(None),
+    keep_original_polygon: bool = Form(False),
+    resolution: Optional[str] = Form(None),
     db: Session = Depends(get_db)
 ):
     """Analyze image and return the image with bounding boxes/masks drawn on it"""
     start_time = time.time()
     logger.info(f"Starting analysis with overlay: {detect_type} for '{target_prompt}'")
+    try:
+        postprocess = build_postprocess_options(
+            min_confidence, nms_iou_threshold, top_k,
+            polygon_tolerance, polygon_method, keep_original_polygon
+        )
+        resolution_mode = resolution_policy.resolve_mode(resolution)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     try:
-        # Read and convert image to PNG
+        # Read and decode the image
         image_data = await file.read()
-        img_base64 = convert_image_to_png_base64(image_data, skip_resize=skip_resize)
+        image = decode_image(image_data)
         
-        # Choose model based on detection type
-        model_name = "gemini-2.0-flash" if detect_type == "3D bounding boxes" else "gemini-2.5-flash"
+        # Choose model based on detection type and recent model performance
+        model_name = model_router.route(detect_type).model_name
         logger.info(f"Using model: {model_name}")
         
         # Get analysis results (same logic as regular analyze endpoint)
-        if detect_type == "Segmentation masks":
-            logger.info("Using prompt engineering for segmentation masks...")
-            result = await analyze_with_prompt_engineering(
-                img_base64, detect_type, target_prompt, label_prompt, 
-                segmentation_language, temperature, model_name
+        sizes = resolution_policy.sizes(detect_type, resolution_mode, max(image.size), skip_resize)
+        for attempt, size in enumerate(sizes):
+            img_base64, width, height = encode_for_model(image, size, skip_resize)
+            formatted_data = await run_detection(
+                img_base64, detect_type, target_prompt, label_prompt,
+                segmentation_language, temperature, model_name, postprocess
             )
-            formatted_data = result
-        else:
-            try:
-                logger.info("Attempting function calling approach...")
-                result = await analyze_with_function_calling(
-                    img_base64, detect_type, target_prompt, label_prompt, 
-                    segmentation_language, temperature, model_name
-                )
-                formatted_data = result
-            except Exception as func_error:
-                logger.warning(f"Function calling failed: {func_error}")
-                logger.info("Falling back to prompt engineering...")
-                result = await analyze_with_prompt_engineering(
-                    img_base64, detect_type, target_prompt, label_prompt, 
-                    segmentation_language, temperature, model_name
-                )
-                formatted_data = result
+            if attempt == len(sizes) - 1 or not resolution_policy.needs_more_resolution(formatted_data, width, height):
+                break
+        image_size = max(width, height)
+        resolution_policy.record(detect_type, image_size, escalated=attempt > 0)
         
         # Create image with overlays
-        overlay_image_base64 = create_image_with_overlays(img_base64, formatted_data, detect_type)
+        overlay_image_base64 = render_overlay(img_base64, formatted_data, detect_type)
         
         # Calculate processing time
         processing_time = time.time() - start_time
@@ -359,19 +609,20 @@ async def analyze_image_with_overlay(
             temperature=temperature,
             model_used=f"{model_name} (with overlay)",
             results=formatted_data,
-            processing_time=processing_time
+            processing_time=processing_time,
+            image_size=image_size
         )
         db.add(prediction)
         db.commit()
         db.refresh(prediction)
         logger.info(f"Saved prediction to database with ID: {prediction.id}")
         
-        return {
+        return negotiate(request, {
             "success": True,
             "data": formatted_data,
             "overlay_image": f"data:image/png;base64,{overlay_image_base64}",
             "prediction_id": prediction.id
-        }
+        })
         
     except Exception as e:
         processing_time = time.time() - start_time
@@ -382,41 +633,612 @@ async def analyze_image_with_overlay(
             "error": str(e)
         }
 
+@app.post("/analyze-multi", response_model=MultiTaskResponse)
+async def analyze_image_multi(
+    file: UploadFile = File(...),
+    tasks: str = Form(...),  # JSON list of {"detect_type", "target_prompt", "label_prompt"}
+    segmentation_language: str = Form("English"),
+    temperature: float = Form(0.4),
+    skip_resize: bool = Form(False),
+    resolution: Optional[str] = Form(None),
+    min_confidence: Optional[float] = Form(None),
+    nms_iou_threshold: Optional[float] = Form(None),
+    top_k: Optional[int] = Form(None),
+    polygon_tolerance: Optional[float] = Form(None),
+    polygon_method: Optional[str] = Form(None),
+    keep_original_polygon: bool = Form(False),
+    db: Session = Depends(get_db)
+):
+    """
+    Run several detection tasks on one image, converting and storing the image once.
+    
+    Function-calling tasks with distinct detection types that share a model are sent
+    in a single generation call with all their tools attached; anything else (or any
+    task the model did not answer) runs as parallel calls on the same encoded image.
+    """
+    start_time = time.time()
+    try:
+        task_list = [AnalysisTask(**task) for task in json.loads(tasks)]
+        if not task_list:
+            raise ValueError("At least one task is required")
+        for task in task_list:
+            if task.detect_type not in DETECT_TYPES:
+                raise ValueError(f"Unknown detection type: {task.detect_type}")
+        postprocess = build_postprocess_options(
+            min_confidence, nms_iou_threshold, top_k,
+            polygon_tolerance, polygon_method, keep_original_polygon
+        )
+        resolution_mode = resolution_policy.resolve_mode(resolution)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    logger.info(f"Starting multi-task analysis: {[(task.detect_type, task.target_prompt) for task in task_list]}")
+    
+    # Read and convert image to PNG once for all tasks, at the largest size any of them needs
+    # (no adaptive first pass: the tasks share one encoded image)
+    image_data = await file.read()
+    size = max(resolution_policy.max_size(task.detect_type, resolution_mode) for task in task_list)
+    try:
+        img_base64, width, height = encode_for_model(decode_image(image_data), size, skip_resize)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid image: {e}")
+    image_size = max(width, height)
+    for task in task_list:
+        resolution_policy.record(task.detect_type, image_size)
+    
+    model_names = [model_router.route(task.detect_type).model_name for task in task_list]
+    results = {}
+    errors = {}
+    mode = "parallel"
+    
+    # One generation call can answer each function-calling detection type once
+    tool_tasks = [
+        i for i, task in enumerate(task_list)
+        if task.detect_type != "Segmentation masks" or postprocess.wants_polygons
+    ]
+    if (
+        len(tool_tasks) > 1
+        and len({task_list[i].detect_type for i in tool_tasks}) == len(tool_tasks)
+        and len({model_names[i] for i in tool_tasks}) == 1
+    ):
+        try:
+            answered = await analyze_tasks_single_call(
+                img_base64, [task_list[i] for i in tool_tasks], segmentation_language,
+                temperature, model_names[tool_tasks[0]], postprocess
+            )
+            results.update({tool_tasks[k]: data for k, data in answered.items()})
+            mode = "single-call"
+        except Exception as e:
+            logger.warning(f"Single-call multi-task analysis failed: {e}")
+    
+    # Remaining tasks run concurrently against the same encoded image
+    remaining = [i for i in range(len(task_list)) if i not in results]
+    if remaining:
+        outcomes = await asyncio.gather(
+            *[
+                run_detection(
+                    img_base64, task_list[i].detect_type, task_list[i].target_prompt, task_list[i].label_prompt,
+                    segmentation_language, temperature, model_names[i], postprocess
+                )
+                for i in remaining
+            ],
+            return_exceptions=True
+        )
+        for i, outcome in zip(remaining, outcomes):
+            if isinstance(outcome, Exception):
+                logger.error(f"Task {i} ({task_list[i].detect_type}) failed: {outcome}")
+                errors[i] = str(outcome)
+            else:
+                results[i] = outcome
+        if mode == "single-call":
+            mode = "single-call+parallel"
+    
+    processing_time = time.time() - start_time
+    logger.info(f"Multi-task analysis ({mode}) completed in {processing_time:.2f}s")
+    
+    # Save one row per task; only the first row stores the image, the others link to it
+    predictions = []
+    for i, task in enumerate(task_list):
+        prediction = Prediction(
+            image_name=file.filename or "unknown",
+            image_data=None if predictions else f"data:image/png;base64,{img_base64}",
+            detect_type=task.detect_type,
+            target_prompt=task.target_prompt,
+            label_prompt=task.label_prompt,
+            segmentation_language=segmentation_language,
+            temperature=temperature,
+            model_used=f"{model_names[i]} (multi-task)",
+            results=results.get(i, []),
+            processing_time=processing_time,
+            image_size=image_size,
+            parent_id=predictions[0].id if predictions else None
+        )
+        db.add(prediction)
+        db.flush()
+        predictions.append(prediction)
+    db.commit()
+    logger.info(f"Saved multi-task predictions with IDs: {[p.id for p in predictions]}")
+    
+    return MultiTaskResponse(
+        success=not errors,
+        mode=mode,
+        processing_time=processing_time,
+        results=[
+            TaskResult(
+                detect_type=task.detect_type,
+                target_prompt=task.target_prompt,
+                success=i not in errors,
+                data=results.get(i, []),
+                error=errors.get(i),
+                prediction_id=predictions[i].id,
+                model_used=model_names[i]
+            )
+            for i, task in enumerate(task_list)
+        ]
+    )
+
+@app.post("/analyze-sequence", response_model=SequenceResponse)
+async def analyze_sequence(
+    file: UploadFile = File(...),
+    detect_type: str = Form(...),
+    target_prompt: str = Form("items"),
+    label_prompt: str = Form(""),
+    segmentation_language: str = Form("English"),
+    temperature: float = Form(0.4),
+    skip_resize: bool = Form(False),
+    resolution: Optional[str] = Form(None),
+    keyframe_threshold: Optional[float] = Form(None),
+    max_gap: Optional[int] = Form(None),
+    propagation: str = Form("previous"),
+    min_confidence: Optional[float] = Form(None),
+    nms_iou_threshold: Optional[float] = Form(None),
+    top_k: Optional[int] = Form(None),
+    polygon_tolerance: Optional[float] = Form(None),
+    polygon_method: Optional[str] = Form(None),
+    keep_original_polygon: bool = Form(False),
+    db: Session = Depends(get_db)
+):
+    """
+    Analyze a multi-frame image (GIF, TIFF, APNG, WebP) or a zip of frames by keyframe.
+    
+    Frames are decoded one at a time and a frame becomes a keyframe when it differs
+    enough from the last one. Keyframes are analyzed in parallel while later frames
+    are still being read; every other frame takes the results of a keyframe.
+    """
+    start_time = time.time()
+    try:
+        if detect_type not in DETECT_TYPES:
+            raise ValueError(f"Unknown detection type: {detect_type}")
+        if propagation not in PROPAGATION_MODES:
+            raise ValueError(f"Unknown propagation '{propagation}'. Use one of: {', '.join(PROPAGATION_MODES)}")
+        if (keyframe_threshold is not None and keyframe_threshold < 0) or (max_gap is not None and max_gap < 0):
+            raise ValueError("keyframe_threshold and max_gap must not be negative")
+        postprocess = build_postprocess_options(
+            min_confidence, nms_iou_threshold, top_k,
+            polygon_tolerance, polygon_method, keep_original_polygon
+        )
+        resolution_mode = resolution_policy.resolve_mode(resolution)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    selector = KeyframeSelector(
+        SEQUENCE_KEYFRAME_THRESHOLD if keyframe_threshold is None else keyframe_threshold,
+        SEQUENCE_MAX_GAP if max_gap is None else max_gap
+    )
+    # One size for all keyframes (no adaptive first pass: keyframes of a scene look alike)
+    size = resolution_policy.max_size(detect_type, resolution_mode)
+    model_name = model_router.route(detect_type).model_name
+    semaphore = asyncio.Semaphore(SEQUENCE_CONCURRENCY)
+    logger.info(f"Starting sequence analysis: {detect_type} for '{target_prompt}'")
+    
+    async def analyze_keyframe(
+        image: Image.Image
+    ) -> Tuple[Optional[str], Optional[int], List[dict], float, Optional[Exception]]:
+        # The caller acquired the semaphore before starting this analysis.
+        # A failed analysis still returns the encoded frame, so its row keeps the image as /analyze does
+        call_start = time.time()
+        img_base64 = image_size = None
+        try:
+            img_base64, width, height = await asyncio.to_thread(encode_for_model, to_rgb(image), size, skip_resize)
+            image_size = max(width, height)
+            resolution_policy.record(detect_type, image_size)
+            formatted_data = await run_detection(
+                img_base64, detect_type, target_prompt, label_prompt,
+                segmentation_language, temperature, model_name, postprocess
+            )
+            return img_base64, image_size, formatted_data, time.time() - call_start, None
+        except Exception as e:
+            return img_base64, image_size, [], time.time() - call_start, e
+        finally:
+            semaphore.release()
+    
+    # Decoding and keyframe scoring run in a thread, a frame at a time; analyses start as keyframes are found.
+    # Reading waits while SEQUENCE_CONCURRENCY keyframes are in analysis, so decoded keyframes do not pile up
+    frames = []
+    analyses = {}
+    truncated_reason = None
+    steps = select_keyframes(iter_frames(file.file, SEQUENCE_MAX_FRAMES + 1), selector)
+    try:
+        while True:
+            try:
+                step = await asyncio.to_thread(next, steps, None)
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=f"Invalid frame {len(frames)}: {e}")
+            if step is None:
+                break
+            info, image = step
+            if info.index == SEQUENCE_MAX_FRAMES:
+                truncated_reason = "max_frames"
+                break
+            if image is not None and len(analyses) == SEQUENCE_MAX_KEYFRAMES:
+                truncated_reason = "max_keyframes"
+                break
+            frames.append(info)
+            if image is not None:
+                await semaphore.acquire()
+                analyses[info.index] = asyncio.create_task(analyze_keyframe(image))
+        if not frames:
+            raise HTTPException(status_code=400, detail="No image frames found")
+        outcomes = dict(zip(analyses, await asyncio.gather(*analyses.values())))
+    finally:
+        for analysis in analyses.values():
+            analysis.cancel()
+    
+    processing_time = time.time() - start_time
+    logger.info(
+        f"Sequence analysis of {len(frames)} frames with {len(analyses)} keyframes completed in {processing_time:.2f}s"
+    )
+    
+    # One row per keyframe, each with its own frame
+    keyframes = []
+    for index, outcome in outcomes.items():
+        info = frames[index]
+        img_base64, image_size, formatted_data, keyframe_time, error = outcome
+        if error is not None:
+            logger.error(f"Keyframe {index} failed: {error}")
+        prediction = Prediction(
+            image_name=f"{file.filename or 'unknown'} [{info.name}]",
+            image_data=f"data:image/png;base64,{img_base64}" if img_base64 is not None else None,
+            detect_type=detect_type,
+            target_prompt=target_prompt,
+            label_prompt=label_prompt,
+            segmentation_language=segmentation_language,
+            temperature=temperature,
+            model_used=f"{model_name} (sequence)",
+            results=formatted_data,
+            processing_time=keyframe_time,
+            image_size=image_size
+        )
+        db.add(prediction)
+        db.flush()
+        keyframes.append(SequenceKeyframe(
+            frame=index, name=info.name, difference=info.difference, success=error is None,
+            data=formatted_data, error=str(error) if error is not None else None, prediction_id=prediction.id
+        ))
+    db.commit()
+    
+    assigned = assign_keyframes(list(outcomes), len(frames), propagation)
+    return SequenceResponse(
+        success=all(keyframe.success for keyframe in keyframes),
+        detect_type=detect_type,
+        model_used=model_name,
+        frame_count=len(frames),
+        truncated=truncated_reason is not None,
+        truncated_reason=truncated_reason,
+        keyframes=keyframes,
+        frames=[
+            SequenceFrame(frame=info.index, name=info.name, difference=info.difference, keyframe=keyframe)
+            for info, keyframe in zip(frames, assigned)
+        ],
+        processing_time=processing_time
+    )
+
+@app.post("/image-sessions")
+async def create_image_session(
+    file: UploadFile = File(...),
+    skip_resize: bool = Form(False)
+):
+    """Upload an image once and get a handle for running many prompts against it"""
+    start_time = time.time()
+    image_data = await file.read()
+    try:
+        img_base64 = convert_image_to_png_base64(image_data, skip_resize=skip_resize)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid image: {e}")
+    
+    session = image_sessions.create(img_base64, file.filename or "unknown", time.time() - start_time)
+    logger.info(f"Created image session {session.id}")
+    return session.summary()
+
+@app.get("/image-sessions/{session_id}")
+async def get_image_session(session_id: str):
+    """Get usage and savings statistics of an image session"""
+    session = image_sessions.get(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Image session not found or expired")
+    return session.summary()
+
+@app.delete("/image-sessions/{session_id}")
+async def delete_image_session(session_id: str):
+    """Close an image session and release its provider caches"""
+    if not image_sessions.remove(session_id):
+        raise HTTPException(status_code=404, detail="Image session not found or expired")
+    return {"message": "Image session deleted successfully"}
+
+@app.post("/image-sessions/{session_id}/analyze", response_model=VisionResponse)
+async def analyze_image_session(
+    request: Request,
+    session_id: str,
+    detect_type: str = Form(...),
+    target_prompt: str = Form("items"),
+    label_prompt: str = Form(""),
+    segmentation_language: str = Form("English"),
+    temperature: float = Form(0.4),
+    min_confidence: Optional[float] = Form(None),
+    nms_iou_threshold: Optional[float] = Form(None),
+    top_k: Optional[int] = Form(None),
+    polygon_tolerance: Optional[float] = Form(None),
+    polygon_method: Optional[str] = Form(None),
+    keep_original_polygon: bool = Form(False),
+    db: Session = Depends(get_db)
+):
+    """Run a prompt against an image session without re-uploading or re-encoding the image"""
+    start_time = time.time()
+    session = image_sessions.get(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Image session not found or expired")
+    try:
+        postprocess = build_postprocess_options(
+            min_confidence, nms_iou_threshold, top_k,
+            polygon_tolerance, polygon_method, keep_original_polygon
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    logger.info(f"Session {session_id} analysis: {detect_type} for '{target_prompt}'")
+    session.stats["requests"] += 1
+    model_name = model_router.route(detect_type).model_name
+    
+    try:
+        formatted_data = await run_detection(
+            session.img_base64, detect_type, target_prompt, label_prompt,
+            segmentation_language, temperature, model_name, postprocess, session
+        )
+        success, error = True, None
+    except Exception as e:
+        logger.error(f"Session {session_id} analysis failed: {e}")
+        formatted_data, success, error = [], False, str(e)
+    
+    processing_time = time.time() - start_time
+    
+    # The first prediction of a session stores the image; later ones link to it
+    if session.prediction_id is not None and db.get(Prediction, session.prediction_id) is None:
+        session.prediction_id = None
+    prediction = Prediction(
+        image_name=session.image_name,
+        image_data=None if session.prediction_id else f"data:image/png;base64,{session.img_base64}",
+        detect_type=detect_type,
+        target_prompt=target_prompt,
+        label_prompt=label_prompt,
+        segmentation_language=segmentation_language,
+        temperature=temperature,
+        model_used=f"{model_name} (session)",
+        results=formatted_data,
+        processing_time=processing_time,
+        parent_id=session.prediction_id
+    )
+    db.add(prediction)
+    db.commit()
+    db.refresh(prediction)
+    if session.prediction_id is None:
+        session.prediction_id = prediction.id
+        image_sessions.save(session)
+    
+    return negotiate(request, VisionResponse(success=success, data=formatted_data, error=error, prediction_id=prediction.id))
+
+@app.websocket("/ws/live")
+async def live_analysis(websocket: WebSocket):
+    """
+    Continuous analysis of camera/screenshare frames over a WebSocket.
+    
+    Text messages are JSON, either {"type": "config", ...} with the same fields as
+    /analyze plus max_concurrency, or {"type": "frame", "frame_id": ..., "image": <base64>}.
+    Binary messages are raw image frames numbered by the server. Only the newest
+    waiting frame is kept; results come back as {"type": "result", "frame_id": ...}.
+    """
+    await websocket.accept()
+    
+    state = {
+        "config": {
+            "detect_type": "2D bounding boxes",
+            "target_prompt": "items",
+            "label_prompt": "",
+            "segmentation_language": "English",
+            "temperature": 0.4,
+            "skip_resize": False
+        },
+        "postprocess": build_postprocess_options()
+    }
+    send_lock = asyncio.Lock()
+    
+    async def send(message: dict):
+        async with send_lock:
+            await websocket.send_json(message)
+    
+    async def analyze(image_data: bytes) -> dict:
+        # Settings are captured when the frame starts, so config changes only affect later frames
+        config, postprocess = state["config"], state["postprocess"]
+        size = resolution_policy.max_size(config["detect_type"], resolution_policy.mode)
+        img_base64 = await asyncio.to_thread(
+            convert_image_to_png_base64, image_data, size, config["skip_resize"]
+        )
+        model_name = model_router.route(config["detect_type"]).model_name
+        formatted_data = await run_detection(
+            img_base64, config["detect_type"], config["target_prompt"], config["label_prompt"],
+            config["segmentation_language"], config["temperature"], model_name, postprocess
+        )
+        return {"success": True, "data": formatted_data, "detect_type": config["detect_type"], "model_used": model_name}
+    
+    scheduler = LatestFrameScheduler(analyze, send)
+    next_frame_id = 0
+    logger.info("Live analysis session started")
+    
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            
+            if message.get("bytes") is not None:
+                await scheduler.submit(next_frame_id, message["bytes"])
+                next_frame_id += 1
+                continue
+            
+            try:
+                payload = json.loads(message.get("text") or "{}")
+                
+                if payload.get("type") == "config":
+                    config = dict(state["config"])
+                    config.update({key: payload[key] for key in config if key in payload})
+                    if config["detect_type"] not in DETECT_TYPES:
+                        raise ValueError(f"Unknown detection type: {config['detect_type']}")
+                    max_concurrency = parse_max_concurrency(payload.get("max_concurrency", DEFAULT_LIVE_CONCURRENCY))
+                    state["postprocess"] = build_postprocess_options(
+                        payload.get("min_confidence"), payload.get("nms_iou_threshold"), payload.get("top_k"),
+                        payload.get("polygon_tolerance"), payload.get("polygon_method"),
+                        payload.get("keep_original_polygon", False)
+                    )
+                    state["config"] = config
+                    scheduler.max_concurrency = max_concurrency
+                    await send({"type": "config", **config, "max_concurrency": scheduler.max_concurrency})
+                
+                elif payload.get("type") == "frame":
+                    frame_id = payload.get("frame_id", next_frame_id)
+                    image_data = base64.b64decode(clean_base64_for_gemini(payload["image"]))
+                    await scheduler.submit(frame_id, image_data)
+                    next_frame_id += 1
+                
+                else:
+                    raise ValueError(f"Unknown message type: {payload.get('type')}")
+            
+            except (ValueError, KeyError, TypeError) as e:
+                await send({"type": "error", "error": str(e)})
+    
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await scheduler.close()
+        logger.info(
+            f"Live analysis session ended: {scheduler.received} frames received, "
+            f"{scheduler.completed} analyzed, {scheduler.dropped} dropped"
+        )
+
+async def run_detection(
+    img_base64: str, detect_type: str, target_prompt: str,
+    label_prompt: str, segmentation_language: str, temperature: float, model_name: str,
+    postprocess: Optional[PostprocessOptions] = None, image_session: Optional[ImageSession] = None
+) -> List[dict]:
+    """Run detection with function calling, falling back to prompt engineering"""
+    call_start = time.time()
+    try:
+        formatted_data = await _run_detection(
+            img_base64, detect_type, target_prompt, label_prompt,
+            segmentation_language, temperature, model_name, postprocess, image_session
+        )
+    except Exception:
+        model_router.record(model_name, time.time() - call_start, False)
+        raise
+    model_router.record(model_name, time.time() - call_start, True)
+    return formatted_data
+
+async def _run_detection(
+    img_base64: str, detect_type: str, target_prompt: str,
+    label_prompt: str, segmentation_language: str, temperature: float, model_name: str,
+    postprocess: Optional[PostprocessOptions] = None, image_session: Optional[ImageSession] = None
+) -> List[dict]:
+    """Detection strategy behind run_detection, without latency bookkeeping"""
+    # For segmentation masks, skip function calling and go straight to prompt engineering
+    # as the original Google code shows this works better for masks, unless the request
+    # asked for polygon simplification, which needs the function-calling polygons
+    if detect_type == "Segmentation masks" and not (postprocess and postprocess.wants_polygons):
+        logger.info("Using prompt engineering for segmentation masks (like original)...")
+        formatted_data = await analyze_with_prompt_engineering(
+            img_base64, detect_type, target_prompt, label_prompt, 
+            segmentation_language, temperature, model_name, postprocess, image_session
+        )
+        logger.info(f"Prompt engineering succeeded with {len(formatted_data)} detections")
+        return formatted_data
+    
+    # Try function calling first for other detection types
+    try:
+        logger.info("Attempting function calling approach...")
+        formatted_data = await analyze_with_function_calling(
+            img_base64, detect_type, target_prompt, label_prompt, 
+            segmentation_language, temperature, model_name, postprocess, image_session
+        )
+        logger.info(f"Function calling succeeded with {len(formatted_data)} detections")
+    except Exception as func_error:
+        logger.warning(f"Function calling failed: {func_error}")
+        logger.info("Falling back to prompt engineering...")
+        # Fallback to prompt engineering
+        formatted_data = await analyze_with_prompt_engineering(
+            img_base64, detect_type, target_prompt, label_prompt, 
+            segmentation_language, temperature, model_name, postprocess, image_session
+        )
+        logger.info(f"Prompt engineering succeeded with {len(formatted_data)} detections")
+    
+    return formatted_data
+
 async def analyze_with_function_calling(
     img_base64: str, detect_type: str, target_prompt: str, 
-    label_prompt: str, segmentation_language: str, temperature: float, model_name: str
+    label_prompt: str, segmentation_language: str, temperature: float, model_name: str,
+    postprocess: Optional[PostprocessOptions] = None, image_session: Optional[ImageSession] = None
 ):
     """Try analysis with function calling tools"""
     logger.info(f"Setting up function calling for {detect_type}")
     
     # Get the appropriate tool and prompt
-    tool = get_tool_for_detection_type(detect_type)
-    prompt = get_tool_prompt(detect_type, target_prompt, label_prompt, segmentation_language)
+    max_detections = output_budget.max_detections(detect_type)
+    tool = get_tool_for_detection_type(detect_type, max_detections)
+    prompt = get_tool_prompt(detect_type, target_prompt, label_prompt, segmentation_language, max_detections)
     
     logger.info(f"Tool: {tool.function_declarations[0].name}")
     logger.info(f"Prompt: {prompt}")
     
-    model = genai.GenerativeModel(model_name, tools=[tool])
+    # Image sessions may already hold the image (and tool) in a provider-side cache
+    cached_content = await image_session.get_provider_cache(model_name, tool) if image_session else None
+    if cached_content is not None:
+        model = genai.GenerativeModel.from_cached_content(cached_content)
+        contents = [prompt]
+    else:
+        model = genai.GenerativeModel(model_name, tools=[tool])
+        contents = [
+            {
+                "mime_type": image_mime_type(img_base64),
+                "data": img_base64
+            },
+            prompt
+        ]
     
     # Generate content with tools
     generation_config = genai.types.GenerationConfig(
         temperature=temperature
     )
     
-    if detect_type != "3D bounding boxes":
-        generation_config.thinking_budget = 0
+    max_output_tokens = output_budget.apply(generation_config, (detect_type,), model_name)
     
     logger.info("Sending request to Gemini...")
-    response = model.generate_content(
-        [
-            {
-                "mime_type": "image/png",
-                "data": img_base64
-            },
-            prompt
-        ],
-        generation_config=generation_config
+    call_start = time.time()
+    response = await response_archive.generate(
+        model, contents, generation_config, "function_calling", model_name,
+        request_fingerprint(
+            "function_calling", img_base64, prompt,
+            [tool.function_declarations[0].name], generation_config
+        )
     )
+    latency = time.time() - call_start
+    if image_session:
+        image_session.record_usage(response)
     
     logger.info("Received response from Gemini")
     logger.info(f"Response candidates: {len(response.candidates) if response.candidates else 0}")
@@ -439,23 +1261,11 @@ async def analyze_with_function_calling(
                     logger.info(f"Function call args type: {type(function_call.args)}")
                     
                     try:
-                        # Try different ways to get the args
-                        if hasattr(function_call.args, 'get'):
-                            # Dictionary-like access
-                            detections = function_call.args.get('detections', [])
-                            logger.info(f"Got detections via .get(): {len(detections)}")
-                        elif hasattr(function_call.args, 'detections'):
-                            # Direct attribute access
-                            detections = function_call.args.detections
-                            logger.info(f"Got detections via attribute: {len(detections)}")
-                        else:
-                            # Convert to dict if possible
-                            args_dict = dict(function_call.args)
-                            detections = args_dict.get('detections', [])
-                            logger.info(f"Got detections via dict conversion: {len(detections)}")
+                        detections = get_function_call_detections(function_call)
+                        output_budget.record(detect_type, latency, response, max_output_tokens, len(detections))
                         
                         # Format response based on detection type
-                        result = format_tool_response(detect_type, detections)
+                        result = format_tool_response(detect_type, output_budget.cap(detect_type, detections), postprocess)
                         logger.info(f"Formatted {len(result)} detections")
                         return result
                         
@@ -471,6 +1281,7 @@ async def analyze_with_function_calling(
     
     # If we get here, no function call was found
     logger.warning("No function call found in response")
+    output_budget.record(detect_type, latency, response, max_output_tokens)
     
     # Log the full response for debugging
     if response.candidates:
@@ -479,39 +1290,136 @@ async def analyze_with_function_calling(
     
     raise Exception("No function call found in response")
 
+def get_function_call_detections(function_call) -> list:
+    """Read the detections argument from a function call"""
+    # Try different ways to get the args
+    if hasattr(function_call.args, 'get'):
+        # Dictionary-like access
+        detections = function_call.args.get('detections', [])
+        logger.info(f"Got detections via .get(): {len(detections)}")
+    elif hasattr(function_call.args, 'detections'):
+        # Direct attribute access
+        detections = function_call.args.detections
+        logger.info(f"Got detections via attribute: {len(detections)}")
+    else:
+        # Convert to dict if possible
+        args_dict = dict(function_call.args)
+        detections = args_dict.get('detections', [])
+        logger.info(f"Got detections via dict conversion: {len(detections)}")
+    return detections
+
+async def analyze_tasks_single_call(
+    img_base64: str, tasks: List[AnalysisTask], segmentation_language: str,
+    temperature: float, model_name: str, postprocess: Optional[PostprocessOptions] = None
+) -> dict:
+    """
+    Run several function-calling tasks in one generation call with all their tools attached.
+    
+    Returns:
+        Formatted detections keyed by task index, for the tasks the model answered
+    """
+    max_detections = [output_budget.max_detections(task.detect_type) for task in tasks]
+    tools = [get_tool_for_detection_type(task.detect_type, limit) for task, limit in zip(tasks, max_detections)]
+    prompt = get_multi_tool_prompt(
+        [{**task.model_dump(), "max_detections": limit} for task, limit in zip(tasks, max_detections)],
+        segmentation_language
+    )
+    logger.info(f"Single-call tools: {[tool.function_declarations[0].name for tool in tools]}")
+    
+    model = genai.GenerativeModel(model_name, tools=tools)
+    generation_config = genai.types.GenerationConfig(
+        temperature=temperature
+    )
+    max_output_tokens = output_budget.apply(generation_config, tuple(task.detect_type for task in tasks), model_name)
+    
+    logger.info("Sending multi-task request to Gemini...")
+    tool_names = [tool.function_declarations[0].name for tool in tools]
+    call_start = time.time()
+    try:
+        response = await response_archive.generate(
+            model,
+            [
+                {
+                    "mime_type": image_mime_type(img_base64),
+                    "data": img_base64
+                },
+                prompt
+            ],
+            generation_config, "multi_task", model_name,
+            request_fingerprint("multi_task", img_base64, prompt, tool_names, generation_config)
+        )
+    except Exception:
+        model_router.record(model_name, time.time() - call_start, False)
+        raise
+    model_router.record(model_name, time.time() - call_start, True)
+    output_budget.record(MULTI_TASK, time.time() - call_start, response, max_output_tokens)
+    
+    task_index = {task.detect_type: i for i, task in enumerate(tasks)}
+    results = {}
+    if response.candidates and response.candidates[0].content:
+        for part in response.candidates[0].content.parts:
+            if not (hasattr(part, 'function_call') and part.function_call):
+                continue
+            try:
+                detect_type = get_detection_type_for_function(part.function_call.name)
+            except ValueError as e:
+                logger.warning(str(e))
+                continue
+            if detect_type not in task_index or task_index[detect_type] in results:
+                continue
+            detections = output_budget.cap(detect_type, get_function_call_detections(part.function_call))
+            results[task_index[detect_type]] = format_tool_response(detect_type, detections, postprocess)
+    
+    logger.info(f"Single call answered {len(results)} of {len(tasks)} tasks")
+    return results
+
 async def analyze_with_prompt_engineering(
     img_base64: str, detect_type: str, target_prompt: str, 
-    label_prompt: str, segmentation_language: str, temperature: float, model_name: str
+    label_prompt: str, segmentation_language: str, temperature: float, model_name: str,
+    postprocess: Optional[PostprocessOptions] = None, image_session: Optional[ImageSession] = None
 ):
     """Fallback to prompt engineering if function calling fails"""
     logger.info(f"Using prompt engineering fallback for {detect_type}")
     
-    model = genai.GenerativeModel(model_name)
+    cached_content = await image_session.get_provider_cache(model_name) if image_session else None
+    if cached_content is not None:
+        model = genai.GenerativeModel.from_cached_content(cached_content)
+    else:
+        model = genai.GenerativeModel(model_name)
     
     # Generate prompt based on detection type (fallback)
-    prompt = generate_fallback_prompt(detect_type, target_prompt, label_prompt, segmentation_language)
+    prompt = generate_fallback_prompt(
+        detect_type, target_prompt, label_prompt, segmentation_language, output_budget.max_detections(detect_type)
+    )
     logger.info(f"Fallback prompt: {prompt}")
     
     generation_config = genai.types.GenerationConfig(
         temperature=temperature
     )
     
-    if detect_type != "3D bounding boxes":
-        generation_config.thinking_budget = 0
+    max_output_tokens = output_budget.apply(generation_config, (detect_type,), model_name)
     
     logger.info("Sending fallback request to Gemini...")
-    # Clean base64 data to ensure it doesn't have any data URL prefix
-    clean_base64 = clean_base64_for_gemini(img_base64)
-    response = model.generate_content(
-        [
+    if cached_content is not None:
+        contents = [prompt]
+    else:
+        # Clean base64 data to ensure it doesn't have any data URL prefix
+        clean_base64 = clean_base64_for_gemini(img_base64)
+        contents = [
             {
-                "mime_type": "image/png",
+                "mime_type": image_mime_type(clean_base64),
                 "data": clean_base64
             },
             prompt
-        ],
-        generation_config=generation_config
+        ]
+    call_start = time.time()
+    response = await response_archive.generate(
+        model, contents, generation_config, "prompt_engineering", model_name,
+        request_fingerprint("prompt_engineering", img_base64, prompt, (), generation_config)
     )
+    latency = time.time() - call_start
+    if image_session:
+        image_session.record_usage(response)
     
     logger.info("Received fallback response from Gemini")
     
@@ -519,28 +1427,35 @@ async def analyze_with_prompt_engineering(
     response_text = response.text
     logger.info(f"Response text length: {len(response_text)}")
     
-    if "```json" in response_text:
-        response_text = response_text.split("```json")[1].split("```")[0]
-        logger.info("Extracted JSON from markdown block")
-    
+    # Keeps every complete detection of truncated output or output with trailing text
     try:
-        parsed_response = json.loads(response_text)
-        logger.info(f"Parsed JSON with {len(parsed_response)} items")
+        parsed = parse_json_array(response_text)
+        parsed_response = parsed.items
+        logger.info(f"Parsed JSON with {len(parsed_response)} items (complete: {parsed.complete})")
     except json.JSONDecodeError as e:
+        output_budget.record(detect_type, latency, response, max_output_tokens, complete=False)
         logger.error(f"JSON parsing failed: {e}")
         logger.error(f"Response text: {response_text[:500]}...")
         raise e
     
+    output_budget.record(detect_type, latency, response, max_output_tokens, len(parsed_response), parsed.complete)
+    
     # Format response based on detection type
-    result = format_prompt_response(detect_type, parsed_response)
+    result = format_prompt_response(detect_type, output_budget.cap(detect_type, parsed_response), postprocess)
     logger.info(f"Formatted {len(result)} detections from prompt engineering")
     return result
 
-def generate_fallback_prompt(detect_type: str, target_prompt: str, label_prompt: str, segmentation_language: str) -> str:
-    """Generate fallback prompts for when function calling fails"""
+def generate_fallback_prompt(
+    detect_type: str, target_prompt: str, label_prompt: str, segmentation_language: str,
+    max_detections: Optional[int] = None
+) -> str:
+    """Generate fallback prompts for when function calling fails, asking for at most max_detections items"""
+    items_limit = f", with no more than {max_detections} items" if max_detections is not None else ""
     if detect_type == "2D bounding boxes":
+        # The original 2D prompt asked for at most 20 boxes; without a budget that request stays
+        items_limit = items_limit or ", with no more than 20 items"
         label_text = label_prompt or "a text label"
-        return f"Detect {target_prompt}, with no more than 20 items. Output a json list where each entry contains the 2D bounding box in \"box_2d\" and {label_text} in \"label\"."
+        return f"Detect {target_prompt}{items_limit}. Output a json list where each entry contains the 2D bounding box in \"box_2d\" and {label_text} in \"label\"."
     
     elif detect_type == "Segmentation masks":
         language_instruction = ""
@@ -549,7 +1464,7 @@ def generate_fallback_prompt(detect_type: str, target_prompt: str, label_prompt:
         else:
             language_instruction = " Use descriptive labels."
         
-        return f"""Detect and segment {target_prompt} in this image. For each object, provide:
+        return f"""Detect and segment {target_prompt} in this image{items_limit}. For each object, provide:
 1. A precise 2D bounding box as [ymin, xmin, ymax, xmax] in 0-1000 pixel coordinates
 2. A base64 encoded PNG segmentation mask showing the exact object shape
 3. A descriptive text label{language_instruction}
@@ -562,133 +1477,174 @@ Output a JSON list where each entry contains:
 IMPORTANT: The mask must be a valid base64 encoded PNG image showing the exact shape of the detected objects."""
     
     elif detect_type == "Points":
-        return f"Detect {target_prompt} and mark key points. Output a json list where each entry contains the point coordinates in \"point\" and a text label in \"label\"."
+        return f"Detect {target_prompt} and mark key points{items_limit}. Output a json list where each entry contains the point coordinates in \"point\" and a text label in \"label\"."
     
     elif detect_type == "3D bounding boxes":
-        return f"Detect {target_prompt} and create 3D bounding boxes. Output a json list where each entry contains the 3D bounding box in \"box_3d\" (9 values: center_x, center_y, center_z, size_x, size_y, size_z, roll, pitch, yaw in degrees) and a text label in \"label\"."
+        return f"Detect {target_prompt} and create 3D bounding boxes{items_limit}. Output a json list where each entry contains the 3D bounding box in \"box_3d\" (9 values: center_x, center_y, center_z, size_x, size_y, size_z, roll, pitch, yaw in degrees) and a text label in \"label\"."
     
-    return f"Detect {target_prompt}."
+    return f"Detect {target_prompt}{items_limit}."
 
-def format_tool_response(detect_type: str, detections: List[dict]) -> List[dict]:
+def format_tool_response(detect_type: str, detections: List[dict], postprocess: Optional[PostprocessOptions] = None) -> List[dict]:
     """Format the tool response to match frontend expectations"""
     logger.info(f"Formatting tool response for {detect_type} with {len(detections)} detections")
     
+    if detect_type not in DETECT_TYPES:
+        return detections
+    
+    columns = normalize_detections(detect_type, detections)
+    keep = select_detections(detect_type, columns, postprocess)
+    confidence = [None if np.isnan(c) else c for c in columns["confidence"][keep].tolist()]
+    labels = [columns["labels"][i] for i in keep]
+    
     if detect_type == "2D bounding boxes":
         return [
             {
-                "x": detection["box_2d"][1] / 1000,
-                "y": detection["box_2d"][0] / 1000,
-                "width": (detection["box_2d"][3] - detection["box_2d"][1]) / 1000,
-                "height": (detection["box_2d"][2] - detection["box_2d"][0]) / 1000,
-                "label": detection["label"],
-                "confidence": detection.get("confidence")
+                "x": x,
+                "y": y,
+                "width": width,
+                "height": height,
+                "label": label,
+                "confidence": score
             }
-            for detection in detections
+            for x, y, width, height, label, score in zip(
+                columns["x"][keep].tolist(), columns["y"][keep].tolist(),
+                columns["width"][keep].tolist(), columns["height"][keep].tolist(),
+                labels, confidence
+            )
         ]
     
     elif detect_type == "Points":
         return [
             {
                 "point": {
-                    "x": detection["point"][1] / 1000,
-                    "y": detection["point"][0] / 1000
+                    "x": x,
+                    "y": y
                 },
-                "label": detection["label"],
-                "confidence": detection.get("confidence")
+                "label": label,
+                "confidence": score
             }
-            for detection in detections
+            for x, y, label, score in zip(
+                columns["x"][keep].tolist(), columns["y"][keep].tolist(), labels, confidence
+            )
         ]
     
     elif detect_type == "Segmentation masks":
+        # Convert polygon coordinates from 0-1000 scale to 0-1 scale for all detections at once
+        polygons = normalize_polygons([detections[i].get("polygon", []) for i in keep])
+        tolerance = postprocess.polygon_tolerance if postprocess else None
+        method = postprocess.polygon_method if postprocess else DEFAULT_POLYGON_METHOD
+        keep_original = postprocess.keep_original_polygon if postprocess else False
+        
         formatted = []
-        for i, detection in enumerate(detections):
-            polygon_data = detection.get("polygon", [])
-            logger.info(f"Detection {i}: polygon points = {len(polygon_data)}")
-            
-            # Convert polygon coordinates from 0-1000 scale to 0-1 scale
-            normalized_polygon = []
-            if polygon_data:
-                for point in polygon_data:
-                    if len(point) >= 2:
-                        normalized_polygon.append([point[0] / 1000, point[1] / 1000])
+        original_vertices = 0
+        simplified_vertices = 0
+        for i, polygon, x, y, width, height, label, score in zip(
+            keep.tolist(), polygons, columns["x"][keep].tolist(), columns["y"][keep].tolist(),
+            columns["width"][keep].tolist(), columns["height"][keep].tolist(), labels, confidence
+        ):
+            logger.info(f"Detection {i}: polygon points = {len(polygon)}")
             
             # If no polygon data, create a simple rectangle polygon
-            if not normalized_polygon:
+            if not len(polygon):
                 logger.warning(f"No polygon data for detection {i}, creating rectangle polygon")
-                x1, y1 = detection["box_2d"][1] / 1000, detection["box_2d"][0] / 1000
-                x2, y2 = detection["box_2d"][3] / 1000, detection["box_2d"][2] / 1000
-                normalized_polygon = [[x1, y1], [x2, y1], [x2, y2], [x1, y2]]
+                polygon = np.array([[x, y], [x + width, y], [x + width, y + height], [x, y + height]])
+            
+            simplified = simplify_polygon(polygon, tolerance, method)
+            original_vertices += len(polygon)
+            simplified_vertices += len(simplified)
             
             formatted_detection = {
-                "x": detection["box_2d"][1] / 1000,
-                "y": detection["box_2d"][0] / 1000,
-                "width": (detection["box_2d"][3] - detection["box_2d"][1]) / 1000,
-                "height": (detection["box_2d"][2] - detection["box_2d"][0]) / 1000,
-                "label": detection["label"],
-                "polygon": normalized_polygon,
-                "confidence": detection.get("confidence")
+                "x": x,
+                "y": y,
+                "width": width,
+                "height": height,
+                "label": label,
+                "polygon": simplified.tolist(),
+                "vertex_count": len(simplified),
+                "original_vertex_count": len(polygon),
+                "confidence": score
             }
+            if keep_original:
+                formatted_detection["original_polygon"] = polygon.tolist()
             formatted.append(formatted_detection)
         
+        if original_vertices:
+            logger.info(f"Simplified polygons with {method}: {original_vertices} -> {simplified_vertices} vertices "
+                        f"({100 * (1 - simplified_vertices / original_vertices):.1f}% reduction)")
+        
         # Sort largest to smallest
         return sorted(formatted, key=lambda x: x["width"] * x["height"], reverse=True)
     
     elif detect_type == "3D bounding boxes":
         return [
             {
-                "center": detection["box_3d"][:3],
-                "size": detection["box_3d"][3:6],
-                "rpy": [x * 3.14159 / 180 for x in detection["box_3d"][6:]],
-                "label": detection["label"],
-                "confidence": detection.get("confidence")
+                "center": center,
+                "size": size,
+                "rpy": rpy,
+                "label": label,
+                "confidence": score
             }
-            for detection in detections
+            for center, size, rpy, label, score in zip(
+                columns["center"][keep].tolist(), columns["size"][keep].tolist(),
+                columns["rpy"][keep].tolist(), labels, confidence
+            )
         ]
-    
-    return detections
 
-def format_prompt_response(detect_type: str, parsed_response: List[dict]) -> List[dict]:
+def format_prompt_response(detect_type: str, parsed_response: List[dict], postprocess: Optional[PostprocessOptions] = None) -> List[dict]:
     """Format the prompt response to match frontend expectations"""
     logger.info(f"Formatting prompt response for {detect_type} with {len(parsed_response)} items")
     
+    if detect_type not in DETECT_TYPES:
+        return parsed_response
+    
+    columns = normalize_detections(detect_type, parsed_response)
+    keep = select_detections(detect_type, columns, postprocess)
+    labels = [columns["labels"][i] for i in keep]
+    
     if detect_type == "2D bounding boxes":
         return [
             {
-                "x": box["box_2d"][1] / 1000,
-                "y": box["box_2d"][0] / 1000,
-                "width": (box["box_2d"][3] - box["box_2d"][1]) / 1000,
-                "height": (box["box_2d"][2] - box["box_2d"][0]) / 1000,
-                "label": box["label"]
+                "x": x,
+                "y": y,
+                "width": width,
+                "height": height,
+                "label": label
             }
-            for box in parsed_response
+            for x, y, width, height, label in zip(
+                columns["x"][keep].tolist(), columns["y"][keep].tolist(),
+                columns["width"][keep].tolist(), columns["height"][keep].tolist(), labels
+            )
         ]
     
     elif detect_type == "Points":
         return [
             {
                 "point": {
-                    "x": point["point"][1] / 1000,
-                    "y": point["point"][0] / 1000
+                    "x": x,
+                    "y": y
                 },
-                "label": point["label"]
+                "label": label
             }
-            for point in parsed_response
+            for x, y, label in zip(columns["x"][keep].tolist(), columns["y"][keep].tolist(), labels)
         ]
     
     elif detect_type == "Segmentation masks":
         formatted = []
-        for i, box in enumerate(parsed_response):
-            mask_data = box.get("mask", "")
+        for i, x, y, width, height, label in zip(
+            keep.tolist(), columns["x"][keep].tolist(), columns["y"][keep].tolist(),
+            columns["width"][keep].tolist(), columns["height"][keep].tolist(), labels
+        ):
+            mask_data = parsed_response[i].get("mask", "")
             logger.info(f"Prompt response {i}: mask data length = {len(mask_data)}, has_mask = {bool(mask_data)}")
             if mask_data:
                 logger.info(f"Prompt response {i}: mask data preview = {mask_data[:50]}...")
             
             formatted_detection = {
-                "x": box["box_2d"][1] / 1000,
-                "y": box["box_2d"][0] / 1000,
-                "width": (box["box_2d"][3] - box["box_2d"][1]) / 1000,
-                "height": (box["box_2d"][2] - box["box_2d"][0]) / 1000,
-                "label": box["label"],
+                "x": x,
+                "y": y,
+                "width": width,
+                "height": height,
+                "label": label,
                 "imageData": mask_data
             }
             formatted.append(formatted_detection)
@@ -699,15 +1655,26 @@ def format_prompt_response(detect_type: str, parsed_response: List[dict]) -> Lis
     elif detect_type == "3D bounding boxes":
         return [
             {
-                "center": box["box_3d"][:3],
-                "size": box["box_3d"][3:6],
-                "rpy": [x * 3.14159 / 180 for x in box["box_3d"][6:]],
-                "label": box["label"]
+                "center": center,
+                "size": size,
+                "rpy": rpy,
+                "label": label
             }
-            for box in parsed_response
+            for center, size, rpy, label in zip(
+                columns["center"][keep].tolist(), columns["size"][keep].tolist(),
+                columns["rpy"][keep].tolist(), labels
+            )
         ]
-    
-    return parsed_response
+
+def render_overlay(img_base64: str, detections: List[dict], detect_type: str) -> str:
+    """create_image_with_overlays, reusing the image when the same detections were drawn on the same image before"""
+    key = hashlib.sha256(img_base64.encode() + orjson.dumps([detect_type, detections])).hexdigest()
+    cached = overlay_cache.get(key)
+    if cached is not None:
+        return cached.body.decode()
+    overlay_base64 = create_image_with_overlays(img_base64, detections, detect_type)
+    overlay_cache.put(key, overlay_base64.encode())
+    return overlay_base64
 
 def create_image_with_overlays(img_base64: str, detections: List[dict], detect_type: str) -> str:
     """Draw bounding boxes or overlays on the image and return as base64"""
@@ -891,14 +1858,88 @@ def generate_fallback_mask(xmin: int, ymin: int, xmax: int, ymax: int) -> str:
         logger.error(f"Failed to generate fallback mask: {e}")
         return ""
 
+@app.get("/routing/stats")
+async def get_routing_stats():
+    """Get model routing configuration, per-model latency percentiles and error rates"""
+    return model_router.stats()
+
+@app.get("/admission/stats")
+async def get_admission_stats():
+    """Get slots in use, the service time estimate and queued, admitted and shed requests per priority lane"""
+    return admission.stats()
+
+@app.get("/output-budget/stats")
+async def get_output_budget_stats():
+    """Get output budgets and, per detection type, latency percentiles, truncation and capping rates"""
+    return output_budget.stats()
+
+@app.get("/resolution/stats")
+async def get_resolution_stats():
+    """Get the resolution mode and profiles and the image sizes sent per detection type"""
+    return resolution_policy.stats()
+
+@app.get("/response-archive/stats")
+async def get_response_archive_stats():
+    """Recording/replay mode and counts of Gemini responses recorded or replayed"""
+    return response_archive.summary()
+
+@app.get("/prediction-cache/stats")
+async def get_prediction_cache_stats():
+    """Get size and hit-rate metrics of the serialized prediction cache"""
+    return prediction_cache.stats()
+
+@app.get("/maintenance/stats")
+async def get_maintenance_stats():
+    """Get retention policies, results of the last maintenance run and database space usage"""
+    return retention.stats()
+
+@app.get("/overlay-cache/stats")
+async def get_overlay_cache_stats():
+    """Get size and hit-rate metrics of the rendered overlay cache"""
+    return overlay_cache.stats()
+
+@app.get("/shared-cache/stats")
+async def get_shared_cache_stats():
+    """Get worker count and the size of the cache shared between workers"""
+    return {"workers": WEB_CONCURRENCY, **(shared_cache.stats() if shared_cache else {"path": None})}
+
+def require_profile_token(request: Request):
+    # Without a configured token the profile endpoints do not exist, rather than being open to anyone
+    if PROFILE_ADMIN_TOKEN is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not token_matches(request.headers.get(PROFILE_HEADER), PROFILE_ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Missing or wrong X-Profile-Token")
+
+@app.get("/admin/profiles", dependencies=[Depends(require_profile_token)])
+async def list_profiles(limit: int = 20):
+    """List the most recent request profiles, newest first"""
+    return await asyncio.to_thread(profile_store.recent, max(1, min(limit, 200)))
+
+@app.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_profile_token)])
+async def get_profile(profile_id: str):
+    """Download a profile: folded stacks for flame graphs, or a .pstats file"""
+    path = profile_store.path(profile_id)
+    if path is None or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    media_type = "text/plain" if path.endswith(".folded") else "application/octet-stream"
+    return FileResponse(path, media_type=media_type, filename=os.path.basename(path))
+
+@app.get("/phash-index/stats")
+async def get_phash_index_stats():
+    """Get size and hit-rate metrics of the near-duplicate image index"""
+    return phash_index.stats()
+
 @app.get("/history", response_model=List[PredictionHistory])
 async def get_prediction_history(
+    response: Response,
     limit: int = 50,
     detect_type: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
-    """Get prediction history with optional filtering"""
-    query = db.query(Prediction)
+    """Get prediction history with optional filtering; X-History-Cursor is where /history/changes picks up"""
+    # Read before the rows: a change committed in between is then sent again by the feed, never missed
+    response.headers["X-History-Cursor"] = str(latest_cursor(db))
+    query = db.query(Prediction).options(defer(Prediction.image_data))
     
     if detect_type:
         query = query.filter(Prediction.detect_type == detect_type)
@@ -913,23 +1954,223 @@ async def get_prediction_history(
             target_prompt=p.target_prompt,
             created_at=p.created_at,
             processing_time=p.processing_time,
+            image_size=p.image_size,
             result_count=len(p.results) if p.results else 0
         )
         for p in predictions
     ]
 
+@app.get("/history/changes")
+async def get_history_changes(
+    since: Optional[int] = None,
+    limit: int = 100,
+    detect_type: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Predictions created, updated or deleted after cursor since, for refreshing a loaded history.
+
+    Without since, only the current cursor is returned. With reset, since is too old
+    (or from another database): reload /history and continue from the cursor returned.
+    """
+    if since is None:
+        return {"cursor": latest_cursor(db), "reset": False, "has_more": False, "changes": []}
+    if since < 0:
+        raise HTTPException(status_code=400, detail="since must be a cursor from /history or /history/changes")
+    return read_changes(db, since, limit=min(max(limit, 1), 1000), detect_type=detect_type)
+
+@app.get("/history/stream")
+async def stream_history_changes(request: Request, since: Optional[int] = None, detect_type: Optional[str] = None):
+    """
+    Server-sent events with the history changes after since (or Last-Event-ID), pushed as they commit.
+
+    Each event's id is its cursor, so a reconnecting EventSource resumes where it stopped.
+    """
+    last_event_id = request.headers.get("last-event-id")
+    try:
+        cursor = int(last_event_id) if last_event_id else since
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Last-Event-ID must be a cursor from this stream")
+    if cursor is not None and cursor < 0:
+        raise HTTPException(status_code=400, detail="since must be a cursor from /history or /history/changes")
+    
+    def read(since: Optional[int]) -> dict:
+        init_database()
+        db = SessionLocal()
+        try:
+            if since is None:
+                return {"cursor": latest_cursor(db), "reset": False, "has_more": False, "changes": []}
+            return read_changes(db, since, limit=1000, detect_type=detect_type)
+        finally:
+            db.close()
+    
+    async def events():
+        nonlocal cursor
+        change_feed.subscribe()
+        try:
+            # Tell a new client the starting cursor, so it can resume even if nothing changes
+            if cursor is None:
+                cursor = (await asyncio.to_thread(read, None))["cursor"]
+                yield f"id: {cursor}\nevent: cursor\ndata: {orjson.dumps({'cursor': cursor}).decode()}\n\n"
+            while True:
+                page = await asyncio.to_thread(read, cursor)
+                if page["reset"] or page["changes"]:
+                    event = "reset" if page["reset"] else "changes"
+                    yield f"id: {page['cursor']}\nevent: {event}\ndata: {orjson.dumps(page).decode()}\n\n"
+                cursor = page["cursor"]
+                if page["has_more"]:
+                    continue
+                if not await change_feed.wait(CHANGE_FEED_KEEPALIVE):
+                    # A comment line: ignored by EventSource, keeps idle connections open through proxies
+                    yield ": keepalive\n\n"
+        finally:
+            change_feed.unsubscribe()
+    
+    return StreamingResponse(
+        events(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/history/stream/stats")
+async def get_history_stream_stats():
+    """Get open history streams and wake-ups sent to them"""
+    return change_feed.stats()
+
+@app.get("/search")
+async def search(
+    q: str,
+    field: str = "all",
+    detect_type: Optional[str] = None,
+    sort: str = "relevance",
+    prefix: bool = False,
+    limit: int = 20,
+    offset: int = 0,
+    db: Session = Depends(get_db)
+):
+    """Full-text search over detected labels and prompts, ranked by relevance or recency"""
+    if field not in SEARCH_FIELDS:
+        raise HTTPException(status_code=400, detail=f"Unknown field '{field}'. Use one of: {', '.join(SEARCH_FIELDS)}")
+    if sort not in SEARCH_SORTS:
+        raise HTTPException(status_code=400, detail=f"Unknown sort '{sort}'. Use one of: {', '.join(SEARCH_SORTS)}")
+    
+    return search_predictions(
+        db, q, field, detect_type, sort,
+        limit=min(max(limit, 1), 100), offset=max(offset, 0), prefix=prefix
+    )
+
+@app.get("/detections")
+async def get_detections(
+    region: Optional[str] = None,
+    mode: str = "intersects",
+    label: Optional[str] = None,
+    min_confidence: Optional[float] = None,
+    detect_type: Optional[str] = None,
+    limit: int = 100,
+    offset: int = 0,
+    db: Session = Depends(get_db)
+):
+    """Stored detections filtered by frame region ("x_min,y_min,x_max,y_max", 0-1), label and confidence"""
+    if mode not in REGION_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown mode '{mode}'. Use one of: {', '.join(REGION_MODES)}")
+    bounds = None
+    if region:
+        try:
+            bounds = tuple(float(value) for value in region.split(","))
+        except ValueError:
+            bounds = ()
+        if len(bounds) != 4 or bounds[0] > bounds[2] or bounds[1] > bounds[3]:
+            raise HTTPException(status_code=400, detail="region must be x_min,y_min,x_max,y_max with min <= max")
+    
+    return query_detections(
+        db, bounds, mode, label, min_confidence, detect_type,
+        limit=min(max(limit, 1), 1000), offset=max(offset, 0)
+    )
+
+@app.get("/export")
+async def export_predictions(
+    format: str = "ndjson",
+    images: str = "skip",
+    detect_type: Optional[str] = None,
+    model: Optional[str] = None,
+    created_after: Optional[str] = None,
+    created_before: Optional[str] = None
+):
+    """Stream stored predictions as NDJSON or a COCO annotations file, with images embedded, referenced or skipped"""
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format '{format}'. Use one of: {', '.join(EXPORT_FORMATS)}")
+    if images not in IMAGE_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown images '{images}'. Use one of: {', '.join(IMAGE_MODES)}")
+    try:
+        # ISO dates or date-times, e.g. 2025-01-31 or 2025-01-31T12:00
+        created_after = datetime.fromisoformat(created_after) if created_after else None
+        created_before = datetime.fromisoformat(created_before) if created_before else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="created_after and created_before must be ISO dates or date-times")
+    
+    def stream():
+        # Own session, open for as long as the response streams
+        init_database()
+        db = SessionLocal()
+        try:
+            yield from EXPORTERS[format](
+                db, images, detect_type=detect_type, model=model,
+                created_after=created_after, created_before=created_before
+            )
+        finally:
+            db.close()
+    
+    media_type, extension = ("application/x-ndjson", "ndjson") if format == "ndjson" else ("application/json", "json")
+    return StreamingResponse(
+        stream(), media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="predictions-{format}.{extension}"'}
+    )
+
 @app.get("/prediction/{prediction_id}")
-async def get_prediction(prediction_id: int, db: Session = Depends(get_db)):
+async def get_prediction(prediction_id: int, request: Request, db: Session = Depends(get_db)):
     """Get a specific prediction with full details"""
+    cached = prediction_cache.get(prediction_id)
+    if cached is None:
+        cached = prediction_cache.put(prediction_id, ORJSONResponse(load_prediction_details(prediction_id, db)).body)
+    
+    headers = {
+        "ETag": cached.etag,
+        "Cache-Control": f"private, max-age={PREDICTION_CACHE_MAX_AGE}, immutable"
+    }
+    if etag_matches(request.headers.get("if-none-match"), cached.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(cached.body, media_type="application/json", headers=headers)
+
+@app.get("/prediction/{prediction_id}/image")
+async def get_prediction_image(prediction_id: int, request: Request, db: Session = Depends(get_db)):
+    """The stored PNG image of a prediction, resolved from the parent row if shared"""
+    image_data = load_prediction_details(prediction_id, db)["image_data"]
+    if not image_data:
+        raise HTTPException(status_code=404, detail="Prediction has no image")
+    
+    body = base64.b64decode(image_data.split(",", 1)[1])
+    etag = make_etag(body)
+    headers = {"ETag": etag, "Cache-Control": f"private, max-age={PREDICTION_CACHE_MAX_AGE}, immutable"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="image/png", headers=headers)
+
+def load_prediction_details(prediction_id: int, db: Session) -> dict:
+    """Full prediction payload, with the image resolved from the parent row if shared"""
     prediction = db.query(Prediction).filter(Prediction.id == prediction_id).first()
     
     if not prediction:
         raise HTTPException(status_code=404, detail="Prediction not found")
     
+    # Multi-task rows share the image stored on their parent row
+    image_data = prediction.image_data
+    if image_data is None and prediction.parent_id is not None:
+        parent = db.query(Prediction).filter(Prediction.id == prediction.parent_id).first()
+        image_data = parent.image_data if parent else None
+    
     return {
         "id": prediction.id,
         "image_name": prediction.image_name,
-        "image_data": prediction.image_data,
+        "image_data": image_data,
         "detect_type": prediction.detect_type,
         "target_prompt": prediction.target_prompt,
         "label_prompt": prediction.label_prompt,
@@ -938,7 +2179,9 @@ async def get_prediction(prediction_id: int, db: Session = Depends(get_db)):
         "model_used": prediction.model_used,
         "results": prediction.results,
         "created_at": prediction.created_at,
-        "processing_time": prediction.processing_time
+        "processing_time": prediction.processing_time,
+        "image_size": prediction.image_size,
+        "parent_id": prediction.parent_id
     }
 
 @app.delete("/prediction/{prediction_id}")
@@ -949,9 +2192,15 @@ async def delete_prediction(prediction_id: int, db: Session = Depends(get_db)):
     if not prediction:
         raise HTTPException(status_code=404, detail="Prediction not found")
     
+    # Hand the shared image over to the next linked row before deleting its holder
+    children = hand_over_image(db, prediction)
+    
     db.delete(prediction)
     db.commit()
     
+    # Linked rows changed parent, so their cached payloads are stale too
+    prediction_cache.invalidate(prediction_id, *(child.id for child in children))
+    
     return {"message": "Prediction deleted successfully"}
 
 @app.post("/save-analysis")
@@ -985,8 +2234,8 @@ async def save_analysis(
         # Calculate processing time (just for the save operation)
         processing_time = time.time() - start_time
         
-        # Choose model name (same logic as analyze endpoint)
-        model_name = "gemini-2.0-flash" if detect_type == "3D bounding boxes" else "gemini-2.5-flash"
+        # The client called Gemini directly, so record the configured primary model
+        model_name = model_router.primary_model(detect_type)
         
         # Save to database
         prediction = Prediction(
@@ -1022,4 +2271,12 @@ async def save_analysis(
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    if shared_cache:
+        shared_cache.clear()
+    # Once here rather than racing in every worker
+    init_database()
+    if WEB_CONCURRENCY > 1:
+        # Each worker imports the app itself; see gunicorn.conf.py for workers forked from one preloaded app
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=WEB_CONCURRENCY)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,171 @@
+import json
+import os
+import threading
+import logging
+from collections import Counter, deque
+from pydantic import BaseModel
+from typing import Any, Deque, Dict, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Number of recent calls per detection type used for latency percentiles and truncation rates
+OUTPUT_BUDGET_WINDOW = int(os.getenv("OUTPUT_BUDGET_WINDOW", "500"))
+
+# Key under which single-call /analyze-multi requests are recorded
+MULTI_TASK = "multi-task"
+
+# Tokens added to max_output_tokens for models that think by default; their thoughts count against the limit
+THINKING_ALLOWANCE = int(os.getenv("OUTPUT_BUDGET_THINKING_ALLOWANCE", "8192"))
+
+# Model name prefixes that think with a dynamic budget, which the installed SDK cannot turn off
+THINKING_MODELS = ("gemini-2.5",)
+
+# Shares of max_output_tokens used, as bucket edges for latency-versus-budget stats
+USAGE_BUCKETS = (0.25, 0.5, 0.75)
+
+class OutputBudget(BaseModel):
+    """Limits on what Gemini writes for one detection type; None leaves a limit off"""
+    max_detections: Optional[int] = None  # Asked for in prompt and schema; extra detections are dropped
+    max_output_tokens: Optional[int] = None  # Answer tokens; thinking models get THINKING_ALLOWANCE on top
+
+# Off by default: every detection the model returns is kept. Gemini latency grows with output length
+# (a box or point costs ~20-30 tokens, a base64 PNG mask hundreds), so OUTPUT_BUDGETS can trade
+# completeness for tail latency deliberately, e.g. {"Segmentation masks": {"max_output_tokens": 8192}}
+DEFAULT_BUDGETS = {
+    "2D bounding boxes": OutputBudget(),
+    "Points": OutputBudget(),
+    "Segmentation masks": OutputBudget(),
+    "3D bounding boxes": OutputBudget(),
+}
+
+def load_budgets() -> Dict[str, OutputBudget]:
+    """Default budgets, overridden per detection type by the OUTPUT_BUDGETS JSON env var"""
+    budgets = dict(DEFAULT_BUDGETS)
+    overrides = os.getenv("OUTPUT_BUDGETS")
+    if overrides:
+        for detect_type, settings in json.loads(overrides).items():
+            base = budgets[detect_type].model_dump() if detect_type in budgets else {}
+            budgets[detect_type] = OutputBudget(**{**base, **settings})
+    return budgets
+
+def finish_reason(response: Any) -> Optional[str]:
+    """Name of the first candidate's finish reason, e.g. STOP or MAX_TOKENS"""
+    candidates = getattr(response, "candidates", None)
+    if not candidates:
+        return None
+    reason = getattr(candidates[0], "finish_reason", None)
+    return getattr(reason, "name", None) or (str(reason) if reason is not None else None)
+
+def output_tokens(response: Any) -> Optional[int]:
+    usage = getattr(response, "usage_metadata", None)
+    return getattr(usage, "candidates_token_count", None) if usage is not None else None
+
+class OutputBudgetController:
+    """
+    Applies output budgets to Gemini calls and tracks what they cost.
+
+    Each call records its latency, output tokens, whether the answer was
+    truncated (Gemini stopped at max_output_tokens, or the JSON ended
+    mid-array) and whether detections beyond max_detections were dropped.
+    stats() shows latency percentiles against the share of the budget used,
+    to choose budgets that trade completeness for tail latency deliberately.
+    """
+
+    def __init__(self, budgets: Optional[Dict[str, OutputBudget]] = None, window: int = OUTPUT_BUDGET_WINDOW):
+        self.budgets = budgets if budgets is not None else load_budgets()
+        self.window = window
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Deque[Tuple[float, Optional[int], Optional[int], bool, bool]]] = {}
+        self._totals: Dict[str, Counter] = {}
+
+    def max_detections(self, detect_type: str) -> Optional[int]:
+        budget = self.budgets.get(detect_type)
+        return budget.max_detections if budget else None
+
+    def max_output_tokens(self, detect_type: str) -> Optional[int]:
+        budget = self.budgets.get(detect_type)
+        return budget.max_output_tokens if budget else None
+
+    def apply(self, generation_config: Any, detect_types: Tuple[str, ...], model_name: str) -> Optional[int]:
+        """
+        Set max_output_tokens for a call answering detect_types: the sum of
+        their budgets, none if one is unbounded. Models that think by default
+        get THINKING_ALLOWANCE on top, so thoughts do not eat the answer's budget.
+        """
+        budgets = [self.max_output_tokens(detect_type) for detect_type in detect_types]
+        if not budgets or None in budgets:
+            return None
+        if model_name.startswith(THINKING_MODELS):
+            budgets.append(THINKING_ALLOWANCE)
+        generation_config.max_output_tokens = sum(budgets)
+        return generation_config.max_output_tokens
+
+    def cap(self, detect_type: str, detections: list) -> list:
+        """Detections within the detection type's max_detections, in the model's order"""
+        limit = self.max_detections(detect_type)
+        if limit is None or len(detections) <= limit:
+            return detections
+        logger.info(f"Dropped {len(detections) - limit} {detect_type} detections beyond max_detections={limit}")
+        return list(detections)[:limit]
+
+    def record(
+        self, key: str, latency: float, response: Any, max_output_tokens: Optional[int],
+        detections: Optional[int] = None, complete: bool = True
+    ) -> bool:
+        """
+        Record one call; returns whether its answer was truncated.
+
+        detections is the number the model returned before capping; complete
+        is False when the answer's JSON was cut off or could not be parsed.
+        """
+        truncated = finish_reason(response) == "MAX_TOKENS" or not complete
+        limit = self.max_detections(key)
+        capped = limit is not None and detections is not None and detections > limit
+        tokens = output_tokens(response)
+        if truncated:
+            logger.warning(f"{key} answer truncated after {tokens} output tokens (max_output_tokens={max_output_tokens})")
+        with self._lock:
+            self._calls.setdefault(key, deque(maxlen=self.window)).append(
+                (latency, tokens, max_output_tokens, truncated, capped)
+            )
+            totals = self._totals.setdefault(key, Counter())
+            totals["calls"] += 1
+            totals["truncated"] += truncated
+            totals["capped"] += capped
+        return truncated
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = {key: list(window) for key, window in self._calls.items()}
+            totals = {key: dict(counts) for key, counts in self._totals.items()}
+        return {
+            "budgets": {detect_type: budget.model_dump() for detect_type, budget in self.budgets.items()},
+            "calls": {key: {**totals[key], **self._window_stats(window)} for key, window in calls.items()}
+        }
+
+    @staticmethod
+    def _window_stats(window: list) -> Dict[str, Any]:
+        latencies = np.array([latency for latency, *_ in window])
+        tokens = [tokens for _, tokens, *_ in window if tokens is not None]
+        edges = (0,) + USAGE_BUCKETS + (1,)
+        by_usage: Dict[str, list] = {}
+        for latency, tokens_used, budget, _, _ in window:
+            if tokens_used is not None and budget:
+                bucket = int(np.searchsorted(USAGE_BUCKETS, tokens_used / budget, side="right"))
+                by_usage.setdefault(f"{edges[bucket]:.0%}-{edges[bucket + 1]:.0%}", []).append(latency)
+        return {
+            "samples": len(window),
+            "p50": float(np.percentile(latencies, 50)),
+            "p95": float(np.percentile(latencies, 95)),
+            "p99": float(np.percentile(latencies, 99)),
+            "mean_output_tokens": float(np.mean(tokens)) if tokens else None,
+            "truncated_rate": sum(call[3] for call in window) / len(window),
+            "capped_rate": sum(call[4] for call in window) / len(window),
+            # Latency by share of max_output_tokens used: what the tail costs at each fill level
+            "latency_by_budget_used": {
+                bucket: {"samples": len(values), "p50": float(np.percentile(values, 50)), "p95": float(np.percentile(values, 95))}
+                for bucket, values in sorted(by_usage.items())
+            }
+        }
@@ -0,0 +1,103 @@
+import json
+import logging
+from typing import Any, List, NamedTuple
+
+try:
+    import orjson
+except ImportError:  # Optional: the standard library parser is used instead
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+class ParsedOutput(NamedTuple):
+    items: List[Any]
+    complete: bool  # False when items were recovered from truncated output
+    skipped_bytes: int  # Text after the last recovered item that could not be used
+
+def loads(text: str) -> Any:
+    """json.loads, through orjson when it is installed"""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+def extract_json_text(text: str) -> str:
+    """
+    Text of the first ```json block, or the whole text without one.
+
+    The closing fence may be missing when the output was cut off.
+    """
+    if "```json" in text:
+        text = text.split("```json", 1)[1]
+        end = text.find("```")
+        if end != -1:
+            text = text[:end]
+    return text
+
+def _find_array(value: Any) -> Any:
+    """Models sometimes wrap the array in an object, e.g. {"detections": [...]}"""
+    if isinstance(value, dict):
+        for item in value.values():
+            if isinstance(item, list):
+                return item
+        return [value]
+    return value
+
+def parse_json_array(text: str) -> ParsedOutput:
+    """
+    Parse the JSON array in model output, recovering what it can.
+
+    Tries, in order: a fast parse of the whole (fenced) text; a parse of
+    the first JSON value, ignoring trailing garbage; and finally an element
+    by element scan of the array that keeps every complete element before
+    the point where the output was truncated or became malformed.
+
+    Raises:
+        json.JSONDecodeError: If not even one complete element can be read
+    """
+    text = extract_json_text(text)
+    try:
+        return ParsedOutput(_find_array(loads(text)), True, 0)
+    except ValueError:
+        pass
+
+    starts = [index for index in (text.find("["), text.find("{")) if index != -1]
+    if not starts:
+        raise json.JSONDecodeError("No JSON array found in model output", text, 0)
+    start = min(starts)
+
+    try:
+        value, end = _decoder.raw_decode(text, start)
+        return ParsedOutput(_find_array(value), True, len(text[end:].strip()))
+    except json.JSONDecodeError as e:
+        error = e
+
+    if text[start] != "[":
+        raise error
+
+    # Walk the array one element at a time; the C scanner does the heavy lifting
+    items = []
+    position = start + 1
+    length = len(text)
+    while True:
+        while position < length and text[position] in _WHITESPACE:
+            position += 1
+        if position >= length or text[position] == "]":
+            break
+        if text[position] == "," and items:
+            position += 1
+            continue
+        try:
+            item, position = _decoder.raw_decode(text, position)
+        except json.JSONDecodeError:
+            break
+        items.append(item)
+
+    if not items:
+        raise error
+
+    skipped_bytes = length - position
+    logger.warning(f"Recovered {len(items)} items from incomplete JSON output ({skipped_bytes} bytes skipped)")
+    return ParsedOutput(items, False, skipped_bytes)
@@ -0,0 +1,205 @@
+import numpy as np
+import io
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+from PIL import Image
+from typing import Any, Dict, Hashable, Optional
+
+import orjson
+
+from shared_cache import SharedCache
+
+logger = logging.getLogger(__name__)
+
+# Maximum Hamming distance (out of 64 bits) for an image to count as a near-duplicate, for requests
+# that do not send reuse_threshold; negative (the default) leaves reuse off unless a request asks for it
+DEFAULT_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", "-1"))
+
+# Maximum number of remembered images across all parameter sets
+DEFAULT_INDEX_SIZE = int(os.getenv("PHASH_INDEX_SIZE", "256"))
+
+# Entries older than this many seconds are never reused
+DEFAULT_MAX_AGE = float(os.getenv("PHASH_MAX_AGE", "60"))
+
+def dhash(image_data: bytes, hash_size: int = 8) -> int:
+    """
+    Compute a 64-bit difference hash of an image.
+
+    The image is shrunk to (hash_size + 1) x hash_size grayscale and each bit
+    records whether a pixel is brighter than its right-hand neighbour, so small
+    compression or sensor noise between frames leaves the hash unchanged.
+
+    Args:
+        image_data: Raw image bytes in any format PIL can open
+
+    Returns:
+        Hash as an unsigned integer
+    """
+    image = Image.open(io.BytesIO(image_data))
+    # Let JPEG decode at reduced scale; a no-op for other formats
+    image.draft("L", (hash_size * 8, hash_size * 8))
+    pixels = np.asarray(
+        image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR),
+        dtype=np.int16
+    )
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def hamming_distances(target: int, hashes: np.ndarray) -> np.ndarray:
+    """Hamming distance between one hash and an array of uint64 hashes"""
+    xor = np.bitwise_xor(hashes, np.uint64(target))
+    return np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+class PerceptualHashIndex:
+    """
+    Bounded LRU of recently analyzed image hashes and their results.
+
+    Entries are grouped by a parameter key (detect type, prompts, options) so a
+    result is only reused for an identical request on a near-identical image.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_INDEX_SIZE, max_age: float = DEFAULT_MAX_AGE):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key: Hashable, image_hash: int, max_distance: int = DEFAULT_MAX_DISTANCE) -> Optional[Dict[str, Any]]:
+        """
+        Find the closest fresh entry for key within max_distance.
+
+        Returns:
+            Dict with the stored result, prediction_id and distance, or None
+        """
+        with self._lock:
+            now = time.time()
+            candidates = [
+                (entry_id, entry) for entry_id, entry in self._entries.items()
+                if entry["key"] == key and now - entry["created_at"] <= self.max_age
+            ]
+
+            match = None
+            if candidates and max_distance >= 0:
+                hashes = np.array([entry["hash"] for _, entry in candidates], dtype=np.uint64)
+                distances = hamming_distances(image_hash, hashes)
+                best = int(np.argmin(distances))
+                if distances[best] <= max_distance:
+                    entry_id, entry = candidates[best]
+                    self._entries.move_to_end(entry_id)
+                    match = {
+                        "result": entry["result"],
+                        "prediction_id": entry["prediction_id"],
+                        "distance": int(distances[best])
+                    }
+
+            if match:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return match
+
+    def add(self, key: Hashable, image_hash: int, result: Any, prediction_id: Optional[int] = None):
+        """Remember a result, evicting the least recently used entries beyond max_entries"""
+        with self._lock:
+            self._entries[self._next_id] = {
+                "key": key,
+                "hash": image_hash,
+                "result": result,
+                "prediction_id": prediction_id,
+                "created_at": time.time()
+            }
+            self._next_id += 1
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit-rate metrics for the index"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "max_age": self.max_age,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+class SharedPerceptualHashIndex(PerceptualHashIndex):
+    """
+    The same index kept in a shared cache file, so every worker reuses results any of them stored.
+
+    Hashes are stored as signed 64-bit integers, SQLite's only integer type;
+    recency is the row id, which a hit moves past the newest entry.
+    """
+
+    def __init__(self, shared: SharedCache, max_entries: int = DEFAULT_INDEX_SIZE, max_age: float = DEFAULT_MAX_AGE):
+        super().__init__(max_entries, max_age)
+        self.shared = shared
+        self.shared.connection().executescript("""
+            CREATE TABLE IF NOT EXISTS phash_entries (
+                id INTEGER PRIMARY KEY,
+                key TEXT NOT NULL,
+                hash INTEGER NOT NULL,
+                prediction_id INTEGER,
+                created_at REAL NOT NULL,
+                result BLOB NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ix_phash_entries_key ON phash_entries (key, created_at);
+        """)
+
+    def lookup(self, key: Hashable, image_hash: int, max_distance: int = DEFAULT_MAX_DISTANCE) -> Optional[Dict[str, Any]]:
+        connection = self.shared.connection()
+        candidates = connection.execute(
+            "SELECT id, hash FROM phash_entries WHERE key = ? AND created_at >= ?",
+            (str(key), time.time() - self.max_age)
+        ).fetchall()
+
+        match = None
+        if candidates and max_distance >= 0:
+            hashes = np.array([entry_hash for _, entry_hash in candidates], dtype=np.int64).view(np.uint64)
+            distances = hamming_distances(image_hash, hashes)
+            best = int(np.argmin(distances))
+            if distances[best] <= max_distance:
+                row = connection.execute(
+                    "UPDATE phash_entries SET id = (SELECT max(id) + 1 FROM phash_entries) WHERE id = ? "
+                    "RETURNING result, prediction_id",
+                    (candidates[best][0],)
+                ).fetchone()
+                # Another worker may have evicted it since
+                if row is not None:
+                    match = {"result": orjson.loads(row[0]), "prediction_id": row[1], "distance": int(distances[best])}
+
+        self.shared.increment("phash", "hits" if match else "misses")
+        return match
+
+    def add(self, key: Hashable, image_hash: int, result: Any, prediction_id: Optional[int] = None):
+        connection = self.shared.connection()
+        signed_hash = image_hash - (1 << 64) if image_hash >= 1 << 63 else image_hash
+        connection.execute(
+            "INSERT INTO phash_entries (key, hash, prediction_id, created_at, result) VALUES (?, ?, ?, ?, ?)",
+            (str(key), signed_hash, prediction_id, time.time(), orjson.dumps(result))
+        )
+        connection.execute(
+            "DELETE FROM phash_entries WHERE id <= (SELECT max(id) FROM phash_entries) - ?", (self.max_entries,)
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        counters = self.shared.counters("phash")
+        hits, misses = counters.get("hits", 0), counters.get("misses", 0)
+        return {
+            "size": self.shared.connection().execute("SELECT count(*) FROM phash_entries").fetchone()[0],
+            "max_entries": self.max_entries,
+            "max_age": self.max_age,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "shared": self.shared.path
+        }
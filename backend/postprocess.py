@@ -0,0 +1,312 @@
+import numpy as np
+import os
+import logging
+from pydantic import BaseModel
+from typing import List, Optional, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+# Post-processing is opt-in: by default detections come back as the model returned them
+
+# Default IoU above which two same-label boxes are considered duplicates, e.g. 0.7; unset leaves NMS off
+DEFAULT_NMS_IOU = float(os.environ["NMS_IOU_THRESHOLD"]) if os.getenv("NMS_IOU_THRESHOLD") else None
+
+# Default distance (0-1 scale) under which two same-label points are considered duplicates, e.g. 0.01; 0 is off
+DEFAULT_POINT_RADIUS = float(os.getenv("POINT_DEDUP_RADIUS", "0"))
+
+# Default polygon simplification tolerance (0-1 scale, e.g. 0.002; 0 is off) and algorithm
+DEFAULT_POLYGON_TOLERANCE = float(os.getenv("POLYGON_TOLERANCE", "0"))
+DEFAULT_POLYGON_METHOD = os.getenv("POLYGON_METHOD", "douglas-peucker")
+POLYGON_METHODS = ["douglas-peucker", "visvalingam"]
+
+class PostprocessOptions(BaseModel):
+    """Per-request cleanup settings applied to formatted detections"""
+    min_confidence: Optional[float] = None
+    iou_threshold: Optional[float] = DEFAULT_NMS_IOU
+    point_radius: Optional[float] = DEFAULT_POINT_RADIUS
+    top_k: Optional[int] = None
+    polygon_tolerance: Optional[float] = DEFAULT_POLYGON_TOLERANCE
+    polygon_method: str = DEFAULT_POLYGON_METHOD
+    keep_original_polygon: bool = False
+
+    @property
+    def wants_polygons(self) -> bool:
+        """Whether segmentation should return polygons (function calling) instead of prompt-engineering masks"""
+        return bool(self.polygon_tolerance) or self.keep_original_polygon
+
+def build_postprocess_options(
+    min_confidence: Optional[float] = None,
+    iou_threshold: Optional[float] = None,
+    top_k: Optional[int] = None,
+    polygon_tolerance: Optional[float] = None,
+    polygon_method: Optional[str] = None,
+    keep_original_polygon: bool = False
+) -> PostprocessOptions:
+    """Build options from request form values, falling back to the server defaults"""
+    polygon_method = polygon_method or DEFAULT_POLYGON_METHOD
+    if polygon_method not in POLYGON_METHODS:
+        raise ValueError(f"Unknown polygon method: {polygon_method}")
+
+    return PostprocessOptions(
+        min_confidence=min_confidence,
+        iou_threshold=DEFAULT_NMS_IOU if iou_threshold is None else iou_threshold,
+        top_k=top_k,
+        polygon_tolerance=DEFAULT_POLYGON_TOLERANCE if polygon_tolerance is None else polygon_tolerance,
+        polygon_method=polygon_method,
+        keep_original_polygon=keep_original_polygon
+    )
+
+def normalize_detections(detect_type: str, detections: List[dict]) -> Dict[str, Any]:
+    """
+    Convert raw Gemini detections (0-1000 scale) into column arrays in one pass.
+
+    Args:
+        detect_type: Detection type the detections belong to
+        detections: Raw detections with box_2d / point / box_3d keys
+
+    Returns:
+        Dict of NumPy columns: geometry, labels, label_ids and confidence (NaN when missing)
+    """
+    count = len(detections)
+    labels = [detection["label"] for detection in detections]
+    confidence = np.array(
+        [detection.get("confidence") for detection in detections], dtype=float
+    ).reshape(count)
+
+    if labels:
+        _, label_ids = np.unique(np.array(labels, dtype=str), return_inverse=True)
+    else:
+        label_ids = np.zeros(0, dtype=int)
+
+    columns = {
+        "labels": labels,
+        "label_ids": label_ids.reshape(count),
+        "confidence": confidence,
+    }
+
+    if detect_type in ("2D bounding boxes", "Segmentation masks"):
+        # [ymin, xmin, ymax, xmax] -> x, y, width, height
+        boxes = np.array([list(detection["box_2d"])[:4] for detection in detections], dtype=float).reshape(count, 4) / 1000
+        columns["x"] = boxes[:, 1]
+        columns["y"] = boxes[:, 0]
+        columns["width"] = boxes[:, 3] - boxes[:, 1]
+        columns["height"] = boxes[:, 2] - boxes[:, 0]
+
+    elif detect_type == "Points":
+        # [y, x] -> x, y
+        points = np.array([list(detection["point"])[:2] for detection in detections], dtype=float).reshape(count, 2) / 1000
+        columns["x"] = points[:, 1]
+        columns["y"] = points[:, 0]
+
+    elif detect_type == "3D bounding boxes":
+        boxes = np.array([list(detection["box_3d"])[:9] for detection in detections], dtype=float).reshape(count, 9)
+        columns["center"] = boxes[:, :3]
+        columns["size"] = boxes[:, 3:6]
+        # Same conversion constant as before vectorising, so rpy values are unchanged
+        columns["rpy"] = boxes[:, 6:] * 3.14159 / 180
+
+    return columns
+
+def non_max_suppression(boxes: np.ndarray, scores: np.ndarray, label_ids: np.ndarray, iou_threshold: float) -> np.ndarray:
+    """
+    Class-aware greedy NMS over [x1, y1, x2, y2] boxes.
+
+    Each label is suppressed independently, so every step only compares
+    against the remaining boxes of the same class.
+
+    Returns:
+        Indices of kept boxes
+    """
+    areas = np.clip(boxes[:, 2] - boxes[:, 0], 0, None) * np.clip(boxes[:, 3] - boxes[:, 1], 0, None)
+
+    keep = []
+    for label_id in np.unique(label_ids):
+        order = np.flatnonzero(label_ids == label_id)
+        order = order[np.argsort(-scores[order], kind="stable")]
+        x1, y1, x2, y2 = (boxes[order, k] for k in range(4))
+        class_areas = areas[order]
+
+        # Boolean sweep over score-sorted boxes; contiguous slices keep each step cheap
+        alive = np.ones(len(order), dtype=bool)
+        for i in range(len(order)):
+            if not alive[i]:
+                continue
+            keep.append(order[i])
+
+            inter_w = np.clip(np.minimum(x2[i], x2[i + 1:]) - np.maximum(x1[i], x1[i + 1:]), 0, None)
+            inter_h = np.clip(np.minimum(y2[i], y2[i + 1:]) - np.maximum(y1[i], y1[i + 1:]), 0, None)
+            inter = inter_w * inter_h
+            union = class_areas[i] + class_areas[i + 1:] - inter
+            iou = np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+            alive[i + 1:] &= iou <= iou_threshold
+
+    return np.array(keep, dtype=int)
+
+def dedup_points(xs: np.ndarray, ys: np.ndarray, scores: np.ndarray, label_ids: np.ndarray, radius: float) -> np.ndarray:
+    """Greedy same-label point dedup: drop points within radius of a better-scored one, highest score first"""
+    order = np.argsort(-scores, kind="stable")
+
+    keep = []
+    while order.size:
+        best = order[0]
+        keep.append(best)
+        rest = order[1:]
+
+        distance = np.hypot(xs[rest] - xs[best], ys[rest] - ys[best])
+        duplicate = (label_ids[rest] == label_ids[best]) & (distance < radius)
+        order = rest[~duplicate]
+
+    return np.array(keep, dtype=int)
+
+def select_detections(detect_type: str, columns: Dict[str, Any], options: Optional[PostprocessOptions] = None) -> np.ndarray:
+    """
+    Apply confidence filtering, dedup/NMS and top-k to normalized detections.
+
+    Detections without a confidence always pass the threshold but rank below
+    scored ones for NMS and top-k.
+
+    Returns:
+        Indices of surviving detections in their original order
+    """
+    confidence = columns["confidence"]
+    indices = np.arange(len(confidence))
+    if options is None or len(indices) == 0:
+        return indices
+
+    if options.min_confidence is not None:
+        passing = np.isnan(confidence) | (confidence >= options.min_confidence)
+        indices = indices[passing]
+
+    scores = np.nan_to_num(confidence[indices], nan=0.0)
+    label_ids = columns["label_ids"][indices]
+
+    if detect_type in ("2D bounding boxes", "Segmentation masks") and options.iou_threshold is not None:
+        x1 = columns["x"][indices]
+        y1 = columns["y"][indices]
+        boxes = np.stack([x1, y1, x1 + columns["width"][indices], y1 + columns["height"][indices]], axis=1)
+        kept = non_max_suppression(boxes, scores, label_ids, options.iou_threshold)
+        ranked = indices[kept[np.argsort(-scores[kept], kind="stable")]]
+    elif detect_type == "Points" and options.point_radius:
+        ranked = indices[dedup_points(columns["x"][indices], columns["y"][indices], scores, label_ids, options.point_radius)]
+    else:
+        ranked = indices[np.argsort(-scores, kind="stable")]
+
+    if options.top_k is not None:
+        ranked = ranked[:max(options.top_k, 0)]
+
+    removed = len(confidence) - len(ranked)
+    if removed:
+        logger.info(f"Post-processing removed {removed} of {len(confidence)} {detect_type} detections")
+
+    return np.sort(ranked)
+
+def normalize_polygons(polygons: List[list]) -> List[np.ndarray]:
+    """
+    Convert polygons from 0-1000 scale to 0-1 scale in a single array operation.
+
+    Args:
+        polygons: One vertex list per detection; vertices with fewer than 2 values are dropped
+
+    Returns:
+        One (n, 2) float array per polygon (empty when no usable vertices)
+    """
+    vertex_lists = []
+    for polygon in polygons:
+        try:
+            vertices = np.asarray(polygon, dtype=float)
+        except (TypeError, ValueError):
+            vertices = None
+        if vertices is None or vertices.ndim != 2 or vertices.shape[1] < 2:
+            # Ragged input: keep only vertices with at least [x, y]
+            vertices = np.array([list(point)[:2] for point in polygon if len(point) >= 2], dtype=float).reshape(-1, 2)
+        vertex_lists.append(vertices[:, :2])
+
+    if not vertex_lists:
+        return []
+
+    lengths = [len(vertices) for vertices in vertex_lists]
+    flat = np.concatenate(vertex_lists) / 1000
+    return np.split(flat, np.cumsum(lengths)[:-1])
+
+def douglas_peucker(points: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    Simplify a closed polygon with the Douglas-Peucker algorithm.
+
+    The ring is split at the vertex farthest from the first one so both
+    halves are open chains; each split step measures all candidate
+    distances at once.
+    """
+    count = len(points)
+    ring = np.vstack([points, points[:1]])
+    far = int(np.argmax(np.hypot(*(points - points[0]).T)))
+    if far == 0:
+        return points[:1]
+
+    keep = np.zeros(count + 1, dtype=bool)
+    keep[[0, far, count]] = True
+    stack = [(0, far), (far, count)]
+
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+
+        anchor = ring[start]
+        direction = ring[end] - anchor
+        offsets = ring[start + 1:end] - anchor
+        length = np.hypot(*direction)
+        if length > 0:
+            distances = np.abs(direction[0] * offsets[:, 1] - direction[1] * offsets[:, 0]) / length
+        else:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+
+    return ring[keep][:-1]
+
+def visvalingam(points: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    Simplify a closed polygon with the Visvalingam-Whyatt algorithm.
+
+    Vertices whose triangle with their neighbours is smaller than tolerance**2
+    are removed in rounds; each round drops every non-adjacent local minimum
+    at once instead of one vertex at a time.
+    """
+    min_area = tolerance ** 2
+
+    while len(points) > 3:
+        previous = np.roll(points, 1, axis=0)
+        following = np.roll(points, -1, axis=0)
+        areas = 0.5 * np.abs(
+            (previous[:, 0] - points[:, 0]) * (following[:, 1] - points[:, 1])
+            - (following[:, 0] - points[:, 0]) * (previous[:, 1] - points[:, 1])
+        )
+
+        candidates = (areas < min_area) & (areas <= np.roll(areas, 1)) & (areas <= np.roll(areas, -1))
+        # Never remove two neighbours in the same round
+        candidates &= ~np.roll(candidates, 1)
+        if not candidates.any():
+            break
+
+        if len(points) - candidates.sum() < 3:
+            candidates[np.flatnonzero(candidates)[len(points) - 3:]] = False
+        points = points[~candidates]
+
+    return points
+
+def simplify_polygon(points: np.ndarray, tolerance: Optional[float], method: str = DEFAULT_POLYGON_METHOD) -> np.ndarray:
+    """Simplify a normalized polygon, keeping the original if it would degenerate below 3 vertices"""
+    if not tolerance or len(points) <= 3:
+        return points
+
+    if method == "visvalingam":
+        simplified = visvalingam(points, tolerance)
+    else:
+        simplified = douglas_peucker(points, tolerance)
+
+    return simplified if len(simplified) >= 3 else points
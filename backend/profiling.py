@@ -0,0 +1,263 @@
+"""
+Opt-in per-request profiling.
+
+A request is profiled when it carries the admin token in the X-Profile-Token
+header, or is picked by PROFILE_SAMPLE_RATE. The default sampling profiler
+records the request's stack every PROFILE_INTERVAL seconds, both while it
+runs and while it waits (on Gemini, the database, a thread). Samples are
+saved in folded-stack format (one "frame;frame;frame count" line per stack),
+which flamegraph.pl, inferno and speedscope read. The cProfile mode saves
+.pstats files instead (snakeviz, flameprof); it sees the whole event loop
+thread, so concurrent requests show up in it too.
+
+With profiling disabled (no rate, no token) the middleware passes requests
+straight through.
+"""
+import asyncio
+import cProfile
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+# Share of requests profiled without being asked, e.g. 0.01; 0 profiles only on request
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+
+# Requests sending this in X-Profile-Token are profiled; the profile endpoints require it and are off without it
+PROFILE_ADMIN_TOKEN = os.getenv("PROFILE_ADMIN_TOKEN") or None
+
+# "sampling" (folded stacks of this request) or "cprofile" (.pstats of the event loop thread)
+PROFILER = os.getenv("PROFILER", "sampling")
+
+# Seconds between stack samples
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+
+# Profiles are written here; the oldest beyond PROFILE_KEEP are deleted
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "100"))
+
+PROFILE_HEADER = "x-profile-token"
+
+def token_matches(supplied: Optional[str], token: Optional[str]) -> bool:
+    """Constant-time check of a supplied X-Profile-Token; never matches when no token is configured"""
+    if supplied is None or token is None:
+        return False
+    return hmac.compare_digest(supplied.encode(), token.encode())
+
+# Paths never profiled: reading profiles should not make new ones
+EXCLUDED_PREFIXES = ("/admin/profiles",)
+
+_REQUEST_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+def _label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class StackSampler:
+    """
+    Samples one asyncio task's stack from a background thread.
+
+    While the task runs, its frames are read from the event loop thread;
+    while it is suspended, the chain of coroutines it awaits is walked
+    instead and the stack ends in "[awaiting]", so time spent waiting is
+    attributed to where the request waits.
+    """
+
+    def __init__(self, task: asyncio.Task, loop: asyncio.AbstractEventLoop, root_code, interval: float = PROFILE_INTERVAL):
+        self.task = task
+        self.loop = loop
+        self.root_code = root_code
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                stack = self._sample()
+            except Exception:  # The task's frames changed under us; skip this sample
+                continue
+            if stack:
+                self.samples[";".join(stack)] += 1
+
+    def _sample(self) -> List[str]:
+        if asyncio.current_task(self.loop) is self.task:
+            frame = sys._current_frames().get(self.thread_id)
+            codes = []
+            while frame is not None:
+                codes.append(frame.f_code)
+                frame = frame.f_back
+            codes.reverse()
+            suffix = []
+        else:
+            codes = []
+            awaitable = self.task.get_coro()
+            while awaitable is not None:
+                frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None)
+                if frame is None:
+                    break
+                codes.append(frame.f_code)
+                awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+            suffix = ["[awaiting]"]
+        # Frames above the middleware (server, event loop) are the same in every sample
+        if self.root_code in codes:
+            codes = codes[codes.index(self.root_code):]
+        return [_label(code) for code in codes] + suffix
+
+class ProfileStore:
+    """Profiles on disk as <id>.json metadata next to the profile data, shared by all workers"""
+
+    def __init__(self, directory: str = PROFILE_DIR, keep: int = PROFILE_KEEP):
+        self.directory = directory
+        self.keep = keep
+
+    def save(self, metadata: Dict[str, Any], data: bytes, suffix: str):
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, metadata["id"])
+        with open(base + suffix, "wb") as f:
+            f.write(data)
+        # Metadata last: a profile is listed only once its data is complete
+        with open(base + ".json", "w") as f:
+            json.dump({**metadata, "file": metadata["id"] + suffix}, f)
+        self._prune()
+
+    def _metadata_files(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(".json")]
+        return sorted(paths, key=os.path.getmtime, reverse=True)
+
+    def _prune(self):
+        for path in self._metadata_files()[self.keep:]:
+            metadata = self._read(path)
+            for name in (os.path.basename(path), metadata.get("file") if metadata else None):
+                if name:
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                    except FileNotFoundError:
+                        pass
+
+    @staticmethod
+    def _read(path: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def recent(self, limit: int = 20) -> List[Dict[str, Any]]:
+        profiles = (self._read(path) for path in self._metadata_files()[:limit])
+        return [profile for profile in profiles if profile]
+
+    def path(self, profile_id: str) -> Optional[str]:
+        """Data file of a profile, or None"""
+        if not _REQUEST_ID.match(profile_id):
+            return None
+        metadata = self._read(os.path.join(self.directory, profile_id + ".json"))
+        return os.path.join(self.directory, metadata["file"]) if metadata else None
+
+class ProfilingMiddleware:
+    """Profiles requests chosen by header or sampling; see the module docstring"""
+
+    def __init__(
+        self, app: ASGIApp, store: Optional[ProfileStore] = None, sample_rate: float = PROFILE_SAMPLE_RATE,
+        token: Optional[str] = PROFILE_ADMIN_TOKEN, profiler: str = PROFILER
+    ):
+        self.app = app
+        self.store = store or ProfileStore()
+        self.sample_rate = sample_rate
+        self.token = token
+        self.profiler = profiler
+        self.enabled = sample_rate > 0 or token is not None
+        # cProfile hooks the whole thread, so only one request is profiled that way at a time
+        self._cprofile_busy = False
+
+    def selected(self, scope: Scope) -> bool:
+        if scope["type"] != "http" or scope["path"].startswith(EXCLUDED_PREFIXES):
+            return False
+        if self.token is not None:
+            if token_matches(Headers(scope=scope).get(PROFILE_HEADER), self.token):
+                return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if not self.enabled or not self.selected(scope):
+            await self.app(scope, receive, send)
+            return
+        if self.profiler == "cprofile" and self._cprofile_busy:
+            await self.app(scope, receive, send)
+            return
+
+        requested_id = Headers(scope=scope).get("x-request-id", "")
+        profile_id = requested_id if _REQUEST_ID.match(requested_id) else uuid.uuid4().hex
+        status = {"code": None}
+
+        async def send_with_id(message: Message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                MutableHeaders(scope=message).append("x-profile-id", profile_id)
+            await send(message)
+
+        started = time.perf_counter()
+        if self.profiler == "cprofile":
+            self._cprofile_busy = True
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                await self.app(scope, receive, send_with_id)
+            finally:
+                profile.disable()
+                self._cprofile_busy = False
+            data, suffix, samples = None, ".pstats", None
+        else:
+            sampler = StackSampler(asyncio.current_task(), asyncio.get_running_loop(), ProfilingMiddleware.__call__.__code__)
+            sampler.start()
+            try:
+                await self.app(scope, receive, send_with_id)
+            finally:
+                sampler.stop()
+            data = "".join(f"{stack} {count}\n" for stack, count in sampler.samples.items()).encode()
+            suffix, samples = ".folded", sum(sampler.samples.values())
+
+        metadata = {
+            "id": profile_id,
+            "method": scope["method"],
+            "path": scope["path"],
+            "status": status["code"],
+            "duration": time.perf_counter() - started,
+            "profiler": self.profiler,
+            "samples": samples,
+            "created_at": time.time()
+        }
+        if data is None:
+            data = await asyncio.to_thread(_pstats_bytes, profile)
+        await asyncio.to_thread(self.store.save, metadata, data, suffix)
+        logger.info(f"Profiled {scope['method']} {scope['path']} as {profile_id} ({metadata['duration']:.3f}s)")
+
+def _pstats_bytes(profile: cProfile.Profile) -> bytes:
+    """The marshalled stats dump_stats would write"""
+    import marshal
+
+    profile.create_stats()
+    return marshal.dumps(profile.stats)
@@ -0,0 +1,135 @@
+import json
+import os
+import threading
+import logging
+from collections import Counter
+from pydantic import BaseModel
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+RESOLUTION_MODES = ("fixed", "profile", "adaptive")
+
+# Default way of choosing the size of images sent to Gemini (overridable per request)
+RESOLUTION_MODE = os.getenv("RESOLUTION_MODE", "profile")
+
+# Maximum dimension of every image in fixed mode, as before resolution profiles
+FIXED_MAX_SIZE = 800
+
+# In adaptive mode, a first-pass answer is kept when its smallest object is at least this many pixels across
+ADAPTIVE_MIN_OBJECT_PIXELS = float(os.getenv("ADAPTIVE_MIN_OBJECT_PIXELS", "32"))
+
+class ResolutionProfile(BaseModel):
+    """Image sizes for one detection type"""
+    max_size: int  # Maximum dimension of the image sent
+    first_pass_size: int  # Maximum dimension of the adaptive first pass
+
+# Points and coarse boxes hold up at small sizes, masks lose outline detail (benchmarks/eval_resolution.py)
+DEFAULT_PROFILES = {
+    "2D bounding boxes": ResolutionProfile(max_size=640, first_pass_size=384),
+    "3D bounding boxes": ResolutionProfile(max_size=800, first_pass_size=512),
+    "Points": ResolutionProfile(max_size=512, first_pass_size=384),
+    "Segmentation masks": ResolutionProfile(max_size=1024, first_pass_size=640),
+}
+
+def load_profiles() -> Dict[str, ResolutionProfile]:
+    """Default profiles, overridden per detection type by the RESOLUTION_PROFILES JSON env var"""
+    profiles = dict(DEFAULT_PROFILES)
+    overrides = os.getenv("RESOLUTION_PROFILES")
+    if overrides:
+        for detect_type, settings in json.loads(overrides).items():
+            base = profiles[detect_type].model_dump() if detect_type in profiles else {}
+            profiles[detect_type] = ResolutionProfile(**{**base, **settings})
+    return profiles
+
+def smallest_object(detections: List[dict], width: int, height: int) -> Optional[float]:
+    """
+    Pixel size of the finest thing in a formatted result (0-1 coordinates): the
+    shorter side of the smallest box, or the distance between the two closest
+    points. None without either.
+    """
+    sizes = [
+        min(detection["width"] * width, detection["height"] * height)
+        for detection in detections if "width" in detection and "height" in detection
+    ]
+    points = [(detection["point"]["x"], detection["point"]["y"]) for detection in detections if "point" in detection]
+    if len(points) > 1:
+        pixels = np.array(points, dtype=float) * [width, height]
+        distances = np.linalg.norm(pixels[:, None] - pixels[None, :], axis=-1)
+        np.fill_diagonal(distances, np.inf)
+        sizes.append(float(distances.min()))
+    return min(sizes) if sizes else None
+
+class ResolutionPolicy:
+    """
+    Picks the maximum dimension of the image sent for each detection type.
+
+    fixed sends every image at FIXED_MAX_SIZE; profile uses the detection
+    type's max_size; adaptive first tries first_pass_size and keeps that
+    answer unless it is empty or its smallest object is under
+    min_object_pixels, in which case the request is repeated at max_size.
+    """
+
+    def __init__(
+        self, profiles: Optional[Dict[str, ResolutionProfile]] = None, mode: str = RESOLUTION_MODE,
+        min_object_pixels: float = ADAPTIVE_MIN_OBJECT_PIXELS
+    ):
+        self.profiles = profiles if profiles is not None else load_profiles()
+        self.mode = self.resolve_mode(mode)
+        self.min_object_pixels = min_object_pixels
+        self._lock = threading.Lock()
+        self._sizes: Dict[str, Counter] = {}
+        self._escalations: Counter = Counter()
+
+    def resolve_mode(self, mode: Optional[str]) -> str:
+        """A request's mode, or the default when it sets none; ValueError when unknown"""
+        if mode is None:
+            return self.mode
+        if mode not in RESOLUTION_MODES:
+            raise ValueError(f"Unknown resolution mode '{mode}'. Use one of: {', '.join(RESOLUTION_MODES)}")
+        return mode
+
+    def max_size(self, detect_type: str, mode: str) -> int:
+        profile = self.profiles.get(detect_type)
+        if mode == "fixed" or profile is None:
+            return FIXED_MAX_SIZE
+        return profile.max_size
+
+    def sizes(self, detect_type: str, mode: str, longest_side: int, skip_resize: bool = False) -> List[int]:
+        """
+        Sizes to try in order: the first pass and the full size in adaptive
+        mode, else one size. With skip_resize every pass would send the same
+        image, so there is only one.
+        """
+        size = self.max_size(detect_type, mode)
+        profile = self.profiles.get(detect_type)
+        if mode == "adaptive" and not skip_resize and profile is not None and profile.first_pass_size < min(size, longest_side):
+            return [profile.first_pass_size, size]
+        return [size]
+
+    def needs_more_resolution(self, detections: List[dict], width: int, height: int) -> bool:
+        """Whether a first-pass answer may have missed or merged objects too small for its image"""
+        if not detections:
+            return True
+        smallest = smallest_object(detections, width, height)
+        return smallest is not None and smallest < self.min_object_pixels
+
+    def record(self, detect_type: str, image_size: int, escalated: bool = False):
+        with self._lock:
+            self._sizes.setdefault(detect_type, Counter())[image_size] += 1
+            if escalated:
+                self._escalations[detect_type] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            sizes = {detect_type: dict(sorted(counts.items())) for detect_type, counts in self._sizes.items()}
+            escalations = dict(self._escalations)
+        return {
+            "mode": self.mode,
+            "min_object_pixels": self.min_object_pixels,
+            "profiles": {detect_type: profile.model_dump() for detect_type, profile in self.profiles.items()},
+            "sizes_sent": sizes,
+            "adaptive_escalations": escalations
+        }
@@ -0,0 +1,199 @@
+import asyncio
+import atexit
+import gzip
+import hashlib
+import json
+import os
+import time
+import threading
+import logging
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Sequence
+
+from lazy_imports import lazy_import
+
+genai = lazy_import("google.generativeai")
+api_exceptions = lazy_import("google.api_core.exceptions")
+generation_types = lazy_import("google.generativeai.types.generation_types")
+
+logger = logging.getLogger(__name__)
+
+# Append every Gemini request fingerprint and raw response to this gzipped JSON-lines archive
+RECORD_PATH = os.getenv("GEMINI_RECORD_PATH")
+
+# Serve Gemini responses from this archive instead of calling the API
+REPLAY_PATH = os.getenv("GEMINI_REPLAY_PATH")
+
+# Replay timing: 1 keeps the recorded latency, 10 is ten times faster, 0 returns immediately
+REPLAY_SPEED = float(os.getenv("GEMINI_REPLAY_SPEED", "1"))
+
+# With strict replay a request that was never recorded fails; otherwise it gets the
+# next recorded response of the same call type, so any image can be replayed against
+REPLAY_STRICT = os.getenv("GEMINI_REPLAY_STRICT", "true").lower() == "true"
+
+def request_fingerprint(
+    call: str, img_base64: str, prompt: str,
+    tool_names: Sequence[str] = (), generation_config: Any = None
+) -> str:
+    """
+    Stable hash of the image, prompt, tools and temperature of a request.
+
+    The model (and its thinking budget) is left out: routing may send the
+    same request to another model on replay, and the response recorded
+    for it is still wanted.
+    """
+    request = {
+        "call": call,
+        "image": hashlib.sha256(img_base64.encode()).hexdigest(),
+        "prompt": prompt,
+        "tools": list(tool_names),
+        "temperature": getattr(generation_config, "temperature", None)
+    }
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()[:32]
+
+def load_archive(path: str) -> List[Dict[str, Any]]:
+    """Read all records, tolerating a final record cut short by a crash"""
+    records = []
+    try:
+        with gzip.open(path, "rt") as f:
+            for line in f:
+                if line.strip():
+                    records.append(json.loads(line))
+    except (EOFError, json.JSONDecodeError) as e:
+        logger.warning(f"Archive {path} ends with an incomplete record: {e}")
+    return records
+
+class ResponseArchive:
+    """
+    Records raw Gemini responses, or replays them in place of the API.
+
+    Records are one JSON object per line in a gzip stream: the request
+    fingerprint, call type, model, latency, and either the response as
+    returned by the SDK or the error it raised. Replayed responses are
+    rebuilt into SDK response objects, so everything downstream of the
+    model call runs unchanged.
+    """
+
+    def __init__(
+        self,
+        record_path: Optional[str] = RECORD_PATH,
+        replay_path: Optional[str] = REPLAY_PATH,
+        replay_speed: float = REPLAY_SPEED,
+        replay_strict: bool = REPLAY_STRICT
+    ):
+        self.record_path = record_path
+        self.replay_path = replay_path
+        self.replay_speed = replay_speed
+        self.replay_strict = replay_strict
+        self._file = None
+        self._lock = threading.Lock()
+        self._by_fingerprint: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._by_call: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._cursors: Dict[Any, int] = defaultdict(int)
+        self.stats = {"recorded": 0, "replayed": 0, "replay_misses": 0}
+
+        if replay_path:
+            records = load_archive(replay_path)
+            for record in records:
+                self._by_fingerprint[record["fingerprint"]].append(record)
+                self._by_call[record["call"]].append(record)
+            logger.info(f"Replaying {len(records)} Gemini responses from {replay_path}")
+        if record_path:
+            logger.info(f"Recording Gemini responses to {record_path}")
+
+    async def generate(
+        self, model: Any, contents: list, generation_config: Any,
+        call: str, model_name: str, fingerprint: str
+    ) -> Any:
+        """Call model.generate_content_async, or replay the recorded response for this request"""
+        if self.replay_path:
+            return await self._replay(call, fingerprint)
+
+        start_time = time.time()
+        try:
+            response = await model.generate_content_async(contents, generation_config=generation_config)
+        except Exception as e:
+            if self.record_path:
+                # API errors carry their HTTP status, so replay can raise the same exception type
+                code = getattr(e, "code", None)
+                self._record(fingerprint, call, model_name, time.time() - start_time, error={
+                    "type": type(e).__name__,
+                    "message": getattr(e, "message", None) or str(e),
+                    "code": code if isinstance(code, int) else None
+                })
+            raise
+        if self.record_path:
+            self._record(fingerprint, call, model_name, time.time() - start_time, response=response.to_dict())
+        return response
+
+    def _record(self, fingerprint: str, call: str, model_name: str, latency: float,
+                response: Optional[dict] = None, error: Optional[dict] = None):
+        line = json.dumps({
+            "fingerprint": fingerprint,
+            "call": call,
+            "model": model_name,
+            "latency": latency,
+            "recorded_at": time.time(),
+            "response": response,
+            "error": error
+        }, separators=(",", ":"))
+        with self._lock:
+            if self._file is None:
+                self._file = gzip.open(self.record_path, "at")
+                # An unterminated gzip member would corrupt the next run's appended records
+                atexit.register(self.close)
+            self._file.write(line + "\n")
+            # Sync flush so records survive a crash of the server
+            self._file.flush()
+            self.stats["recorded"] += 1
+
+    def _next_record(self, call: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """Recorded responses for the same key are served in turn, cycling"""
+        with self._lock:
+            candidates, key = self._by_fingerprint.get(fingerprint), fingerprint
+            if not candidates:
+                self.stats["replay_misses"] += 1
+                if self.replay_strict:
+                    return None
+                candidates, key = self._by_call.get(call), ("call", call)
+                if not candidates:
+                    return None
+            record = candidates[self._cursors[key] % len(candidates)]
+            self._cursors[key] += 1
+            self.stats["replayed"] += 1
+            return record
+
+    async def _replay(self, call: str, fingerprint: str) -> Any:
+        record = self._next_record(call, fingerprint)
+        if record is None:
+            raise LookupError(f"No recorded {call} response for request {fingerprint}")
+
+        if self.replay_speed > 0:
+            await asyncio.sleep(record["latency"] / self.replay_speed)
+
+        error = record.get("error")
+        if error:
+            if error.get("code"):
+                raise api_exceptions.from_http_status(error["code"], error["message"])
+            raise Exception(error["message"])
+
+        return generation_types.AsyncGenerateContentResponse.from_response(
+            genai.protos.GenerateContentResponse(record["response"])
+        )
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "mode": "replay" if self.replay_path else "record" if self.record_path else "off",
+            "record_path": self.record_path,
+            "replay_path": self.replay_path,
+            "replay_speed": self.replay_speed,
+            "replay_strict": self.replay_strict,
+            "archived_responses": sum(len(records) for records in self._by_fingerprint.values()),
+            **self.stats
+        }
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,127 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, NamedTuple, Optional
+
+from shared_cache import SharedCache
+
+# Total size of serialized responses kept in memory
+DEFAULT_CACHE_BYTES = int(os.getenv("PREDICTION_CACHE_BYTES", str(64 * 1024 * 1024)))
+
+# Total size of rendered overlay images kept for repeated analyze-with-overlay results
+OVERLAY_CACHE_BYTES = int(os.getenv("OVERLAY_CACHE_BYTES", str(32 * 1024 * 1024)))
+
+# Browser cache lifetime for prediction payloads, which are never modified once stored
+PREDICTION_CACHE_MAX_AGE = int(os.getenv("PREDICTION_CACHE_MAX_AGE", "31536000"))
+
+# Length of make_etag values: 32 hex digits in quotes
+_ETAG_LENGTH = 34
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    etag: str
+
+def make_etag(body: bytes) -> str:
+    """Strong validator derived from the exact response bytes"""
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match check with weak comparison, as RFC 9110 requires for it"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == opaque for candidate in if_none_match.split(","))
+
+class ResponseCache:
+    """
+    LRU of serialized responses bounded by their total size in bytes.
+
+    Entries are immutable; anything that changes a cached resource must
+    invalidate its key. With a shared cache, entries are kept there under
+    namespace instead of in process memory, so every worker sees the same
+    entries and invalidations.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BYTES, shared: Optional[SharedCache] = None, namespace: str = "responses"):
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self.namespace = namespace
+        self._entries: "OrderedDict[Hashable, CachedResponse]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[CachedResponse]:
+        if self.shared is not None:
+            value = self.shared.get(self.namespace, str(key))
+            self.shared.increment(self.namespace, "misses" if value is None else "hits")
+            # Stored as the fixed-length ETag followed by the body
+            return None if value is None else CachedResponse(value[_ETAG_LENGTH:], value[:_ETAG_LENGTH].decode())
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: Hashable, body: bytes) -> CachedResponse:
+        """Cache a response body; bodies larger than the whole cache are not kept"""
+        entry = CachedResponse(body, make_etag(body))
+        if len(body) > self.max_bytes:
+            return entry
+        if self.shared is not None:
+            self.shared.put(self.namespace, str(key), entry.etag.encode() + body)
+            return entry
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous.body)
+            self._entries[key] = entry
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted.body)
+                self.evictions += 1
+        return entry
+
+    def invalidate(self, *keys: Hashable):
+        if self.shared is not None:
+            self.shared.delete(self.namespace, *(str(key) for key in keys))
+            return
+        with self._lock:
+            for key in keys:
+                entry = self._entries.pop(key, None)
+                if entry is not None:
+                    self._bytes -= len(entry.body)
+
+    def stats(self) -> Dict[str, Any]:
+        if self.shared is not None:
+            counters = self.shared.counters(self.namespace)
+            hits, misses = counters.get("hits", 0), counters.get("misses", 0)
+            return {
+                **self.shared.usage(self.namespace),
+                "max_bytes": self.shared.max_bytes,
+                "hits": hits,
+                "misses": misses,
+                "evictions": self.shared.counters("").get("evictions", 0),
+                "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+                "shared": self.shared.path
+            }
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
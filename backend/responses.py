@@ -0,0 +1,215 @@
+import base64
+import os
+import zlib
+from typing import Any, List, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+from pydantic import BaseModel
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # Optional: only gzip is offered without it
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:  # Optional: responses stay JSON without it
+    msgpack = None
+
+# Content encodings to offer, in order of preference, e.g. "br,gzip"; empty disables compression
+RESPONSE_COMPRESSION = [
+    encoding.strip() for encoding in os.getenv("RESPONSE_COMPRESSION", "").split(",") if encoding.strip()
+]
+
+# Responses smaller than this many bytes are sent uncompressed
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+
+# Base64 image data barely compresses at any level, so fast levels cost little size
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "1"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "1"))
+
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+# Content types that are already compressed
+UNCOMPRESSED_TYPES = ("image/", "application/zip", "application/gzip")
+
+class MsgpackResponse(Response):
+    media_type = MSGPACK_MEDIA_TYPE
+
+    def render(self, content: Any) -> bytes:
+        return msgpack.packb(content)
+
+def data_urls_to_bytes(value: Any) -> Any:
+    """Replace base64 data URLs with their raw bytes, which msgpack sends as binary"""
+    if isinstance(value, str):
+        if value.startswith("data:") and ";base64," in value[:64]:
+            return base64.b64decode(value.split(",", 1)[1])
+        return value
+    if isinstance(value, dict):
+        return {key: data_urls_to_bytes(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [data_urls_to_bytes(item) for item in value]
+    return value
+
+def wants_msgpack(request: Request) -> bool:
+    return msgpack is not None and MSGPACK_MEDIA_TYPE in request.headers.get("accept", "")
+
+def negotiate(request: Request, content: Any) -> Any:
+    """
+    msgpack for clients that accept it, otherwise the content unchanged.
+
+    In the msgpack representation data URLs (images, masks) are raw PNG bytes.
+    """
+    if not wants_msgpack(request):
+        return content
+    if isinstance(content, BaseModel):
+        content = content.model_dump()
+    return MsgpackResponse(data_urls_to_bytes(content))
+
+class GzipCompressor:
+    def __init__(self, level: int = GZIP_LEVEL):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip container
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+class BrotliCompressor:
+    def __init__(self, quality: int = BROTLI_QUALITY):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+COMPRESSORS = {"gzip": GzipCompressor}
+if brotli is not None:
+    COMPRESSORS["br"] = BrotliCompressor
+
+def choose_encoding(accept_encoding: str, encodings: List[str]) -> Optional[str]:
+    """First of our encodings the client accepts (q=0 means refused)"""
+    accepted = set()
+    for item in accept_encoding.lower().split(","):
+        name, *params = item.split(";")
+        quality = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(name.strip())
+    for encoding in encodings:
+        if encoding in COMPRESSORS and (encoding in accepted or "*" in accepted):
+            return encoding
+    return None
+
+class CompressionMiddleware:
+    """
+    gzip/brotli response compression, negotiated from Accept-Encoding.
+
+    Like Starlette's GZipMiddleware, but with brotli, per-encoding levels,
+    and a flush after every chunk of a streamed response so streamed
+    records reach the client as soon as they are produced.
+    """
+
+    def __init__(self, app: ASGIApp, encodings: List[str] = RESPONSE_COMPRESSION, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.encodings = encodings
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http" and self.encodings:
+            encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""), self.encodings)
+            if encoding:
+                await CompressionResponder(self.app, encoding, self.minimum_size)(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+class CompressionResponder:
+    def __init__(self, app: ASGIApp, encoding: str, minimum_size: int):
+        self.app = app
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.send: Optional[Send] = None
+        self.initial_message: Message = {}
+        self.started = False
+        self.passthrough = False
+        self.compressor = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    def _start_compression(self):
+        headers = MutableHeaders(raw=self.initial_message["headers"])
+        headers["Content-Encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        if "etag" in headers and not headers["etag"].startswith("W/"):
+            # The compressed bytes differ from the identity body a strong ETag describes
+            headers["ETag"] = "W/" + headers["etag"]
+        self.compressor = COMPRESSORS[self.encoding]()
+        return headers
+
+    async def send_compressed(self, message: Message):
+        if message["type"] == "http.response.start":
+            # Hold the start message until the body shows whether to compress
+            self.initial_message = message
+            headers = Headers(raw=message["headers"])
+            self.passthrough = (
+                "content-encoding" in headers
+                or headers.get("content-type", "").startswith(UNCOMPRESSED_TYPES)
+            )
+            return
+
+        if message["type"] != "http.response.body":
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.passthrough:
+            if not self.started:
+                self.started = True
+                await self.send(self.initial_message)
+            await self.send(message)
+            return
+
+        if not self.started:
+            self.started = True
+            if len(body) < self.minimum_size and not more_body:
+                await self.send(self.initial_message)
+                await self.send(message)
+                self.passthrough = True
+                return
+
+            headers = self._start_compression()
+            if more_body:
+                del headers["Content-Length"]
+                message["body"] = self.compressor.compress(body) + self.compressor.flush()
+            else:
+                message["body"] = self.compressor.compress(body) + self.compressor.finish()
+                headers["Content-Length"] = str(len(message["body"]))
+            await self.send(self.initial_message)
+            await self.send(message)
+            return
+
+        data = self.compressor.compress(body)
+        message["body"] = data + (self.compressor.flush() if more_body else self.compressor.finish())
+        await self.send(message)
@@ -0,0 +1,296 @@
+"""
+Retention, archival and incremental compaction of stored predictions.
+
+Rows matching a retention policy are written to gzipped NDJSON archive files
+partitioned by creation date, deleted, and the freed pages returned to the
+filesystem with PRAGMA incremental_vacuum. Work is done in small batches,
+each its own short transaction, with pauses that keep maintenance to
+RETENTION_DUTY_CYCLE of the time, so requests are never held up for long.
+
+Usage:
+    python retention.py --dry-run
+    python retention.py --run
+    python retention.py --convert   # once, for databases created before incremental vacuum
+"""
+import argparse
+import fcntl
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+import orjson
+from pydantic import BaseModel
+from sqlalchemy import func, or_
+
+from database import Prediction, SessionLocal, engine, hand_over_image, init_database
+
+logger = logging.getLogger(__name__)
+
+class RetentionPolicy(BaseModel):
+    """Rows older than max_age_days, optionally only of one detect type or only failed ones, expire"""
+    max_age_days: float
+    detect_type: Optional[str] = None
+    failed: Optional[bool] = None  # True: only rows with empty results; False: only rows with results
+    archive: bool = True  # Write expired rows to the archive before deleting them
+
+def load_policies() -> List[RetentionPolicy]:
+    """Policies from the RETENTION_POLICIES JSON env var, e.g. [{"failed": true, "max_age_days": 1}]"""
+    return [RetentionPolicy(**policy) for policy in json.loads(os.getenv("RETENTION_POLICIES", "[]"))]
+
+# Date-partitioned archive files are written here
+RETENTION_ARCHIVE_DIR = os.getenv("RETENTION_ARCHIVE_DIR", "./archive")
+
+# Seconds between maintenance runs
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", "3600"))
+
+# Rows archived and deleted per transaction
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "50"))
+
+# Pages returned to the filesystem per incremental_vacuum step
+RETENTION_VACUUM_PAGES = int(os.getenv("RETENTION_VACUUM_PAGES", "1000"))
+
+# Share of wall time maintenance may spend working; it sleeps in between
+RETENTION_DUTY_CYCLE = float(os.getenv("RETENTION_DUTY_CYCLE", "0.1"))
+
+# Held by the one worker process that runs maintenance when the server has several
+RETENTION_LOCK_PATH = os.getenv("RETENTION_LOCK_PATH", "./retention.lock")
+
+def archive_path(directory: str, created_at: datetime) -> str:
+    return os.path.join(directory, created_at.strftime("%Y"), created_at.strftime("%m"),
+                        f"predictions-{created_at:%Y-%m-%d}.ndjson.gz")
+
+def _record(prediction: Prediction) -> Dict[str, Any]:
+    """Every stored column; image_data is None on rows sharing their parent's image"""
+    return {column.key: getattr(prediction, column.key) for column in Prediction.__table__.columns}
+
+class RetentionManager:
+    """
+    Applies retention policies in the background.
+
+    Rows are archived (appended as gzip members, so earlier data survives an
+    interrupted write) and synced to disk before they are deleted; a crash in
+    between can archive a row twice but never lose it.
+    """
+
+    def __init__(
+        self, policies: Optional[List[RetentionPolicy]] = None, archive_dir: str = RETENTION_ARCHIVE_DIR,
+        interval: float = RETENTION_INTERVAL, batch_size: int = RETENTION_BATCH_SIZE,
+        vacuum_pages: int = RETENTION_VACUUM_PAGES, duty_cycle: float = RETENTION_DUTY_CYCLE,
+        on_deleted: Optional[Callable[[List[int]], None]] = None
+    ):
+        self.policies = load_policies() if policies is None else policies
+        self.archive_dir = archive_dir
+        self.interval = interval
+        self.batch_size = batch_size
+        self.vacuum_pages = vacuum_pages
+        self.duty_cycle = duty_cycle
+        self.on_deleted = on_deleted
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock_file = None
+        self.runs = 0
+        self.last_run: Dict[str, Any] = {}
+
+    def start(self):
+        """Run maintenance every interval on a daemon thread, if there is anything to do"""
+        if not self.policies or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="retention", daemon=True)
+        self._thread.start()
+        logger.info(f"Retention maintenance started with {len(self.policies)} policies")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                if self._lead():
+                    self.run()
+            except Exception as e:
+                logger.error(f"Retention maintenance failed: {e}")
+            self._stop.wait(self.interval)
+
+    def _lead(self) -> bool:
+        """Whether this process runs maintenance; the first worker to lock the file does until it exits"""
+        if self._lock_file is None:
+            self._lock_file = open(RETENTION_LOCK_PATH, "a")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def _pause(self, worked: float):
+        """Sleep long enough that work takes duty_cycle of the time"""
+        self._stop.wait(worked * (1 - self.duty_cycle) / self.duty_cycle)
+
+    def _expired(self, policy: RetentionPolicy, now: datetime):
+        conditions = [Prediction.created_at < now - timedelta(days=policy.max_age_days)]
+        if policy.detect_type:
+            conditions.append(Prediction.detect_type == policy.detect_type)
+        if policy.failed is not None:
+            empty = or_(Prediction.results.is_(None), func.coalesce(func.json_array_length(Prediction.results), 0) == 0)
+            conditions.append(empty if policy.failed else ~empty)
+        return conditions
+
+    def count_expired(self, now: Optional[datetime] = None) -> List[int]:
+        """Rows each policy would remove now"""
+        now = now or datetime.utcnow()
+        db = SessionLocal()
+        try:
+            return [db.query(func.count(Prediction.id)).filter(*self._expired(p, now)).scalar() for p in self.policies]
+        finally:
+            db.close()
+
+    def run(self) -> Dict[str, Any]:
+        """One maintenance pass: expire rows of every policy, then reclaim the freed pages"""
+        init_database()
+        started = time.time()
+        stats = {"started_at": datetime.utcnow(), "archived": 0, "deleted": 0, "archived_bytes": 0, "vacuumed_pages": 0}
+        now = datetime.utcnow()
+        for policy in self.policies:
+            while not self._stop.is_set():
+                step = time.perf_counter()
+                deleted = self._expire_batch(policy, now, stats)
+                self._pause(time.perf_counter() - step)
+                if deleted < self.batch_size:
+                    break
+        while not self._stop.is_set():
+            step = time.perf_counter()
+            freed = self._vacuum_step()
+            stats["vacuumed_pages"] += freed
+            self._pause(time.perf_counter() - step)
+            if freed < self.vacuum_pages:
+                break
+
+        stats["duration"] = time.time() - started
+        stats.update(self.storage_stats())
+        self.runs += 1
+        self.last_run = stats
+        if stats["deleted"]:
+            logger.info(f"Retention removed {stats['deleted']} predictions ({stats['archived']} archived) "
+                        f"and reclaimed {stats['vacuumed_pages']} pages in {stats['duration']:.1f}s")
+        return stats
+
+    def _expire_batch(self, policy: RetentionPolicy, now: datetime, stats: Dict[str, Any]) -> int:
+        db = SessionLocal()
+        try:
+            rows = (
+                db.query(Prediction).filter(*self._expired(policy, now))
+                .order_by(Prediction.id).limit(self.batch_size).all()
+            )
+            if not rows:
+                return 0
+            if policy.archive:
+                stats["archived_bytes"] += self._archive(rows)
+                stats["archived"] += len(rows)
+
+            ids = [row.id for row in rows]
+            changed = []
+            for row in rows:
+                if row.image_data is not None:
+                    # Rows that stay keep the image they share with an expired row
+                    changed += [child.id for child in hand_over_image(db, row, excluded=ids)]
+                db.delete(row)
+            db.commit()
+            stats["deleted"] += len(rows)
+            if self.on_deleted:
+                self.on_deleted(ids + changed)
+            return len(rows)
+        finally:
+            db.close()
+
+    def _archive(self, rows: List[Prediction]) -> int:
+        """Append rows to their day's archive file; returns the compressed bytes written"""
+        partitions: Dict[str, List[bytes]] = {}
+        for row in rows:
+            partitions.setdefault(archive_path(self.archive_dir, row.created_at), []).append(
+                orjson.dumps(_record(row)) + b"\n"
+            )
+        written = 0
+        for path, lines in partitions.items():
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            data = gzip.compress(b"".join(lines), compresslevel=6)
+            with open(path, "ab") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            written += len(data)
+        return written
+
+    def _vacuum_step(self) -> int:
+        """Return up to vacuum_pages free pages to the filesystem; 0 unless auto_vacuum is incremental"""
+        connection = engine.raw_connection()
+        try:
+            if connection.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                return 0
+            before = connection.execute("PRAGMA freelist_count").fetchone()[0]
+            # Each step of the pragma frees one page and execute() steps a statement without result
+            # columns only once; executescript runs it to completion
+            connection.executescript(f"PRAGMA incremental_vacuum({int(self.vacuum_pages)})")
+            return before - connection.execute("PRAGMA freelist_count").fetchone()[0]
+        finally:
+            connection.close()
+
+    def storage_stats(self) -> Dict[str, Any]:
+        with engine.connect() as connection:
+            pragma = lambda name: connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+            page_size = pragma("page_size")
+            return {
+                "auto_vacuum": {0: "none", 1: "full", 2: "incremental"}.get(pragma("auto_vacuum")),
+                "database_bytes": pragma("page_count") * page_size,
+                "free_bytes": pragma("freelist_count") * page_size
+            }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "policies": [policy.model_dump() for policy in self.policies],
+            "archive_dir": self.archive_dir,
+            "running": self._thread is not None,
+            "runs": self.runs,
+            "last_run": self.last_run,
+            **self.storage_stats()
+        }
+
+def convert_to_incremental():
+    """Switch an existing database to incremental auto-vacuum; rewrites the whole file once"""
+    with engine.connect() as connection:
+        connection.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+        connection.exec_driver_sql("VACUUM")
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply retention policies (RETENTION_POLICIES) to predictions.db")
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument("--dry-run", action="store_true", help="Count the rows each policy would remove")
+    action.add_argument("--run", action="store_true", help="Archive, delete and reclaim space once")
+    action.add_argument("--convert", action="store_true", help="Enable incremental vacuum with a one-off full VACUUM")
+    parser.add_argument("--policies", help="Policies as JSON, instead of RETENTION_POLICIES")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.convert:
+        convert_to_incremental()
+        print(RetentionManager(policies=[]).storage_stats())
+        return
+    policies = [RetentionPolicy(**policy) for policy in json.loads(args.policies)] if args.policies else None
+    manager = RetentionManager(policies=policies, duty_cycle=1.0 if args.run else RETENTION_DUTY_CYCLE)
+    if args.dry_run:
+        for policy, count in zip(manager.policies, manager.count_expired()):
+            print(f"{count:>10}  {policy.model_dump()}")
+    else:
+        print(manager.run())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import numpy as np
+import json
+import os
+import random
+import threading
+import logging
+from collections import deque
+from pydantic import BaseModel
+from typing import Any, Deque, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Number of recent calls per model used for latency percentiles and error rate
+ROUTING_WINDOW = int(os.getenv("ROUTING_WINDOW", "100"))
+
+class RouteConfig(BaseModel):
+    """Routing settings for one detection type"""
+    primary: str
+    alternate: Optional[str] = None
+    max_alternate_share: float = 0.5  # Upper bound on traffic shifted to the alternate
+    explore_share: float = 0.05  # Traffic sent to the other model anyway so its stats stay fresh
+    max_error_rate: float = 0.2  # Above this a model is considered unhealthy
+    min_samples: int = 10  # Calls needed before a model's stats are trusted
+    latency_margin: float = 0.8  # Alternate must have p95 below margin * primary p95
+
+class RouteDecision(BaseModel):
+    model_config = {"protected_namespaces": ()}
+
+    model_name: str
+    reason: str
+
+DEFAULT_ROUTES = {
+    "2D bounding boxes": RouteConfig(primary="gemini-2.5-flash", alternate="gemini-2.0-flash"),
+    "Points": RouteConfig(primary="gemini-2.5-flash", alternate="gemini-2.0-flash"),
+    "Segmentation masks": RouteConfig(primary="gemini-2.5-flash", alternate="gemini-2.0-flash"),
+    "3D bounding boxes": RouteConfig(primary="gemini-2.0-flash", alternate="gemini-2.5-flash"),
+}
+
+def load_routes() -> Dict[str, RouteConfig]:
+    """Default routes, overridden per detection type by the MODEL_ROUTING JSON env var"""
+    routes = dict(DEFAULT_ROUTES)
+    overrides = os.getenv("MODEL_ROUTING")
+    if overrides:
+        for detect_type, settings in json.loads(overrides).items():
+            if settings.pop("thinking_budget", None) is not None:
+                # The installed google-generativeai has no thinking config field, so it was never sent
+                logger.warning(f"Ignoring thinking_budget in MODEL_ROUTING for {detect_type}: not supported by the Gemini SDK")
+            base = routes[detect_type].model_dump() if detect_type in routes else {}
+            routes[detect_type] = RouteConfig(**{**base, **settings})
+    return routes
+
+class ModelRouter:
+    """
+    Chooses the model for each request from rolling latency and error stats.
+
+    The primary model is used unless it is unhealthy while the alternate is
+    healthy, or the alternate has been clearly faster at p95; in the latter
+    case at most max_alternate_share of the traffic is shifted.
+    """
+
+    def __init__(self, routes: Optional[Dict[str, RouteConfig]] = None, window: int = ROUTING_WINDOW):
+        self.routes = routes if routes is not None else load_routes()
+        self.window = window
+        self._calls: Dict[str, Deque[Tuple[float, bool]]] = {}
+        self._decisions: Dict[str, Deque[str]] = {}
+        self._lock = threading.Lock()
+
+    def primary_model(self, detect_type: str) -> str:
+        return self._route_for(detect_type).primary
+
+    def _route_for(self, detect_type: str) -> RouteConfig:
+        return self.routes.get(detect_type) or self.routes["2D bounding boxes"]
+
+    def model_stats(self, model_name: str) -> Dict[str, Any]:
+        """Rolling p50/p95 latency (seconds) and error rate of a model"""
+        with self._lock:
+            calls = list(self._calls.get(model_name, ()))
+        if not calls:
+            return {"samples": 0, "p50": None, "p95": None, "error_rate": 0.0}
+
+        latencies = np.array([latency for latency, success in calls if success])
+        errors = sum(1 for _, success in calls if not success)
+        return {
+            "samples": len(calls),
+            "p50": float(np.percentile(latencies, 50)) if len(latencies) else None,
+            "p95": float(np.percentile(latencies, 95)) if len(latencies) else None,
+            "error_rate": errors / len(calls)
+        }
+
+    def route(self, detect_type: str) -> RouteDecision:
+        """Pick the model for one request"""
+        route = self._route_for(detect_type)
+        model_name, reason = route.primary, "primary"
+
+        if route.alternate:
+            primary = self.model_stats(route.primary)
+            alternate = self.model_stats(route.alternate)
+            primary_healthy = primary["samples"] < route.min_samples or primary["error_rate"] <= route.max_error_rate
+            alternate_healthy = alternate["samples"] < route.min_samples or alternate["error_rate"] <= route.max_error_rate
+
+            with self._lock:
+                recent = self._decisions.setdefault(detect_type, deque(maxlen=self.window))
+                alternate_share = recent.count(route.alternate) / len(recent) if recent else 0.0
+
+            if not primary_healthy and alternate_healthy:
+                model_name = route.alternate
+                reason = f"primary error rate {primary['error_rate']:.0%}"
+            elif (
+                alternate["samples"] >= route.min_samples and primary["samples"] >= route.min_samples
+                and alternate_healthy and alternate["p95"] is not None and primary["p95"] is not None
+                and alternate["p95"] < route.latency_margin * primary["p95"]
+                and alternate_share < route.max_alternate_share
+            ):
+                model_name = route.alternate
+                reason = f"alternate p95 {alternate['p95']:.2f}s < primary p95 {primary['p95']:.2f}s"
+
+            # Occasionally send traffic to the other model so a recovered model gets noticed
+            if random.random() < route.explore_share:
+                model_name = route.alternate if model_name == route.primary else route.primary
+                reason = "explore"
+
+            with self._lock:
+                recent.append(model_name)
+
+        if model_name != route.primary:
+            logger.info(f"Routing {detect_type} to {model_name} ({reason})")
+        return RouteDecision(
+            model_name=model_name,
+            reason=reason
+        )
+
+    def record(self, model_name: str, latency: float, success: bool):
+        """Record the outcome of one model call"""
+        with self._lock:
+            self._calls.setdefault(model_name, deque(maxlen=self.window)).append((latency, success))
+
+    def stats(self) -> Dict[str, Any]:
+        """Routing configuration with current per-model stats"""
+        with self._lock:
+            models = list(self._calls)
+            decisions = {
+                detect_type: {model: recent.count(model) for model in set(recent)}
+                for detect_type, recent in self._decisions.items()
+            }
+        return {
+            "routes": {detect_type: route.model_dump() for detect_type, route in self.routes.items()},
+            "models": {model: self.model_stats(model) for model in models},
+            "recent_decisions": decisions
+        }
@@ -0,0 +1,200 @@
+import os
+import re
+from typing import Any, Dict, List, Optional, Sequence
+
+from sqlalchemy import bindparam, inspect, text
+from sqlalchemy.orm import Session
+
+from database import engine
+
+SEARCH_TABLE = "prediction_search"
+
+SEARCH_FIELDS = {
+    "all": None,
+    "labels": "labels",
+    "prompts": "{target_prompt label_prompt}",
+}
+
+SEARCH_SORTS = ("relevance", "recent")
+
+_TOKEN = re.compile(r"\w+")
+
+# Most recent matches ranked by relevance per query; bounds the cost of very common terms
+SEARCH_MAX_CANDIDATES = int(os.getenv("SEARCH_MAX_CANDIDATES", "500"))
+
+# Relevance weight per indexed column: labels, target_prompt, label_prompt
+COLUMN_WEIGHTS = (10.0, 2.0, 1.0)
+TYPICAL_COLUMN_TOKENS = 8
+
+# Detected labels of a row, one entry per detection so frequent labels rank higher
+_LABELS_SQL = (
+    "(SELECT group_concat(json_extract(value, '$.label'), ', ') "
+    "FROM json_each({row}.results) WHERE type = 'object')"
+)
+
+SEARCH_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+        labels, target_prompt, label_prompt,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )""",
+    # Triggers keep the index in step with every insert, update and delete, whichever code path writes
+    f"""CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_insert AFTER INSERT ON predictions BEGIN
+        INSERT INTO {SEARCH_TABLE}(rowid, labels, target_prompt, label_prompt)
+        VALUES (new.id, {_LABELS_SQL.format(row="new")}, new.target_prompt, new.label_prompt);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_update
+        AFTER UPDATE OF results, target_prompt, label_prompt ON predictions BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id;
+        INSERT INTO {SEARCH_TABLE}(rowid, labels, target_prompt, label_prompt)
+        VALUES (new.id, {_LABELS_SQL.format(row="new")}, new.target_prompt, new.label_prompt);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_delete AFTER DELETE ON predictions BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id;
+    END""",
+]
+
+def create_search_index():
+    """Create the FTS5 index and its triggers, indexing existing predictions the first time"""
+    backfill = not inspect(engine).has_table(SEARCH_TABLE)
+    with engine.begin() as connection:
+        for statement in SEARCH_DDL:
+            connection.execute(text(statement))
+        if backfill:
+            connection.execute(text(
+                f"INSERT INTO {SEARCH_TABLE}(rowid, labels, target_prompt, label_prompt) "
+                f"SELECT id, {_LABELS_SQL.format(row='predictions')}, target_prompt, label_prompt FROM predictions"
+            ))
+
+def build_match_query(query: str, field: str = "all", prefix: bool = False) -> Optional[str]:
+    """
+    FTS5 MATCH expression for free text: every word must occur.
+
+    Words are quoted so user input never becomes FTS5 syntax; with prefix
+    the last word also matches longer words, for search-as-you-type. Prefix
+    terms are slower, as they expand to every indexed word they start.
+    """
+    words = _TOKEN.findall(query)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    if prefix:
+        terms[-1] += "*"
+    expression = " ".join(terms)
+    columns = SEARCH_FIELDS[field]
+    return f"{columns} : ({expression})" if columns else expression
+
+def count_labels(labels: Optional[str]) -> Dict[str, int]:
+    """Detections per label from the indexed label list"""
+    counts: Dict[str, int] = {}
+    for label in (labels or "").split(", "):
+        if label:
+            counts[label] = counts.get(label, 0) + 1
+    return counts
+
+def relevance(words: List[str], prefix: bool, columns: Sequence[Optional[str]]) -> float:
+    """
+    Column-weighted, length-normalized frequency of the query words.
+
+    Like bm25 without the inverse document frequency, which needs corpus
+    statistics that cost a full scan of a common term's postings; among
+    rows that all contain every query word it changes little.
+    """
+    score = 0.0
+    exact, last = (words[:-1], words[-1]) if prefix else (words, None)
+    for weight, column in zip(COLUMN_WEIGHTS, columns):
+        if not column:
+            continue
+        tokens = _TOKEN.findall(column.lower())
+        matches = sum(tokens.count(word) for word in exact)
+        if last is not None:
+            matches += sum(1 for token in tokens if token.startswith(last))
+        # bm25 saturation (k1=1.2, b=0.75) against a typical column length
+        score += weight * matches / (matches + 1.2 * (0.25 + 0.75 * len(tokens) / TYPICAL_COLUMN_TOKENS))
+    return score
+
+def _matching_rows(
+    db: Session, match: str, detect_type: Optional[str], limit: int, offset: int = 0, before: Optional[int] = None
+) -> list:
+    """Indexed columns of matching rows, newest first, optionally only those older than the row id before"""
+    # The detect_type index covers this check, so the wide predictions rows are never read
+    type_filter = (
+        "JOIN predictions t INDEXED BY ix_predictions_detect_type ON t.id = s.rowid AND t.detect_type = :detect_type"
+        if detect_type else ""
+    )
+    older = "AND s.rowid < :before" if before is not None else ""
+    return db.execute(text(f"""
+        SELECT s.rowid AS id, s.labels, s.target_prompt, s.label_prompt
+        FROM {SEARCH_TABLE} s {type_filter}
+        WHERE {SEARCH_TABLE} MATCH :match {older}
+        ORDER BY s.rowid DESC
+        LIMIT :limit OFFSET :offset
+    """), {"match": match, "detect_type": detect_type, "before": before, "limit": limit, "offset": offset}).all()
+
+def search_predictions(
+    db: Session, query: str, field: str = "all", detect_type: Optional[str] = None,
+    sort: str = "relevance", limit: int = 20, offset: int = 0, prefix: bool = False
+) -> Dict[str, Any]:
+    """
+    Ranked page of predictions matching a text query.
+
+    Only the search index and the small predictions columns are read.
+    Relevance ranks the SEARCH_MAX_CANDIDATES most recent matches, which
+    keeps queries for common labels bounded however many rows match.
+    When there are more matches than that, truncated is true and the
+    older ones follow the ranked ones, newest first, so paging still
+    reaches every match. Fetching one row more than the page tells
+    whether there are more results without counting every match.
+    """
+    match = build_match_query(query, field, prefix)
+    if match is None:
+        return {"query": query, "results": [], "limit": limit, "offset": offset, "has_more": False, "truncated": False}
+
+    truncated = False
+    if sort == "relevance":
+        candidates = _matching_rows(db, match, detect_type, SEARCH_MAX_CANDIDATES + 1)
+        truncated = len(candidates) > SEARCH_MAX_CANDIDATES
+        candidates = candidates[:SEARCH_MAX_CANDIDATES]
+        words = [word.lower() for word in _TOKEN.findall(query)]
+        searched = {"all": (0, 1, 2), "labels": (0,), "prompts": (1, 2)}[field]
+        scores = {}
+        for row in candidates:
+            columns = [row[1 + i] if i in searched else None for i in range(3)]
+            scores[row.id] = relevance(words, prefix, columns)
+        # Stable sort keeps newer rows first among equal scores
+        page = sorted(candidates, key=lambda row: -scores[row.id])[offset:offset + limit + 1]
+        if truncated and len(page) <= limit:
+            # The page reaches past the ranked window: continue with the older matches
+            page += _matching_rows(
+                db, match, detect_type, limit + 1 - len(page),
+                max(offset - len(candidates), 0), before=candidates[-1].id
+            )
+    else:
+        scores = {}
+        page = _matching_rows(db, match, detect_type, limit + 1, offset)
+
+    details = {}
+    if page:
+        ids = [row.id for row in page]
+        details = {
+            row.id: row for row in db.execute(
+                text(
+                    "SELECT id, image_name, detect_type, target_prompt, label_prompt, created_at "
+                    "FROM predictions WHERE id IN :ids"
+                ).bindparams(bindparam("ids", expanding=True)),
+                {"ids": ids}
+            ).mappings()
+        }
+
+    results = [
+        {**details[row.id], "labels": count_labels(row.labels), "score": scores.get(row.id)}
+        for row in page[:limit] if row.id in details
+    ]
+    return {
+        "query": query,
+        "results": results,
+        "limit": limit,
+        "offset": offset,
+        "has_more": len(page) > limit,
+        # Relevance only ranked the newest SEARCH_MAX_CANDIDATES matches; older ones follow unranked
+        "truncated": truncated
+    }
@@ -0,0 +1,161 @@
+"""
+Frame sequences: multi-frame images and zips of frames, analyzed by keyframe.
+
+Frames are read one at a time. Each is shrunk to a small grayscale
+thumbnail and scored by its mean absolute difference from the last
+keyframe's thumbnail; a frame becomes a keyframe when that difference
+reaches the threshold, or when max_gap frames have passed since the last
+keyframe. Only keyframes are decoded at full size and analyzed, and every
+frame takes the results of a keyframe, so Gemini calls grow with the
+number of scene changes rather than of frames.
+"""
+import io
+import os
+import re
+import zipfile
+import logging
+from typing import IO, Callable, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageSequence, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+# Frames read from one upload at most; later frames are ignored and the response says so
+SEQUENCE_MAX_FRAMES = int(os.getenv("SEQUENCE_MAX_FRAMES", "3000"))
+
+# Keyframes analyzed from one upload at most; reading stops at the next one and the response says so
+SEQUENCE_MAX_KEYFRAMES = int(os.getenv("SEQUENCE_MAX_KEYFRAMES", "100"))
+
+# Uncompressed size of one zipped frame in bytes; larger members are rejected before they are read
+SEQUENCE_MAX_FRAME_BYTES = int(os.getenv("SEQUENCE_MAX_FRAME_BYTES", str(50 * 1024 * 1024)))
+
+# Mean absolute thumbnail difference from the last keyframe (0-1) that makes a frame a keyframe
+SEQUENCE_KEYFRAME_THRESHOLD = float(os.getenv("SEQUENCE_KEYFRAME_THRESHOLD", "0.08"))
+
+# Frames after which a keyframe is taken even without a scene change, so slow drift is re-analyzed; 0 never
+SEQUENCE_MAX_GAP = int(os.getenv("SEQUENCE_MAX_GAP", "60"))
+
+# Keyframes of one request analyzed at once
+SEQUENCE_CONCURRENCY = int(os.getenv("SEQUENCE_CONCURRENCY", "4"))
+
+# Side of the grayscale thumbnails compared; small enough that sensor noise and compression average out
+THUMBNAIL_SIZE = 32
+
+# Which keyframe's results a frame between keyframes takes
+PROPAGATION_MODES = ("previous", "nearest")
+
+FRAME_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif", ".tif", ".tiff")
+
+class Frame:
+    """
+    One frame of a sequence.
+
+    The full image is only decoded by image(); for a multi-frame image it
+    must be called before the next frame is read.
+    """
+
+    def __init__(self, index: int, name: str, open_image: Callable[[], Image.Image]):
+        self.index = index
+        self.name = name
+        self._open_image = open_image
+
+    def thumbnail(self) -> np.ndarray:
+        image = self._open_image()
+        # JPEG frames decode straight at reduced scale; a no-op for other formats
+        image.draft("L", (THUMBNAIL_SIZE * 2, THUMBNAIL_SIZE * 2))
+        thumbnail = image.convert("L").resize((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.Resampling.BOX)
+        return np.asarray(thumbnail, dtype=np.float32) / 255
+
+    def image(self) -> Image.Image:
+        image = self._open_image()
+        image.load()
+        return image
+
+def _natural_key(name: str) -> list:
+    """Sort key putting frame_2 before frame_10"""
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", name)]
+
+def iter_frames(file: IO[bytes], max_frames: int = SEQUENCE_MAX_FRAMES) -> Iterator[Frame]:
+    """
+    Frames of a zip of images (in natural name order) or of a multi-frame
+    image (GIF, TIFF, APNG, WebP; a single image is one frame), at most max_frames.
+
+    Raises:
+        ValueError: the upload is neither a zip nor an image, or a zipped
+            frame is larger than SEQUENCE_MAX_FRAME_BYTES uncompressed
+    """
+    if zipfile.is_zipfile(file):
+        file.seek(0)
+        with zipfile.ZipFile(file) as archive:
+            names = sorted(
+                (name for name in archive.namelist()
+                 if name.lower().endswith(FRAME_EXTENSIONS) and not name.startswith("__MACOSX/")),
+                key=_natural_key
+            )
+            for index, name in enumerate(names[:max_frames]):
+                size = archive.getinfo(name).file_size
+                if size > SEQUENCE_MAX_FRAME_BYTES:
+                    raise ValueError(f"{name} is {size} bytes uncompressed, over the {SEQUENCE_MAX_FRAME_BYTES} byte limit")
+                data = archive.read(name)
+                yield Frame(index, name, lambda data=data: Image.open(io.BytesIO(data)))
+        return
+
+    file.seek(0)
+    try:
+        image = Image.open(file)
+    except UnidentifiedImageError:
+        raise ValueError("not a multi-frame image or a zip of frames")
+    for index, frame in enumerate(ImageSequence.Iterator(image)):
+        if index >= max_frames:
+            return
+        # Copies: later frames of GIFs and APNGs are decoded into the same image
+        yield Frame(index, f"frame {index}", frame.copy)
+
+class FrameInfo(NamedTuple):
+    index: int
+    name: str
+    difference: float  # Mean absolute thumbnail difference from the last keyframe, 0-1
+    keyframe: bool
+
+class KeyframeSelector:
+    """Picks keyframes from thumbnails as frames arrive"""
+
+    def __init__(self, threshold: float = SEQUENCE_KEYFRAME_THRESHOLD, max_gap: int = SEQUENCE_MAX_GAP):
+        self.threshold = threshold
+        self.max_gap = max_gap
+        self._keyframe: Optional[np.ndarray] = None
+        self._since_keyframe = 0
+
+    def offer(self, thumbnail: np.ndarray) -> Tuple[bool, float]:
+        """Whether the frame with this thumbnail is a keyframe, and its difference from the last keyframe"""
+        if self._keyframe is None or self._keyframe.shape != thumbnail.shape:
+            self._keyframe, self._since_keyframe = thumbnail, 0
+            return True, 1.0
+        difference = float(np.abs(thumbnail - self._keyframe).mean())
+        self._since_keyframe += 1
+        if difference >= self.threshold or (self.max_gap and self._since_keyframe >= self.max_gap):
+            self._keyframe, self._since_keyframe = thumbnail, 0
+            return True, difference
+        return False, difference
+
+def select_keyframes(frames: Iterator[Frame], selector: KeyframeSelector) -> Iterator[Tuple[FrameInfo, Optional[Image.Image]]]:
+    """Every frame's info, with its full image for keyframes and None for the rest"""
+    for frame in frames:
+        keyframe, difference = selector.offer(frame.thumbnail())
+        yield FrameInfo(frame.index, frame.name, difference, keyframe), frame.image() if keyframe else None
+
+def assign_keyframes(keyframes: List[int], frame_count: int, mode: str = "previous") -> List[int]:
+    """
+    Index of the keyframe whose results each frame takes: the last keyframe
+    at or before it, or with nearest the closest keyframe either way (ties
+    go to the earlier one). keyframes is sorted and starts at frame 0.
+    """
+    keys = np.asarray(keyframes)
+    frames = np.arange(frame_count)
+    previous = np.searchsorted(keys, frames, side="right") - 1
+    if mode == "previous":
+        return keys[previous].tolist()
+    following = np.minimum(previous + 1, len(keys) - 1)
+    closer = (keys[following] - frames) < (frames - keys[previous])
+    return np.where(closer, keys[following], keys[previous]).tolist()
@@ -0,0 +1,202 @@
+"""
+Cache tier shared by all worker processes on one host.
+
+Entries live in a SQLite file in WAL mode, read through a memory map, so
+every worker sees what any other cached and invalidations apply everywhere.
+Durability is not needed: the file is cleared when the server starts and
+writes are not synced. Put it on tmpfs (/dev/shm) to keep it off the disk.
+"""
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Worker processes; gunicorn and uvicorn read the same variable
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+# Shared cache file; with several workers it defaults to one in /dev/shm (or the temp dir),
+# with one worker caches stay in process memory unless this is set
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH") or (
+    os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "spatial-understanding-cache.db")
+    if WEB_CONCURRENCY > 1 else None
+)
+
+# Total size of cached values across all namespaces; least recently used are evicted first
+SHARED_CACHE_BYTES = int(os.getenv("SHARED_CACHE_BYTES", str(256 * 1024 * 1024)))
+
+# Reads refresh an entry's recency at most this often, so hot entries are not rewritten on every hit
+_TOUCH_INTERVAL = 5.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL,
+    accessed_at REAL NOT NULL,
+    value BLOB NOT NULL,  -- Last, so reading the other columns never walks its overflow pages
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS ix_entries_accessed_at ON entries (accessed_at);
+CREATE TABLE IF NOT EXISTS counters (
+    namespace TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value INTEGER NOT NULL,
+    PRIMARY KEY (namespace, name)
+);
+"""
+
+class SharedCache:
+    """
+    Byte-bounded key/value store in a SQLite file, safe across processes and threads.
+
+    Keys are strings within a namespace, values are bytes. Each thread of
+    each process opens its own connection; connections are never carried
+    across fork.
+    """
+
+    def __init__(self, path: str, max_bytes: int = SHARED_CACHE_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self.connection().executescript(_SCHEMA)
+
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = OFF")
+            connection.execute(f"PRAGMA mmap_size = {self.max_bytes * 2}")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, namespace: str, key: str) -> Optional[bytes]:
+        now = time.time()
+        connection = self.connection()
+        row = connection.execute(
+            "SELECT value, expires_at, accessed_at FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        if row is None or (row[1] is not None and row[1] < now):
+            return None
+        if now - row[2] > _TOUCH_INTERVAL:
+            connection.execute(
+                "UPDATE entries SET accessed_at = ? WHERE namespace = ? AND key = ?", (now, namespace, key)
+            )
+        return row[0]
+
+    def put(self, namespace: str, key: str, value: bytes, ttl: Optional[float] = None) -> bool:
+        """Store a value; values larger than the whole cache are not kept"""
+        if len(value) > self.max_bytes:
+            return False
+        now = time.time()
+        connection = self.connection()
+        with _transaction(connection):
+            previous = connection.execute(
+                "SELECT size FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+            connection.execute(
+                "INSERT OR REPLACE INTO entries (namespace, key, size, expires_at, accessed_at, value) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (namespace, key, len(value), now + ttl if ttl is not None else None, now, value)
+            )
+            # The running total is kept as a counter; summing sizes would read every row
+            total = self._add_bytes(connection, len(value) - (previous[0] if previous else 0))
+            while total > self.max_bytes:
+                oldest = connection.execute(
+                    "SELECT rowid, size FROM entries ORDER BY accessed_at LIMIT 1"
+                ).fetchone()
+                connection.execute("DELETE FROM entries WHERE rowid = ?", (oldest[0],))
+                total = self._add_bytes(connection, -oldest[1])
+                self.increment("", "evictions")
+        return True
+
+    def _add_bytes(self, connection: sqlite3.Connection, amount: int) -> int:
+        self.increment("", "bytes", amount)
+        return connection.execute("SELECT value FROM counters WHERE namespace = '' AND name = 'bytes'").fetchone()[0]
+
+    def touch(self, namespace: str, key: str, ttl: float) -> bool:
+        """Extend an entry's lifetime; False if it no longer exists"""
+        now = time.time()
+        return self.connection().execute(
+            "UPDATE entries SET expires_at = ?, accessed_at = ? "
+            "WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at >= ?)",
+            (now + ttl, now, namespace, key, now)
+        ).rowcount > 0
+
+    def delete(self, namespace: str, *keys: str) -> int:
+        """Remove entries; returns how many existed"""
+        connection = self.connection()
+        deleted = 0
+        with _transaction(connection):
+            for key in keys:
+                row = connection.execute(
+                    "DELETE FROM entries WHERE namespace = ? AND key = ? RETURNING size", (namespace, key)
+                ).fetchone()
+                if row:
+                    self._add_bytes(connection, -row[0])
+                    deleted += 1
+        return deleted
+
+    def increment(self, namespace: str, name: str, amount: int = 1):
+        """Add to a counter kept with the cache, so statistics cover every worker"""
+        if amount:
+            self.connection().execute(
+                "INSERT INTO counters (namespace, name, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (namespace, name) DO UPDATE SET value = value + excluded.value",
+                (namespace, name, amount)
+            )
+
+    def counters(self, namespace: str) -> Dict[str, int]:
+        return dict(self.connection().execute(
+            "SELECT name, value FROM counters WHERE namespace = ?", (namespace,)
+        ).fetchall())
+
+    def usage(self, namespace: str) -> Dict[str, int]:
+        entries, size = self.connection().execute(
+            "SELECT count(*), total(size) FROM entries WHERE namespace = ?", (namespace,)
+        ).fetchone()
+        return {"entries": entries, "bytes": int(size)}
+
+    def clear(self):
+        """Drop everything; done once when the server starts, as the cache may predate changes to the database"""
+        connection = self.connection()
+        with _transaction(connection):
+            # Including tables other caches keep in the same file
+            for (table,) in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall():
+                connection.execute(f'DELETE FROM "{table}"')
+
+    def stats(self) -> Dict[str, Any]:
+        counters = self.counters("")
+        return {
+            "path": self.path,
+            "entries": self.connection().execute("SELECT count(*) FROM entries").fetchone()[0],
+            "bytes": counters.get("bytes", 0),
+            "max_bytes": self.max_bytes,
+            "evictions": counters.get("evictions", 0)
+        }
+
+class _transaction:
+    """BEGIN IMMEDIATE ... COMMIT on an autocommit connection, taking the write lock up front"""
+
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.connection.execute("ROLLBACK" if exc_type else "COMMIT")
+
+def open_shared_cache() -> Optional[SharedCache]:
+    """The host-wide cache, or None when caches stay in process memory"""
+    if not SHARED_CACHE_PATH:
+        return None
+    logger.info(f"Using shared cache {SHARED_CACHE_PATH} ({WEB_CONCURRENCY} workers)")
+    return SharedCache(SHARED_CACHE_PATH)
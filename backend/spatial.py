@@ -0,0 +1,156 @@
+import os
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import Session
+
+from database import engine
+
+DETECTIONS_TABLE = "detections"
+RTREE_TABLE = "detection_boxes"
+
+REGION_MODES = ("intersects", "within")
+
+# Newest detections checked in order before using an index; filters matching more than a
+# page in them are answered without reading (and sorting) every match
+SPATIAL_RECENT_WINDOW = int(os.getenv("SPATIAL_RECENT_WINDOW", "20000"))
+
+# Per-detection values of a stored result; points are zero-size boxes, 3D boxes have no frame position
+_DETECTION_ROWS = """
+    SELECT {row}.id AS prediction_id, {row}.detect_type AS detect_type,
+           json_extract(value, '$.label') AS label,
+           json_extract(value, '$.confidence') AS confidence,
+           coalesce(json_extract(value, '$.x'), json_extract(value, '$.point.x')) AS x,
+           coalesce(json_extract(value, '$.y'), json_extract(value, '$.point.y')) AS y,
+           coalesce(json_extract(value, '$.width'), 0) AS width,
+           coalesce(json_extract(value, '$.height'), 0) AS height
+    FROM {source}json_each({row}.results)
+    WHERE type = 'object' AND coalesce(json_extract(value, '$.x'), json_extract(value, '$.point.x')) IS NOT NULL
+"""
+
+_INSERT_DETECTIONS = (
+    f"INSERT INTO {DETECTIONS_TABLE}(prediction_id, detect_type, label, confidence, x, y, width, height) "
+    "SELECT prediction_id, detect_type, label, confidence, x, y, width, height FROM ({rows})"
+)
+
+SPATIAL_DDL = [
+    f"""CREATE TABLE IF NOT EXISTS {DETECTIONS_TABLE} (
+        id INTEGER PRIMARY KEY,
+        prediction_id INTEGER NOT NULL,
+        detect_type TEXT,
+        label TEXT COLLATE NOCASE,
+        confidence REAL,
+        x REAL NOT NULL,
+        y REAL NOT NULL,
+        width REAL NOT NULL,
+        height REAL NOT NULL
+    )""",
+    f"CREATE INDEX IF NOT EXISTS ix_{DETECTIONS_TABLE}_prediction_id ON {DETECTIONS_TABLE} (prediction_id)",
+    # Entries of one label are in id order, so a label's newest detections are read without sorting
+    f"CREATE INDEX IF NOT EXISTS ix_{DETECTIONS_TABLE}_label ON {DETECTIONS_TABLE} (label)",
+    # Bounding boxes in normalized frame coordinates, keyed by detection id
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {RTREE_TABLE} USING rtree(id, min_x, max_x, min_y, max_y)",
+    f"""CREATE TRIGGER IF NOT EXISTS {DETECTIONS_TABLE}_box_insert AFTER INSERT ON {DETECTIONS_TABLE} BEGIN
+        INSERT INTO {RTREE_TABLE}(id, min_x, max_x, min_y, max_y)
+        VALUES (new.id, new.x, new.x + new.width, new.y, new.y + new.height);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {DETECTIONS_TABLE}_box_delete AFTER DELETE ON {DETECTIONS_TABLE} BEGIN
+        DELETE FROM {RTREE_TABLE} WHERE id = old.id;
+    END""",
+    # Triggers on predictions keep the side table in step with every write, whichever code path writes
+    f"""CREATE TRIGGER IF NOT EXISTS {DETECTIONS_TABLE}_insert AFTER INSERT ON predictions BEGIN
+        {_INSERT_DETECTIONS.format(rows=_DETECTION_ROWS.format(row="new", source=""))};
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {DETECTIONS_TABLE}_update AFTER UPDATE OF results ON predictions BEGIN
+        DELETE FROM {DETECTIONS_TABLE} WHERE prediction_id = old.id;
+        {_INSERT_DETECTIONS.format(rows=_DETECTION_ROWS.format(row="new", source=""))};
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {DETECTIONS_TABLE}_delete AFTER DELETE ON predictions BEGIN
+        DELETE FROM {DETECTIONS_TABLE} WHERE prediction_id = old.id;
+    END""",
+]
+
+def create_spatial_index():
+    """Create the per-detection table, its R*Tree and triggers, filling them from existing predictions the first time"""
+    backfill = not inspect(engine).has_table(DETECTIONS_TABLE)
+    with engine.begin() as connection:
+        for statement in SPATIAL_DDL:
+            connection.execute(text(statement))
+        if backfill:
+            connection.execute(text(_INSERT_DETECTIONS.format(
+                rows=_DETECTION_ROWS.format(row="predictions", source="predictions, ")
+            )))
+
+def query_detections(
+    db: Session, region: Optional[tuple] = None, mode: str = "intersects", label: Optional[str] = None,
+    min_confidence: Optional[float] = None, detect_type: Optional[str] = None, limit: int = 100, offset: int = 0
+) -> Dict[str, Any]:
+    """
+    Stored detections in a region of the frame, newest first.
+
+    Args:
+        region: (x_min, y_min, x_max, y_max) in normalized 0-1 coordinates, or None for the whole frame
+        mode: "intersects" for boxes overlapping the region, "within" for boxes inside it
+        label: Exact label, case-insensitive
+        min_confidence: Lowest confidence; detections without one are excluded
+
+    Only the detections side table and its R*Tree are read, never the
+    predictions payload columns. The newest SPATIAL_RECENT_WINDOW detections
+    are checked first, which answers common filters without an index; rarer
+    ones go to the R*Tree (or the label index) and only their matches are sorted.
+    """
+    conditions = []
+    params: Dict[str, Any] = {"label": label, "min_confidence": min_confidence, "detect_type": detect_type}
+    if region is not None:
+        params.update(zip(("x_min", "y_min", "x_max", "y_max"), region))
+        if mode == "within":
+            conditions += ["d.x >= :x_min", "d.x + d.width <= :x_max", "d.y >= :y_min", "d.y + d.height <= :y_max"]
+        else:
+            conditions += ["d.x + d.width >= :x_min", "d.x <= :x_max", "d.y + d.height >= :y_min", "d.y <= :y_max"]
+    if label:
+        conditions.append("d.label = :label")
+    if min_confidence is not None:
+        conditions.append("d.confidence >= :min_confidence")
+    if detect_type:
+        conditions.append("d.detect_type = :detect_type")
+
+    # Fetching one row more than the page tells whether there are more results without counting them
+    wanted = offset + limit + 1
+    newest = db.execute(text(f"SELECT max(id) FROM {DETECTIONS_TABLE}")).scalar() or 0
+    rows = _select_detections(
+        db, f"{DETECTIONS_TABLE} d", conditions + ["d.id > :floor"],
+        {**params, "floor": newest - SPATIAL_RECENT_WINDOW}, wanted
+    )
+    if len(rows) < wanted and newest > SPATIAL_RECENT_WINDOW:
+        source = f"{DETECTIONS_TABLE} d"
+        index_conditions = []
+        if region is not None:
+            # CROSS JOIN keeps the R*Tree as the outer loop. Its coordinates are 32-bit floats rounded
+            # outwards, so these bounds find a superset of the matches and the exact test runs on d
+            source = f"{RTREE_TABLE} r CROSS JOIN {DETECTIONS_TABLE} d ON d.id = r.id"
+            if mode == "within":
+                index_conditions = [
+                    "r.min_x >= :x_min - 1e-6", "r.max_x <= :x_max + 1e-6",
+                    "r.min_y >= :y_min - 1e-6", "r.max_y <= :y_max + 1e-6"
+                ]
+            else:
+                index_conditions = ["r.max_x >= :x_min", "r.min_x <= :x_max", "r.max_y >= :y_min", "r.min_y <= :y_max"]
+        rows = _select_detections(db, source, index_conditions + conditions, params, wanted)
+
+    page = rows[offset:]
+    return {
+        "detections": [dict(row) for row in page[:limit]],
+        "limit": limit,
+        "offset": offset,
+        "has_more": len(page) > limit
+    }
+
+def _select_detections(db: Session, source: str, conditions: List[str], params: Dict[str, Any], limit: int):
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return db.execute(text(f"""
+        SELECT d.id, d.prediction_id, d.detect_type, d.label, d.confidence, d.x, d.y, d.width, d.height
+        FROM {source}
+        {where}
+        ORDER BY d.id DESC
+        LIMIT :limit
+    """), {**params, "limit": limit}).mappings().all()
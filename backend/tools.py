@@ -1,175 +1,209 @@
-import google.generativeai as genai
-from typing import List, Dict, Any
+import functools
+from typing import List, Dict, Any, Optional
 
-# Tool for 2D bounding box detection
-detect_2d_boxes_tool = genai.protos.FunctionDeclaration(
-    name="detect_2d_bounding_boxes",
-    description="Detect objects in an image and return 2D bounding boxes with labels",
-    parameters=genai.protos.Schema(
-        type=genai.protos.Type.OBJECT,
-        properties={
-            "detections": genai.protos.Schema(
-                type=genai.protos.Type.ARRAY,
-                description="List of detected objects with 2D bounding boxes",
-                items=genai.protos.Schema(
-                    type=genai.protos.Type.OBJECT,
-                    properties={
-                        "box_2d": genai.protos.Schema(
-                            type=genai.protos.Type.ARRAY,
-                            description="2D bounding box coordinates as [ymin, xmin, ymax, xmax] in pixels (0-1000 scale)",
-                            items=genai.protos.Schema(type=genai.protos.Type.NUMBER)
-                        ),
-                        "label": genai.protos.Schema(
-                            type=genai.protos.Type.STRING,
-                            description="Descriptive label for the detected object"
-                        ),
-                        "confidence": genai.protos.Schema(
-                            type=genai.protos.Type.NUMBER,
-                            description="Confidence score between 0 and 1"
-                        )
-                    },
-                    required=["box_2d", "label"]
+from lazy_imports import lazy_import
+
+genai = lazy_import("google.generativeai")
+
+# Detection types supported by the tools and formatters
+DETECT_TYPES = ["2D bounding boxes", "3D bounding boxes", "Segmentation masks", "Points"]
+
+def _function_declarations() -> list:
+    """Function declarations in DETECT_TYPES order"""
+    # Tool for 2D bounding box detection
+    detect_2d_boxes_tool = genai.protos.FunctionDeclaration(
+        name="detect_2d_bounding_boxes",
+        description="Detect objects in an image and return 2D bounding boxes with labels",
+        parameters=genai.protos.Schema(
+            type=genai.protos.Type.OBJECT,
+            properties={
+                "detections": genai.protos.Schema(
+                    type=genai.protos.Type.ARRAY,
+                    description="List of detected objects with 2D bounding boxes",
+                    items=genai.protos.Schema(
+                        type=genai.protos.Type.OBJECT,
+                        properties={
+                            "box_2d": genai.protos.Schema(
+                                type=genai.protos.Type.ARRAY,
+                                description="2D bounding box coordinates as [ymin, xmin, ymax, xmax] in pixels (0-1000 scale)",
+                                items=genai.protos.Schema(type=genai.protos.Type.NUMBER)
+                            ),
+                            "label": genai.protos.Schema(
+                                type=genai.protos.Type.STRING,
+                                description="Descriptive label for the detected object"
+                            ),
+                            "confidence": genai.protos.Schema(
+                                type=genai.protos.Type.NUMBER,
+                                description="Confidence score between 0 and 1"
+                            )
+                        },
+                        required=["box_2d", "label"]
+                    )
                 )
-            )
-        },
-        required=["detections"]
+            },
+            required=["detections"]
+        )
     )
-)
 
-# Tool for 3D bounding box detection
-detect_3d_boxes_tool = genai.protos.FunctionDeclaration(
-    name="detect_3d_bounding_boxes",
-    description="Detect objects in an image and return 3D bounding boxes with spatial information",
-    parameters=genai.protos.Schema(
-        type=genai.protos.Type.OBJECT,
-        properties={
-            "detections": genai.protos.Schema(
-                type=genai.protos.Type.ARRAY,
-                description="List of detected objects with 3D bounding boxes",
-                items=genai.protos.Schema(
-                    type=genai.protos.Type.OBJECT,
-                    properties={
-                        "box_3d": genai.protos.Schema(
-                            type=genai.protos.Type.ARRAY,
-                            description="3D bounding box as [center_x, center_y, center_z, size_x, size_y, size_z, roll, pitch, yaw] where angles are in degrees",
-                            items=genai.protos.Schema(type=genai.protos.Type.NUMBER)
-                        ),
-                        "label": genai.protos.Schema(
-                            type=genai.protos.Type.STRING,
-                            description="Descriptive label for the detected object"
-                        ),
-                        "confidence": genai.protos.Schema(
-                            type=genai.protos.Type.NUMBER,
-                            description="Confidence score between 0 and 1"
-                        )
-                    },
-                    required=["box_3d", "label"]
+    # Tool for 3D bounding box detection
+    detect_3d_boxes_tool = genai.protos.FunctionDeclaration(
+        name="detect_3d_bounding_boxes",
+        description="Detect objects in an image and return 3D bounding boxes with spatial information",
+        parameters=genai.protos.Schema(
+            type=genai.protos.Type.OBJECT,
+            properties={
+                "detections": genai.protos.Schema(
+                    type=genai.protos.Type.ARRAY,
+                    description="List of detected objects with 3D bounding boxes",
+                    items=genai.protos.Schema(
+                        type=genai.protos.Type.OBJECT,
+                        properties={
+                            "box_3d": genai.protos.Schema(
+                                type=genai.protos.Type.ARRAY,
+                                description="3D bounding box as [center_x, center_y, center_z, size_x, size_y, size_z, roll, pitch, yaw] where angles are in degrees",
+                                items=genai.protos.Schema(type=genai.protos.Type.NUMBER)
+                            ),
+                            "label": genai.protos.Schema(
+                                type=genai.protos.Type.STRING,
+                                description="Descriptive label for the detected object"
+                            ),
+                            "confidence": genai.protos.Schema(
+                                type=genai.protos.Type.NUMBER,
+                                description="Confidence score between 0 and 1"
+                            )
+                        },
+                        required=["box_3d", "label"]
+                    )
                 )
-            )
-        },
-        required=["detections"]
+            },
+            required=["detections"]
+        )
     )
-)
 
-# Tool for segmentation masks
-detect_segmentation_tool = genai.protos.FunctionDeclaration(
-    name="detect_segmentation_masks",
-    description="Detect objects in an image and return segmentation polygon coordinates",
-    parameters=genai.protos.Schema(
-        type=genai.protos.Type.OBJECT,
-        properties={
-            "detections": genai.protos.Schema(
-                type=genai.protos.Type.ARRAY,
-                description="List of detected objects with segmentation polygon coordinates",
-                items=genai.protos.Schema(
-                    type=genai.protos.Type.OBJECT,
-                    properties={
-                        "box_2d": genai.protos.Schema(
-                            type=genai.protos.Type.ARRAY,
-                            description="2D bounding box coordinates as [ymin, xmin, ymax, xmax] in pixels (0-1000 scale)",
-                            items=genai.protos.Schema(type=genai.protos.Type.NUMBER)
-                        ),
-                        "polygon": genai.protos.Schema(
-                            type=genai.protos.Type.ARRAY,
-                            description="Segmentation polygon as array of [x, y] coordinate pairs in 0-1000 scale, tracing the object outline",
-                            items=genai.protos.Schema(
+    # Tool for segmentation masks
+    detect_segmentation_tool = genai.protos.FunctionDeclaration(
+        name="detect_segmentation_masks",
+        description="Detect objects in an image and return segmentation polygon coordinates",
+        parameters=genai.protos.Schema(
+            type=genai.protos.Type.OBJECT,
+            properties={
+                "detections": genai.protos.Schema(
+                    type=genai.protos.Type.ARRAY,
+                    description="List of detected objects with segmentation polygon coordinates",
+                    items=genai.protos.Schema(
+                        type=genai.protos.Type.OBJECT,
+                        properties={
+                            "box_2d": genai.protos.Schema(
                                 type=genai.protos.Type.ARRAY,
+                                description="2D bounding box coordinates as [ymin, xmin, ymax, xmax] in pixels (0-1000 scale)",
                                 items=genai.protos.Schema(type=genai.protos.Type.NUMBER)
+                            ),
+                            "polygon": genai.protos.Schema(
+                                type=genai.protos.Type.ARRAY,
+                                description="Segmentation polygon as array of [x, y] coordinate pairs in 0-1000 scale, tracing the object outline",
+                                items=genai.protos.Schema(
+                                    type=genai.protos.Type.ARRAY,
+                                    items=genai.protos.Schema(type=genai.protos.Type.NUMBER)
+                                )
+                            ),
+                            "label": genai.protos.Schema(
+                                type=genai.protos.Type.STRING,
+                                description="Descriptive label for the detected object"
+                            ),
+                            "confidence": genai.protos.Schema(
+                                type=genai.protos.Type.NUMBER,
+                                description="Confidence score between 0 and 1"
                             )
-                        ),
-                        "label": genai.protos.Schema(
-                            type=genai.protos.Type.STRING,
-                            description="Descriptive label for the detected object"
-                        ),
-                        "confidence": genai.protos.Schema(
-                            type=genai.protos.Type.NUMBER,
-                            description="Confidence score between 0 and 1"
-                        )
-                    },
-                    required=["box_2d", "polygon", "label"]
+                        },
+                        required=["box_2d", "polygon", "label"]
+                    )
                 )
-            )
-        },
-        required=["detections"]
+            },
+            required=["detections"]
+        )
     )
-)
 
-# Tool for point detection
-detect_points_tool = genai.protos.FunctionDeclaration(
-    name="detect_key_points",
-    description="Detect key points or landmarks in an image",
-    parameters=genai.protos.Schema(
-        type=genai.protos.Type.OBJECT,
-        properties={
-            "detections": genai.protos.Schema(
-                type=genai.protos.Type.ARRAY,
-                description="List of detected key points",
-                items=genai.protos.Schema(
-                    type=genai.protos.Type.OBJECT,
-                    properties={
-                        "point": genai.protos.Schema(
-                            type=genai.protos.Type.ARRAY,
-                            description="Point coordinates as [y, x] in pixels (0-1000 scale)",
-                            items=genai.protos.Schema(type=genai.protos.Type.NUMBER)
-                        ),
-                        "label": genai.protos.Schema(
-                            type=genai.protos.Type.STRING,
-                            description="Descriptive label for the detected point"
-                        ),
-                        "confidence": genai.protos.Schema(
-                            type=genai.protos.Type.NUMBER,
-                            description="Confidence score between 0 and 1"
-                        )
-                    },
-                    required=["point", "label"]
+    # Tool for point detection
+    detect_points_tool = genai.protos.FunctionDeclaration(
+        name="detect_key_points",
+        description="Detect key points or landmarks in an image",
+        parameters=genai.protos.Schema(
+            type=genai.protos.Type.OBJECT,
+            properties={
+                "detections": genai.protos.Schema(
+                    type=genai.protos.Type.ARRAY,
+                    description="List of detected key points",
+                    items=genai.protos.Schema(
+                        type=genai.protos.Type.OBJECT,
+                        properties={
+                            "point": genai.protos.Schema(
+                                type=genai.protos.Type.ARRAY,
+                                description="Point coordinates as [y, x] in pixels (0-1000 scale)",
+                                items=genai.protos.Schema(type=genai.protos.Type.NUMBER)
+                            ),
+                            "label": genai.protos.Schema(
+                                type=genai.protos.Type.STRING,
+                                description="Descriptive label for the detected point"
+                            ),
+                            "confidence": genai.protos.Schema(
+                                type=genai.protos.Type.NUMBER,
+                                description="Confidence score between 0 and 1"
+                            )
+                        },
+                        required=["point", "label"]
+                    )
                 )
-            )
-        },
-        required=["detections"]
+            },
+            required=["detections"]
+        )
     )
-)
 
-# Create tools for each detection type
-tools_2d = genai.protos.Tool(function_declarations=[detect_2d_boxes_tool])
-tools_3d = genai.protos.Tool(function_declarations=[detect_3d_boxes_tool])
-tools_segmentation = genai.protos.Tool(function_declarations=[detect_segmentation_tool])
-tools_points = genai.protos.Tool(function_declarations=[detect_points_tool])
+    return [detect_2d_boxes_tool, detect_3d_boxes_tool, detect_segmentation_tool, detect_points_tool]
 
-def get_tool_for_detection_type(detect_type: str) -> genai.protos.Tool:
-    """Get the appropriate tool for the detection type"""
-    if detect_type == "2D bounding boxes":
-        return tools_2d
-    elif detect_type == "3D bounding boxes":
-        return tools_3d
-    elif detect_type == "Segmentation masks":
-        return tools_segmentation
-    elif detect_type == "Points":
-        return tools_points
-    else:
+@functools.lru_cache(maxsize=None)
+def build_tools() -> Dict[str, Any]:
+    """One tool per detection type; the protobuf schemas are built on first use rather than at import"""
+    return {
+        detect_type: genai.protos.Tool(function_declarations=[declaration])
+        for detect_type, declaration in zip(DETECT_TYPES, _function_declarations())
+    }
+
+def get_tool_for_detection_type(detect_type: str, max_detections: Optional[int] = None) -> "genai.protos.Tool":
+    """Get the appropriate tool for the detection type, its detections array limited to max_detections items"""
+    tool = build_tools().get(detect_type)
+    if tool is None:
         raise ValueError(f"Unknown detection type: {detect_type}")
+    if max_detections is None:
+        return tool
+    return _capped_tool(detect_type, max_detections)
 
-def get_tool_prompt(detect_type: str, target_prompt: str, label_prompt: str = "", segmentation_language: str = "English") -> str:
-    """Generate a prompt for the tool-based detection"""
+@functools.lru_cache(maxsize=None)
+def _capped_tool(detect_type: str, max_detections: int) -> "genai.protos.Tool":
+    tool = genai.protos.Tool.deserialize(genai.protos.Tool.serialize(build_tools()[detect_type]))
+    detections = tool.function_declarations[0].parameters.properties["detections"]
+    detections.max_items = max_detections
+    detections.description += f", at most {max_detections}, most prominent first"
+    return tool
+
+def get_detection_type_for_function(function_name: str) -> str:
+    """Map a function call name back to its detection type"""
+    for detect_type in DETECT_TYPES:
+        tool = get_tool_for_detection_type(detect_type)
+        if tool.function_declarations[0].name == function_name:
+            return detect_type
+    raise ValueError(f"Unknown detection function: {function_name}")
+
+def get_tool_prompt(
+    detect_type: str, target_prompt: str, label_prompt: str = "", segmentation_language: str = "English",
+    max_detections: Optional[int] = None
+) -> str:
+    """Generate a prompt for the tool-based detection, asking for at most max_detections detections"""
+    prompt = _tool_prompt(detect_type, target_prompt, label_prompt, segmentation_language)
+    if max_detections is not None:
+        prompt += f" Return no more than {max_detections} detections, the most prominent first."
+    return prompt
+
+def _tool_prompt(detect_type: str, target_prompt: str, label_prompt: str, segmentation_language: str) -> str:
     if detect_type == "2D bounding boxes":
         label_instruction = f" Label each detection with {label_prompt}." if label_prompt else " Provide descriptive labels."
         return f"Analyze this image and detect {target_prompt}. You MUST use the detect_2d_bounding_boxes function to return the results.{label_instruction} Call the function with your detections."
@@ -186,4 +220,18 @@ def get_tool_prompt(detect_type: str, target_prompt: str, label_prompt: str = ""
     elif detect_type == "Points":
         return f"Analyze this image and detect key points for {target_prompt}. You MUST use the detect_key_points function to return the results with point coordinates and descriptive labels. Call the function with your detections."
     
-    return f"Analyze this image and detect {target_prompt}." 
\ No newline at end of file
+    return f"Analyze this image and detect {target_prompt}." 
+
+def get_multi_tool_prompt(tasks: List[Dict[str, Any]], segmentation_language: str = "English") -> str:
+    """Generate one prompt asking for a separate function call per task"""
+    instructions = [
+        f"{i + 1}. " + get_tool_prompt(
+            task['detect_type'], task['target_prompt'], task.get('label_prompt', ''), segmentation_language,
+            task.get('max_detections')
+        )
+        for i, task in enumerate(tasks)
+    ]
+    return (
+        f"Analyze this image and complete the following {len(tasks)} detection tasks. "
+        "Call each task's function exactly once, in the same response.\n" + "\n".join(instructions)
+    )
@@ -0,0 +1,61 @@
+import threading
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class Warmup:
+    """
+    Start-up work run in order on a background thread after the server starts listening.
+
+    Every stage is also done on demand by whatever first needs it, so a
+    request that arrives during warm-up is served, only more slowly;
+    readiness tells load balancers when that is no longer the case.
+    """
+
+    def __init__(self, stages: "OrderedDict[str, Callable[[], Any]]"):
+        self.stages = stages
+        self._status: Dict[str, Dict[str, Any]] = {name: {"state": "pending"} for name in stages}
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def start(self):
+        if self._thread is None:
+            self.started_at = time.time()
+            self._thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+            self._thread.start()
+
+    def run(self):
+        for name, stage in self.stages.items():
+            with self._lock:
+                self._status[name] = {"state": "running"}
+            started = time.perf_counter()
+            try:
+                stage()
+                status = {"state": "done", "seconds": round(time.perf_counter() - started, 3)}
+            except Exception as e:
+                logger.error(f"Warm-up stage {name} failed: {e}")
+                status = {"state": "failed", "seconds": round(time.perf_counter() - started, 3), "error": str(e)}
+            with self._lock:
+                self._status[name] = status
+        self.finished_at = time.time()
+        logger.info(f"Warm-up finished in {self.finished_at - self.started_at:.2f}s")
+
+    @property
+    def ready(self) -> bool:
+        with self._lock:
+            return all(status["state"] == "done" for status in self._status.values())
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            stages = {name: dict(status) for name, status in self._status.items()}
+        return {
+            "ready": all(status["state"] == "done" for status in stages.values()),
+            "started_at": self.started_at,
+            "seconds": (self.finished_at or time.time()) - self.started_at if self.started_at else None,
+            "stages": stages
+        }